@@ -1,10 +1,17 @@
-from django.contrib import admin
+import io
+
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import redirect, render
+from django.urls import path
 from .models import (
     Category, UnitOfMeasure, Partner,
     Product, Warehouse, Location,
     InventoryOperation, OperationLine,
-    StockLevel, StockLedgerEntry
+    StockLevel, StockLedgerEntry, ReferenceSequence, ProductStockSummary
 )
+from .forms import ProductImportForm
+from .services import importer, stock
 
 # ================================
 # BASIC MODELS (Simple Admin)
@@ -39,6 +46,40 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ("category", "uom", "is_active")
     search_fields = ("sku", "name")
     list_editable = ("is_active", "min_stock")
+    change_list_template = "admin/core/product/change_list.html"
+
+    def get_urls(self):
+        return [
+            path("import/", self.admin_site.admin_view(self.import_view), name="core_product_import"),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        """Upload a CSV/JSONL file and stream it through the product importer"""
+        # Rows create and overwrite products; opening balances also write adjustments
+        if not (self.has_add_permission(request) and self.has_change_permission(request)):
+            raise PermissionDenied
+        form = ProductImportForm(request.POST or None, request.FILES or None)
+        if request.method == "POST" and form.is_valid():
+            if form.cleaned_data["load_balances"] and not request.user.has_perm("core.add_inventoryoperation"):
+                raise PermissionDenied
+            # utf-8-sig: spreadsheet exports start with a BOM that would stick to the first header
+            upload = io.TextIOWrapper(form.cleaned_data["file"].file, encoding="utf-8-sig", newline="")
+            report = importer.import_products(
+                upload,
+                fmt=form.cleaned_data["format"],
+                load_balances=form.cleaned_data["load_balances"],
+            )
+            self.message_user(
+                request, f"Import finished: {report}", messages.WARNING if report.rejected else messages.SUCCESS
+            )
+            return redirect("admin:core_product_changelist")
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "form": form,
+            "title": "Import products",
+        }
+        return render(request, "admin/core/product/import.html", context)
 
 
 # ================================
@@ -96,6 +137,30 @@ class InventoryOperationAdmin(admin.ModelAdmin):
     ordering = ("-created_at",)
     inlines = [OperationLineInline]
     autocomplete_fields = ("partner", "source_location", "destination_location", "created_by")
+    actions = ["validate_operations"]
+
+    @admin.action(description="Validate selected operations (apply stock)")
+    def validate_operations(self, request, queryset):
+        validated = 0
+        for operation in queryset.order_by("pk"):
+            try:
+                stock.validate_operation(operation)
+                validated += 1
+            except stock.StockMovementError as e:
+                self.message_user(request, f"{operation.reference}: {e}", messages.ERROR)
+        if validated:
+            self.message_user(request, f"{validated} operation(s) validated.", messages.SUCCESS)
+
+
+# ================================
+# REFERENCE SEQUENCES
+# ================================
+
+@admin.register(ReferenceSequence)
+class ReferenceSequenceAdmin(admin.ModelAdmin):
+    list_display = ("warehouse_code", "operation_type", "year", "last_number")
+    list_filter = ("operation_type", "year")
+    search_fields = ("warehouse_code",)
 
 
 # ================================
@@ -110,6 +175,18 @@ class StockLevelAdmin(admin.ModelAdmin):
     ordering = ("product", "location")
 
 
+# ================================
+# STOCK SUMMARY (Dashboard KPIs)
+# ================================
+
+@admin.register(ProductStockSummary)
+class ProductStockSummaryAdmin(admin.ModelAdmin):
+    list_display = ("product", "on_hand", "below_min")
+    list_filter = ("below_min",)
+    search_fields = ("product__sku", "product__name")
+    list_select_related = ("product",)
+
+
 # ================================
 # STOCK LEDGER (Full Move History)
 # ================================
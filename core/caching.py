@@ -0,0 +1,54 @@
+"""
+Versioned caching for stock aggregates.
+
+Cached blocks are keyed by a "stock version": a global one, and one per
+warehouse. Versions live in Django's cache, so every worker process that
+shares the cache backend sees a bump immediately and stops serving the old
+blocks; nothing has to be deleted explicitly. Versions are bumped after
+commit when an operation is saved or validated and when a product,
+warehouse or location changes (see core/signals.py).
+
+The versions live in their own cache (VERSION_CACHE), away from the blocks
+they key: filling the block cache culls entries at random, and a culled
+version would take every block cached under it along.
+"""
+import uuid
+
+from django.core.cache import cache, caches
+from django.db import transaction
+
+STOCK_CACHE_TIMEOUT = 60 * 60
+VERSION_CACHE = "stock_versions"
+
+
+def _version_key(warehouse_id=None):
+    return f"stock-version:wh:{warehouse_id}" if warehouse_id else "stock-version:global"
+
+
+def stock_version(warehouse_id=None):
+    """Current version token, created on first use."""
+    return caches[VERSION_CACHE].get_or_set(_version_key(warehouse_id), lambda: uuid.uuid4().hex, timeout=None)
+
+
+def bump_stock_version(*warehouse_ids):
+    """Invalidate the global blocks and those of the given warehouses once the transaction commits."""
+    keys = [_version_key()] + [_version_key(pk) for pk in set(warehouse_ids) if pk]
+
+    def bump():
+        caches[VERSION_CACHE].set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def cached_block(name, build, warehouse_id=None, timeout=STOCK_CACHE_TIMEOUT):
+    """
+    Return the cached value of `build()` for the current stock version, building
+    and storing it on a miss. `name` must include anything else the value
+    depends on (filters, user id).
+    """
+    key = f"stock-block:{name}:{stock_version(warehouse_id)}"
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, timeout)
+    return value
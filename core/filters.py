@@ -0,0 +1,138 @@
+"""
+Query-string filters shared by the list views and the exports.
+
+Each helper takes a queryset and request.GET and returns
+(filtered queryset, current_filters) so templates can echo the values back.
+Malformed dates raise FilterError, so a view can answer 400 before it starts
+streaming.
+"""
+from datetime import date, datetime, time, timedelta
+
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import Location, OperationLine
+from .search import product_q, search_products
+
+LEDGER_FILTERS = ('date_from', 'date_to', 'product', 'warehouse', 'location', 'doc_type')
+PRODUCT_FILTERS = ('search', 'category', 'status')
+STOCK_LEVEL_FILTERS = ('warehouse', 'location')
+# Matched against integer keys: any other value is dropped rather than sent to the database
+ID_FILTERS = ('product', 'warehouse', 'location', 'category')
+
+
+class FilterError(ValueError):
+    pass
+
+
+def _current(params, names):
+    current = {name: params.get(name, '') for name in names}
+    for name in ID_FILTERS:
+        if name in current and not str(current[name]).isdigit():
+            current[name] = ''
+    return current
+
+
+def _day_start(current, name, days=0):
+    try:
+        day = date.fromisoformat(str(current[name]))
+    except ValueError:
+        raise FilterError(f'{name} must be a date (YYYY-MM-DD).')
+    return timezone.make_aware(datetime.combine(day + timedelta(days=days), time.min))
+
+
+def _created_between(queryset, current):
+    """Filter created_at by date_from / date_to, both inclusive whole days."""
+    if current['date_from']:
+        queryset = queryset.filter(created_at__gte=_day_start(current, 'date_from'))
+    if current['date_to']:
+        queryset = queryset.filter(created_at__lt=_day_start(current, 'date_to', days=1))
+    return queryset
+
+
+def in_warehouse(field, warehouse_id):
+    """Exists() for rows whose location `field` belongs to the warehouse (no join, no DISTINCT)."""
+    return Exists(Location.objects.filter(pk=OuterRef(field), warehouse_id=warehouse_id))
+
+
+def has_product(product_id):
+    """Exists() for operations with a line for the product."""
+    return Exists(OperationLine.objects.filter(operation=OuterRef('pk'), product_id=product_id))
+
+
+def filter_ledger_entries(entries, params):
+    """Apply the move history filters (all on indexed ledger columns)."""
+    current = _current(params, LEDGER_FILTERS)
+    entries = _created_between(entries, current)
+    if current['product']:
+        entries = entries.filter(product_id=current['product'])
+    if current['warehouse']:
+        # Resolve the warehouse to its location ids instead of joining through locations
+        warehouse_locations = Location.objects.filter(warehouse_id=current['warehouse']).values('id')
+        entries = entries.filter(
+            Q(source_location_id__in=warehouse_locations) |
+            Q(destination_location_id__in=warehouse_locations)
+        )
+    if current['location']:
+        entries = entries.filter(
+            Q(source_location_id=current['location']) |
+            Q(destination_location_id=current['location'])
+        )
+    if current['doc_type']:
+        entries = entries.filter(operation__type=current['doc_type'])
+    return entries, current
+
+
+def filter_operations(operations, params):
+    """Apply the move history filters to operations (a product matches through its lines)."""
+    current = _current(params, LEDGER_FILTERS + ('status',))
+    operations = _created_between(operations, current)
+    if current['product']:
+        operations = operations.filter(has_product(current['product']))
+    if current['warehouse']:
+        operations = operations.filter(
+            in_warehouse('source_location_id', current['warehouse']) |
+            in_warehouse('destination_location_id', current['warehouse'])
+        )
+    if current['location']:
+        operations = operations.filter(
+            Q(source_location_id=current['location']) |
+            Q(destination_location_id=current['location'])
+        )
+    if current['doc_type']:
+        operations = operations.filter(type=current['doc_type'])
+    if current['status']:
+        operations = operations.filter(status=current['status'])
+    return operations, current
+
+
+def filter_products(queryset, params, prefix='', rank=False):
+    """
+    Apply the products list filters. prefix lets related querysets reuse them,
+    e.g. filter_products(StockLevel.objects.all(), request.GET, prefix='product__').
+    rank orders a product search by relevance (see core.search).
+    """
+    current = _current(params, PRODUCT_FILTERS)
+    if current['category']:
+        queryset = queryset.filter(**{f'{prefix}category_id': current['category']})
+    if current['status'] == 'active':
+        queryset = queryset.filter(**{f'{prefix}is_active': True})
+    elif current['status'] == 'inactive':
+        queryset = queryset.filter(**{f'{prefix}is_active': False})
+    # Search last: ranking only looks at a window of matches (see core.search)
+    if current['search'] and prefix:
+        queryset = queryset.filter(product_q(current['search'], prefix))
+    elif current['search']:
+        queryset = search_products(queryset, current['search'], rank=rank)
+    return queryset, current
+
+
+def filter_stock_levels(levels, params):
+    """Apply the products list filters to stock levels, plus warehouse / location."""
+    levels, current = filter_products(levels, params, prefix='product__')
+    stock_current = _current(params, STOCK_LEVEL_FILTERS)
+    if stock_current['warehouse']:
+        levels = levels.filter(in_warehouse('location_id', stock_current['warehouse']))
+    if stock_current['location']:
+        levels = levels.filter(location_id=stock_current['location'])
+    return levels, {**current, **stock_current}
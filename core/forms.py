@@ -1,7 +1,49 @@
+import codecs
+import copy
+
 from django import forms
+from django.core.exceptions import ValidationError
 from django.db.models import Q
+from django.urls import reverse
+from django.utils.http import urlencode
 from .models import Product, Category, UnitOfMeasure, InventoryOperation, OperationLine, Partner, Location, Warehouse
 
+class AutocompleteSelect(forms.Select):
+    """
+    Select for large ModelChoiceFields: only the chosen option is rendered and
+    the rest are fetched from a JSON autocomplete endpoint (see
+    templates/core/includes/autocomplete.html). Validation is unchanged.
+    """
+    def __init__(self, url_name, params=None, attrs=None):
+        super().__init__(attrs={'class': 'form-select', **(attrs or {})})
+        self.url_name = url_name
+        self.params = params or {}
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        url = reverse(self.url_name)
+        if self.params:
+            url = f'{url}?{urlencode(self.params)}'
+        context['widget']['attrs']['data-autocomplete-url'] = url
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        field = self.choices.field
+        pk = field.queryset.model._meta.pk
+        selected = []
+        for v in value:
+            try:
+                selected.append(pk.to_python(v))
+            except ValidationError:
+                pass  # tampered value: the form reports it, there is nothing to render
+        selected = [v for v in selected if v]
+        widget = copy.copy(self)
+        widget.choices = [('', field.empty_label or '')] + [
+            (field.prepare_value(obj), field.label_from_instance(obj))
+            for obj in field.queryset.filter(pk__in=selected)
+        ]
+        return forms.Select.optgroups(widget, name, value, attrs)
+
 class CategoryForm(forms.ModelForm):
     class Meta:
         model = Category
@@ -25,8 +67,8 @@ class DeliveryForm(forms.ModelForm):
         model = InventoryOperation
         fields = ['partner', 'source_location', 'scheduled_date', 'notes']
         widgets = {
-            'partner': forms.Select(attrs={'class': 'form-select'}),
-            'source_location': forms.Select(attrs={'class': 'form-select'}),
+            'partner': AutocompleteSelect('core:autocomplete_partners', {'type': 'customer'}),
+            'source_location': AutocompleteSelect('core:autocomplete_locations'),
             'scheduled_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'notes': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
@@ -44,8 +86,8 @@ class InternalTransferForm(forms.ModelForm):
         model = InventoryOperation
         fields = ['source_location', 'destination_location', 'scheduled_date', 'notes']
         widgets = {
-            'source_location': forms.Select(attrs={'class': 'form-select'}),
-            'destination_location': forms.Select(attrs={'class': 'form-select'}),
+            'source_location': AutocompleteSelect('core:autocomplete_locations'),
+            'destination_location': AutocompleteSelect('core:autocomplete_locations'),
             'scheduled_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'notes': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
@@ -55,7 +97,7 @@ class StockAdjustmentForm(forms.ModelForm):
         model = InventoryOperation
         fields = ['source_location', 'scheduled_date', 'notes']
         widgets = {
-            'source_location': forms.Select(attrs={'class': 'form-select'}),
+            'source_location': AutocompleteSelect('core:autocomplete_locations'),
             'scheduled_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'notes': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
@@ -79,8 +121,8 @@ class ReceiptForm(forms.ModelForm):
         model = InventoryOperation
         fields = ['partner', 'destination_location', 'scheduled_date', 'notes']
         widgets = {
-            'partner': forms.Select(attrs={'class': 'form-select'}),
-            'destination_location': forms.Select(attrs={'class': 'form-select'}),
+            'partner': AutocompleteSelect('core:autocomplete_partners', {'type': 'supplier'}),
+            'destination_location': AutocompleteSelect('core:autocomplete_locations'),
             'scheduled_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'notes': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
@@ -133,3 +175,30 @@ class LocationForm(forms.ModelForm):
             'name': forms.TextInput(attrs={'class': 'form-control', 'required': True}),
         }
 
+
+class ProductImportForm(forms.Form):
+    FORMATS = (
+        ('csv', 'CSV'),
+        ('jsonl', 'JSON Lines'),
+    )
+
+    file = forms.FileField()
+    format = forms.ChoiceField(choices=FORMATS, initial='csv')
+    load_balances = forms.BooleanField(
+        required=False,
+        label='Load opening balances',
+        help_text='Rows with location ("WAREHOUSE_CODE/Location name") and quantity set opening stock.',
+    )
+
+    def clean_file(self):
+        """Reject non-UTF-8 files up front, chunk by chunk, instead of failing mid-import."""
+        upload = self.cleaned_data['file']
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            for chunk in upload.chunks():
+                decoder.decode(chunk)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            raise ValidationError('The file is not UTF-8 text; save it as UTF-8 and upload it again.')
+        upload.seek(0)
+        return upload
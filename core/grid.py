@@ -0,0 +1,93 @@
+"""
+Windowed products grid.
+
+The products page loads its rows from a JSON endpoint one window at a time.
+Every sort runs in the database as a keyset page over an index:
+
+    name      product_name_id_idx (name, id)
+    sku       the unique sku index
+    stock     summary_on_hand_idx (on_hand, product) on ProductStockSummary
+    category  product_category_id_idx (category, id), one category at a time
+
+Stock comes from the maintained per-product summary (every product has one,
+see core/signals.py), so no page aggregates StockLevel.
+"""
+from django.db.models import F
+
+from .filters import filter_products
+from .models import Category, Product
+from .pagination import KeysetPage, decode_seek_cursor, encode_seek_cursor, estimated_count, seek_page
+
+GRID_PAGE_SIZE = 100
+MAX_GRID_PAGE_SIZE = 500
+
+SORTS = {
+    'name': 'name',
+    'sku': 'sku',
+    'stock': 'on_hand',
+    'category': None,  # walked category by category, see _category_page()
+}
+
+GRID_FIELDS = (
+    'id', 'sku', 'name', 'category_id', 'category__name', 'uom__abbreviation',
+    'on_hand', 'min_stock', 'cost', 'is_active',
+)
+
+
+def parse_sort(value):
+    """'stock' / '-stock' -> ('stock', descending); unknown keys sort by name."""
+    descending = value.startswith('-')
+    key = value.lstrip('-')
+    if key not in SORTS:
+        return 'name', False
+    return key, descending
+
+
+def products_page(params, page_size=GRID_PAGE_SIZE):
+    """
+    One window of the grid for the query-string params (the products list
+    filters plus sort and after). Returns (page, current_filters, sort).
+    """
+    products, current = filter_products(
+        Product.objects.filter(stock_summary__isnull=False),
+        params,
+    )
+    products = products.annotate(on_hand=F('stock_summary__on_hand')).values(*GRID_FIELDS)
+    key, descending = parse_sort(params.get('sort', 'name'))
+    after = params.get('after')
+    if key == 'category':
+        page = _category_page(products, descending, after, page_size)
+    else:
+        page = seek_page(products, SORTS[key], descending=descending, after=after, page_size=page_size)
+    page.estimated_total = estimated_count(products)
+    return page, current, ('-' if descending else '') + key
+
+
+def _category_page(products, descending, after, page_size):
+    """
+    Sort by category name. Categories are few and their names unique, so
+    instead of sorting the whole catalog on a joined column the page walks
+    categories in name order (uncategorized products last) and reads each
+    one's products in id order from (category, id). The cursor holds the
+    category position and the last product id.
+    """
+    category_ids = list(Category.objects.order_by('-name' if descending else 'name').values_list('id', flat=True))
+    category_ids.append(None)
+    positions = {category_id: i for i, category_id in enumerate(category_ids)}
+    position, last_id = decode_seek_cursor(after) or (0, None)
+    if not isinstance(position, int) or not 0 <= position < len(category_ids):
+        return KeysetPage([])
+
+    rows = []
+    while position < len(category_ids) and len(rows) <= page_size:
+        in_category = products.filter(category_id=category_ids[position])
+        if last_id is not None:
+            in_category = in_category.filter(**{'id__lt' if descending else 'id__gt': last_id})
+        rows.extend(in_category.order_by('-id' if descending else 'id')[:page_size + 1 - len(rows)])
+        position, last_id = position + 1, None
+
+    if len(rows) <= page_size:
+        return KeysetPage(rows)
+    rows = rows[:page_size]
+    last = rows[-1]
+    return KeysetPage(rows, next_cursor=encode_seek_cursor(positions[last['category_id']], last['id']))
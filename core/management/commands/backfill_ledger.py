@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import CostingState, InventoryOperation
+from core.services import snapshots, stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Write StockLedgerEntry rows for DONE operations validated before the ledger "
+        "was populated. Entries are dated with the operation's created_at. Safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Operations per transaction.")
+
+    def handle(self, *args, **options):
+        pending = (
+            InventoryOperation.objects.filter(status="DONE", ledger_entries__isnull=True)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        ids = list(pending.iterator(chunk_size=options["batch_size"]))
+
+        written = skipped = 0
+        earliest = None
+        for start in range(0, len(ids), options["batch_size"]):
+            batch = InventoryOperation.objects.filter(pk__in=ids[start:start + options["batch_size"]])
+            with transaction.atomic():
+                for operation in batch.order_by("pk"):
+                    try:
+                        stock.write_ledger(operation, created_at=operation.created_at)
+                        written += 1
+                        earliest = min(earliest or operation.created_at, operation.created_at)
+                    except stock.MissingLocation:
+                        skipped += 1
+            self.stdout.write(f"{min(start + options['batch_size'], len(ids))}/{len(ids)} operations")
+
+        if earliest is not None:
+            # Entries were dated in the past, so checkpoints taken since then are stale
+            dropped = snapshots.invalidate_from(earliest)
+            if dropped:
+                self.stdout.write(f"Dropped {dropped} stock checkpoint(s); run take_stock_checkpoints.")
+            if CostingState.objects.filter(costed_through__gt=earliest).exists():
+                self.stdout.write(self.style.WARNING("Costing has moved past these entries; run run_costing --rebuild."))
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {written} operation(s), skipped {skipped} without locations."))
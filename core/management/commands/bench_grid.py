@@ -0,0 +1,109 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Case, IntegerField, Sum, Value, When
+from django.http import QueryDict
+
+from core import grid
+from core.models import Category, Product, ProductStockSummary
+from core.search import is_postgres
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the windowed products grid on a synthetic catalog (default 1M products): "
+        "first and deep pages for every sort, against the old annotate(Sum) + distinct list. "
+        "Runs inside a transaction that is rolled back, so no data is kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1_000_000)
+        parser.add_argument("--categories", type=int, default=20)
+        parser.add_argument("--pages", type=int, default=50, help="How far the deep-page case walks")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        if not is_postgres():
+            raise CommandError("bench_grid needs PostgreSQL.")
+        self.repeat = options["repeat"]
+        try:
+            with transaction.atomic():
+                self._load(options["products"], options["categories"])
+                self._run(options["pages"])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _load(self, count, categories):
+        started = time.perf_counter()
+        qn = connection.ops.quote_name
+        category_ids = [Category.objects.create(name=f"Grid bench {i:02d}").pk for i in range(categories)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {qn(Product._meta.db_table)} (sku, name, category_id, min_stock, cost, is_active)
+                SELECT 'GB-' || lpad(i::text, 7, '0'), 'Grid item ' || md5(i::text),
+                       (%s::int[])[1 + i %% %s], 10, 1, i %% 10 <> 0
+                FROM generate_series(1, %s) AS i
+                """,
+                [category_ids, categories, count],
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {qn(ProductStockSummary._meta.db_table)} (product_id, on_hand, below_min)
+                SELECT id, (random() * 500)::int, FALSE FROM {qn(Product._meta.db_table)}
+                WHERE sku LIKE 'GB-%%'
+                """
+            )
+            for model in (Product, ProductStockSummary):
+                cursor.execute(f"ANALYZE {qn(model._meta.db_table)}")
+        self.stdout.write(f"Loaded {count:,} products in {time.perf_counter() - started:.1f}s\n")
+
+    def _time(self, run, repeat=None):
+        timings = []
+        for _ in range(repeat or self.repeat):
+            started = time.perf_counter()
+            rows = run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return rows, statistics.median(timings)
+
+    def _page(self, params):
+        page, _, _ = grid.products_page(QueryDict(params))
+        return page
+
+    def _deep_cursor(self, params, pages):
+        after = None
+        for _ in range(pages):
+            page = self._page(f"{params}&after={after}" if after else params)
+            after = page.next_cursor
+        return after
+
+    def _run(self, pages):
+        self.stdout.write(f"{'query':<40}{'rows':>8}{'ms':>10}")
+        old = Product.objects.select_related("category", "uom").annotate(
+            total_stock=Case(
+                When(stock_levels__quantity__isnull=True, then=Value(0)),
+                default=Sum("stock_levels__quantity"),
+                output_field=IntegerField(),
+            )
+        ).distinct().order_by("-id")
+        # The old page rendered the whole catalog; time the query alone, once
+        rows, ms = self._time(lambda: sum(1 for _ in old.iterator(chunk_size=10_000)), repeat=1)
+        self.stdout.write(f"{'old list (Sum + distinct, every row)':<40}{rows:>8}{ms:>10.1f}")
+
+        for sort in ("name", "-name", "sku", "stock", "-stock", "category", "-category"):
+            for label, params in (
+                (f"sort={sort}", f"sort={sort}"),
+                (f"sort={sort}, status=active", f"sort={sort}&status=active"),
+            ):
+                rows, ms = self._time(lambda: len(self._page(params)))
+                self.stdout.write(f"{label:<40}{rows:>8}{ms:>10.1f}")
+            after = self._deep_cursor(f"sort={sort}", pages)
+            rows, ms = self._time(lambda: len(self._page(f"sort={sort}&after={after}")))
+            self.stdout.write(f"{f'sort={sort}, page {pages + 1}':<40}{rows:>8}{ms:>10.1f}")
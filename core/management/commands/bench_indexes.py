@@ -0,0 +1,185 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from core import views
+from core.models import InventoryOperation, Location, OperationLine, Product, StockLedgerEntry, Warehouse
+from core.pagination import keyset_paginate
+
+# Indexes added for the list / KPI paths (migration 0008); dropped for the "without" run
+HOT_PATH_INDEXES = [
+    "op_type_status_created_idx",
+    "op_type_created_idx",
+    "op_created_id_idx",
+    "op_open_type_status_idx",
+    "product_active_name_idx",
+    "ledger_product_created_idx",
+]
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _scans(plan):
+    """Flatten a JSON plan into 'Node Type [using index] on table' strings for the scan nodes."""
+    found = []
+    if "Scan" in plan["Node Type"]:
+        label = plan["Node Type"]
+        if plan.get("Index Name"):
+            label += f" using {plan['Index Name']}"
+        if plan.get("Relation Name"):
+            label += f" on {plan['Relation Name']}"
+        found.append(label)
+    for child in plan.get("Plans", []):
+        found.extend(_scans(child))
+    return found
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed operations, lines and ledger entries, then EXPLAIN ANALYZE the queries behind the "
+        "operation lists, dashboard KPIs, move history and product pickers, with and without the "
+        "hot-path indexes. Runs inside a transaction that is rolled back, so no data is kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--operations", type=int, default=200_000)
+        parser.add_argument("--products", type=int, default=50_000)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("bench_indexes needs PostgreSQL.")
+        try:
+            with transaction.atomic():
+                product_id = self._seed(options["operations"], options["products"])
+                cases = self._cases(product_id)
+                with_indexes = self._run(cases)
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        for name in HOT_PATH_INDEXES:
+                            cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+                    without_indexes = self._run(cases)
+                    raise _Rollback
+        except _Rollback:
+            pass
+        self._report(with_indexes, without_indexes)
+
+    # -----------------------------------------
+    # Data
+    # -----------------------------------------
+    def _seed(self, operations, products):
+        warehouse = Warehouse.objects.create(name="Index bench", code="BIDX")
+        locations = [Location.objects.create(warehouse=warehouse, name=f"Bin {i}").pk for i in range(4)]
+        qn = connection.ops.quote_name
+        tables = {
+            "product": qn(Product._meta.db_table),
+            "operation": qn(InventoryOperation._meta.db_table),
+            "line": qn(OperationLine._meta.db_table),
+            "ledger": qn(StockLedgerEntry._meta.db_table),
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO {product} (sku, name, min_stock, cost, is_active)
+                SELECT 'BIDX-' || i, 'Bench item ' || i, 10, 1, i %% 10 <> 0
+                FROM generate_series(1, %s) AS i
+                RETURNING id
+                """.format(**tables),
+                [products],
+            )
+            product_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(
+                """
+                INSERT INTO {operation}
+                    (reference, type, status, source_location_id, destination_location_id,
+                     scheduled_date, created_at, notes)
+                SELECT 'BIDX/' || i,
+                       (ARRAY['RECEIPT', 'DELIVERY', 'INTERNAL', 'ADJUST'])[1 + i %% 4],
+                       CASE WHEN random() < 0.9 THEN 'DONE'
+                            ELSE (ARRAY['DRAFT', 'WAITING', 'READY', 'CANCEL'])[1 + (random() * 3)::int] END,
+                       %s, %s, CURRENT_DATE, NOW() - random() * INTERVAL '730 days', ''
+                FROM generate_series(1, %s) AS i
+                """.format(**tables),
+                [locations[0], locations[1], operations],
+            )
+            cursor.execute(
+                """
+                INSERT INTO {line} (operation_id, product_id, quantity)
+                SELECT o.id,
+                       CASE WHEN n = 0 AND o.id %% 4 = 0 THEN %s  -- one fast mover on a quarter of the documents
+                            ELSE %s + ((o.id * 7 + n) %% %s) END,
+                       1 + n
+                FROM {operation} o, generate_series(0, 1) AS n
+                WHERE o.reference LIKE 'BIDX/%%'
+                """.format(**tables),
+                [product_ids[-1], product_ids[0], len(product_ids) - 1],
+            )
+            cursor.execute(
+                """
+                INSERT INTO {ledger}
+                    (operation_id, line_id, product_id, source_location_id, destination_location_id,
+                     quantity_change, created_at)
+                SELECT o.id, l.id, l.product_id, o.source_location_id, o.destination_location_id,
+                       l.quantity, o.created_at
+                FROM {line} l JOIN {operation} o ON o.id = l.operation_id
+                WHERE o.reference LIKE 'BIDX/%%' AND o.status = 'DONE'
+                """.format(**tables),
+            )
+            for table in tables.values():
+                cursor.execute(f"ANALYZE {table}")
+        self.stdout.write(f"Seeded {operations:,} operations and {products:,} products\n")
+        return product_ids[-1]
+
+    def _cases(self, product_id):
+        operations = InventoryOperation.objects.all()
+        return [
+            ("receipts list", lambda: list(operations.filter(type="RECEIPT").order_by("-created_at")[:50])),
+            ("receipts list, status=READY", lambda: list(
+                operations.filter(type="RECEIPT", status="READY").order_by("-created_at")[:50]
+            )),
+            ("dashboard recent operations", lambda: list(operations.order_by("-created_at")[:50])),
+            ("dashboard KPIs", views._dashboard_kpis),
+            ("move history page", lambda: list(keyset_paginate(StockLedgerEntry.objects.all(), page_size=100))),
+            ("fast mover movement history", lambda: list(
+                StockLedgerEntry.objects.filter(product_id=product_id).order_by("-created_at")[:100]
+            )),
+            ("active products by name", lambda: list(
+                Product.objects.filter(is_active=True).order_by("name")[:50]
+            )),
+        ]
+
+    # -----------------------------------------
+    # Measuring
+    # -----------------------------------------
+    def _run(self, cases):
+        """Run every case, then EXPLAIN ANALYZE each SQL statement it issued."""
+        results = {}
+        for label, run in cases:
+            with CaptureQueriesContext(connection) as ctx:
+                run()
+            statements = [q["sql"] for q in ctx.captured_queries if q["sql"].lstrip().upper().startswith("SELECT")]
+            explained = []
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql.replace("%", "%%"))
+                    plan = cursor.fetchone()[0]
+                    plan = json.loads(plan) if isinstance(plan, str) else plan
+                    explained.append((plan[0]["Execution Time"], _scans(plan[0]["Plan"])))
+            results[label] = explained
+        return results
+
+    def _report(self, with_indexes, without_indexes):
+        for label, explained in with_indexes.items():
+            before = sum(ms for ms, _ in without_indexes[label])
+            after = sum(ms for ms, _ in explained)
+            speedup = before / after if after else 0
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{label}: {before:.1f} ms -> {after:.1f} ms ({speedup:.1f}x)"
+            ))
+            for (ms, scans), (old_ms, old_scans) in zip(explained, without_indexes[label]):
+                self.stdout.write(f"    now:    {ms:>8.1f} ms  {'; '.join(scans)}")
+                if old_scans != scans:
+                    self.stdout.write(f"    before: {old_ms:>8.1f} ms  {'; '.join(old_scans)}")
@@ -0,0 +1,87 @@
+import statistics
+import time
+from datetime import datetime, timedelta
+from datetime import time as clock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import InventoryOperation, OperationLine, Product, StockLedgerEntry
+from core.search import is_postgres
+from core.services import replenishment
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the replenishment engine on synthetic delivery history (default 100k products over "
+        "730 days, each delivered on 5% of days). Runs inside a transaction that is rolled back, so no "
+        "data is kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100_000)
+        parser.add_argument("--days", type=int, default=replenishment.HISTORY_DAYS)
+        parser.add_argument("--density", type=float, default=0.05, help="Share of days with a delivery.")
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        if not is_postgres():
+            raise CommandError("bench_replenishment needs PostgreSQL.")
+        try:
+            with transaction.atomic():
+                self._load(options["products"], options["days"], options["density"])
+                self._run(options["days"], options["repeat"])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _load(self, products, days, density):
+        started = time.perf_counter()
+        qn = connection.ops.quote_name
+        first_day = timezone.make_aware(datetime.combine(timezone.localdate() - timedelta(days=days), clock.min))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {qn(Product._meta.db_table)} (sku, name, min_stock, cost, is_active)
+                SELECT 'RB-' || lpad(i::text, 7, '0'), 'Replenishment item ' || i, 0, 1, TRUE
+                FROM generate_series(1, %s) AS i
+                """,
+                [products],
+            )
+            # Every synthetic entry hangs off one delivery and line; only type, product, date and quantity are read
+            operation = InventoryOperation.objects.create(type="DELIVERY", status="DONE")
+            line = OperationLine.objects.create(
+                operation=operation, product=Product.objects.filter(sku__startswith="RB-").first(), quantity=1
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {qn(StockLedgerEntry._meta.db_table)}
+                    (operation_id, line_id, product_id, quantity_change, created_at)
+                SELECT %s, %s, p.id, -(1 + (random() * 20)::int), %s + d * INTERVAL '1 day' + INTERVAL '12 hours'
+                FROM {qn(Product._meta.db_table)} p, generate_series(0, %s - 1) AS d
+                WHERE p.sku LIKE 'RB-%%' AND random() < %s
+                """,
+                [operation.pk, line.pk, first_day, days, density],
+            )
+            cursor.execute(f"ANALYZE {qn(StockLedgerEntry._meta.db_table)}")
+        rows = StockLedgerEntry.objects.filter(operation=operation).count()
+        self.stdout.write(f"Loaded {rows:,} delivery entries in {time.perf_counter() - started:.1f}s")
+
+    def _run(self, days, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            plan = replenishment.compute(days=days)
+            timings.append(time.perf_counter() - started)
+        query = time.perf_counter()
+        replenishment._deliveries(timezone.localdate() - timedelta(days=days), days)
+        query = time.perf_counter() - query
+        self.stdout.write(
+            f"{len(plan['product_id']):,} products, {len(replenishment.suggestions(plan)):,} to reorder: "
+            f"median {statistics.median(timings):.2f}s (delivery query and load {query:.2f}s)"
+        )
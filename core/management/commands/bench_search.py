@@ -0,0 +1,92 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+
+from core.models import InventoryOperation, Product
+from core.search import is_postgres, search_operations, search_products
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark product / operation search on a synthetic catalog (default 1M products): "
+        "trigram index vs. sequential scan, and Exists vs. join + DISTINCT for operations. "
+        "Runs inside a transaction that is rolled back, so no data is kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=1_000_000)
+        parser.add_argument("--terms", nargs="+", default=["BS-0042", "widget 77", "77123", "gear"])
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        if not is_postgres():
+            raise CommandError("bench_search needs PostgreSQL (pg_trgm indexes).")
+        self.repeat = options["repeat"]
+        try:
+            with transaction.atomic():
+                self._load(options["products"])
+                self._run(options["terms"])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _load(self, count):
+        started = time.perf_counter()
+        words = "ARRAY['widget','gear','bolt','valve','panel','cable','sensor','bracket']"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {connection.ops.quote_name(Product._meta.db_table)}
+                    (sku, name, min_stock, cost, is_active)
+                SELECT 'BS-' || lpad(i::text, 7, '0'),
+                       initcap(({words})[1 + i %% 8]) || ' ' || (i %% 997) || ' series ' || i,
+                       0, 1, TRUE
+                FROM generate_series(1, %s) AS i
+                """,
+                [count],
+            )
+            cursor.execute(f"ANALYZE {connection.ops.quote_name(Product._meta.db_table)}")
+        self.stdout.write(f"Loaded {count:,} products in {time.perf_counter() - started:.1f}s\n")
+
+    def _time(self, queryset, seq_scan=False):
+        timings = []
+        with connection.cursor() as cursor:
+            if seq_scan:
+                cursor.execute("SET LOCAL enable_bitmapscan = off")
+                cursor.execute("SET LOCAL enable_indexscan = off")
+            try:
+                for _ in range(self.repeat):
+                    started = time.perf_counter()
+                    rows = len(list(queryset[:50]))
+                    timings.append((time.perf_counter() - started) * 1000)
+            finally:
+                cursor.execute("SET LOCAL enable_bitmapscan = on")
+                cursor.execute("SET LOCAL enable_indexscan = on")
+        return rows, statistics.median(timings)
+
+    def _run(self, terms):
+        self.stdout.write(f"{'query':<34}{'term':<14}{'rows':>6}{'ms':>10}")
+        products = Product.objects.all()
+        operations = InventoryOperation.objects.all()
+        for term in terms:
+            cases = [
+                ("products, seq scan", products.filter(Q(name__icontains=term) | Q(sku__icontains=term)), True),
+                ("products, trigram index", search_products(products, term), False),
+                ("products, trigram index + rank", search_products(products, term, rank=True), False),
+                ("operations, join + distinct", operations.filter(
+                    Q(reference__icontains=term) |
+                    Q(lines__product__sku__icontains=term) |
+                    Q(lines__product__name__icontains=term)
+                ).distinct(), False),
+                ("operations, Exists", search_operations(operations, term), False),
+            ]
+            for label, queryset, seq_scan in cases:
+                rows, ms = self._time(queryset, seq_scan=seq_scan)
+                self.stdout.write(f"{label:<34}{term:<14}{rows:>6}{ms:>10.1f}")
@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from core.models import InventoryOperation, Location, Product, Warehouse
+from core.services import lines, stock
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark creating (save_operation_with_lines) and validating (validate_operation) "
+        "operations: query count and time per operation size. "
+        "Runs inside a transaction that is rolled back, so no data is kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lines", type=int, nargs="+", default=[1, 10, 100, 500, 2000])
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'type':<10}{'lines':>8}{'create q':>10}{'create ms':>11}{'validate q':>12}{'validate ms':>13}"
+        )
+        try:
+            with transaction.atomic():
+                self._run(options["lines"])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, sizes):
+        warehouse = Warehouse.objects.create(name="Bench", code="BENCH")
+        src = Location.objects.create(warehouse=warehouse, name="Bench A")
+        dst = Location.objects.create(warehouse=warehouse, name="Bench B")
+        products = Product.objects.bulk_create(
+            Product(name=f"Bench {i}", sku=f"BENCH-{i:06d}") for i in range(max(sizes))
+        )
+
+        plans = [
+            ("RECEIPT", None, src),
+            ("INTERNAL", src, dst),
+            ("DELIVERY", dst, None),
+            ("ADJUST", src, src),
+        ]
+        for size in sizes:
+            for op_type, source, destination in plans:
+                operation = InventoryOperation(
+                    type=op_type, source_location=source, destination_location=destination,
+                )
+                with CaptureQueriesContext(connection) as create_ctx:
+                    started = time.perf_counter()
+                    lines.save_operation_with_lines(operation, [(p.pk, 1) for p in products[:size]])
+                    create_ms = (time.perf_counter() - started) * 1000
+                with CaptureQueriesContext(connection) as validate_ctx:
+                    started = time.perf_counter()
+                    stock.validate_operation(operation)
+                    validate_ms = (time.perf_counter() - started) * 1000
+                self.stdout.write(
+                    f"{op_type:<10}{size:>8}{len(create_ctx.captured_queries):>10}{create_ms:>11.1f}"
+                    f"{len(validate_ctx.captured_queries):>12}{validate_ms:>13.1f}"
+                )
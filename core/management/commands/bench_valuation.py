@@ -0,0 +1,97 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core.models import Category, Location, Product, StockLevel, StockValuationCell, Warehouse
+from core.search import is_postgres
+from core.services import valuation
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the inventory valuation query on synthetic stock (default 1M stock rows: "
+        "200k products in 5 locations over 2 warehouses). Runs inside a transaction that is "
+        "rolled back, so no data is kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=200_000)
+        parser.add_argument("--locations", type=int, default=5)
+        parser.add_argument("--categories", type=int, default=20)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--explain", action="store_true", help="Print the plan of the unfiltered query.")
+
+    def handle(self, *args, **options):
+        if not is_postgres():
+            raise CommandError("bench_valuation needs PostgreSQL.")
+        try:
+            with transaction.atomic():
+                self._load(options["products"], options["locations"], options["categories"])
+                self._run(options["repeat"])
+                if options["explain"]:
+                    self._explain()
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _load(self, products, locations, categories):
+        started = time.perf_counter()
+        qn = connection.ops.quote_name
+        category_ids = [Category.objects.create(name=f"Valuation bench {i:02d}").pk for i in range(categories)]
+        warehouses = [Warehouse.objects.create(name=f"Valuation bench {i}", code=f"VB{i}") for i in range(2)]
+        location_ids = [
+            Location.objects.create(warehouse=warehouses[i % 2], name=f"Bench {i}").pk for i in range(locations)
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {qn(Product._meta.db_table)} (sku, name, category_id, min_stock, cost, is_active)
+                SELECT 'VB-' || lpad(i::text, 7, '0'), 'Valuation item ' || i,
+                       (%s::int[])[1 + i %% %s], 0, (random() * 100)::numeric(10, 2), TRUE
+                FROM generate_series(1, %s) AS i
+                """,
+                [category_ids, categories, products],
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {qn(StockLevel._meta.db_table)} (product_id, location_id, quantity)
+                SELECT p.id, l, (random() * 500)::int + 1
+                FROM {qn(Product._meta.db_table)} p, unnest(%s::int[]) AS l
+                WHERE p.sku LIKE 'VB-%%'
+                """,
+                [location_ids],
+            )
+            for model in (Product, StockLevel):
+                cursor.execute(f"ANALYZE {qn(model._meta.db_table)}")
+        rows = StockLevel.objects.count()
+        self.stdout.write(f"Loaded {rows:,} stock rows in {time.perf_counter() - started:.1f}s")
+        # Loaded behind the engine's back, so the cells are rebuilt as rebuild_stock_summary would
+        started = time.perf_counter()
+        StockValuationCell.refresh()
+        self.stdout.write(f"Rebuilt the valuation cells in {time.perf_counter() - started:.1f}s\n")
+
+    def _run(self, repeat):
+        cases = [
+            ("all warehouses", {}),
+            ("one warehouse", {"warehouse_id": Warehouse.objects.get(code="VB0").pk}),
+            ("one category", {"category_id": Category.objects.get(name="Valuation bench 00").pk}),
+        ]
+        for label, filters in cases:
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                rows = valuation._query(**filters)
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(f"{label:<16} {len(rows):>4} rows  median {statistics.median(timings):7.1f} ms")
+
+    def _explain(self):
+        sql, params = valuation._sql()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+            self.stdout.write("\n".join(row[0] for row in cursor.fetchall()))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from core.services import chat_router
+
+
+class Command(BaseCommand):
+    help = "Show how many chatbot messages the local intent router answered, per intent, and the hit rate."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Clear the counters after printing them.")
+
+    def handle(self, *args, **options):
+        stats = chat_router.stats()
+        for intent, hits in stats["by_intent"].items():
+            self.stdout.write(f"{intent:<20}{hits:>8}")
+        self.stdout.write(f"{'fallback (model)':<20}{stats['fallbacks']:>8}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Answered locally: {stats['hits']} of {stats['total']} ({stats['hit_rate']:.0%})"
+        ))
+        if options["reset"]:
+            chat_router.reset_stats()
+            self.stdout.write("Counters reset.")
@@ -0,0 +1,57 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.services import importer
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream products from CSV or JSON Lines and upsert them by sku. Columns: sku, name, "
+        "category, uom, min_stock, cost, is_active, and with --balances also location "
+        '("WAREHOUSE_CODE/Location name") and quantity for opening stock.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, or - for stdin.")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--balances", action="store_true", help="Also load opening StockLevel balances.")
+        parser.add_argument("--rejects", help="Write rejected rows (line, reason, record) to this CSV file.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+
+        rejects_file = open(options["rejects"], "w", newline="", encoding="utf-8") if options["rejects"] else None
+        rejects = csv.writer(rejects_file) if rejects_file else None
+
+        def on_reject(line_number, record, reason):
+            if rejects:
+                rejects.writerow([line_number, reason, record])
+            elif options["verbosity"] > 1:
+                self.stderr.write(f"line {line_number}: {reason}")
+
+        def on_batch(report):
+            self.stdout.write(f"{report.rows} rows ({report.rows_per_second:,.0f} rows/s), {report.rejected} rejected")
+
+        stream = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        try:
+            report = importer.import_products(
+                stream,
+                fmt=fmt,
+                batch_size=options["batch_size"],
+                load_balances=options["balances"],
+                on_reject=on_reject,
+                on_batch=on_batch,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if rejects_file:
+                rejects_file.close()
+
+        self.stdout.write(self.style.SUCCESS(str(report)))
@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from core.models import Product, ProductStockSummary, StockLevel, StockValuationCell
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild ProductStockSummary and StockValuationCell from StockLevel, "
+        "or with --check report rows that disagree."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="Only compare; exit non-zero on mismatches.")
+
+    def handle(self, *args, **options):
+        if options["check"]:
+            self._check()
+            return
+        with transaction.atomic():
+            StockValuationCell.refresh()
+            ProductStockSummary.refresh()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {ProductStockSummary.objects.count()} summaries "
+            f"and {StockValuationCell.objects.count()} valuation cells."
+        ))
+
+    def _check(self):
+        count = self._check_summaries() + self._check_cells()
+        if count:
+            raise CommandError(f"{count} summaries do not match StockLevel. Run rebuild_stock_summary.")
+        self.stdout.write(self.style.SUCCESS("Product summaries and valuation cells match StockLevel."))
+
+    def _check_cells(self):
+        expected = {
+            (cell["location_id"], cell["product__category_id"]): (cell["lines"], cell["total"], cell["value"])
+            for cell in StockLevel.objects.values("location_id", "product__category_id").annotate(
+                lines=Count("pk", filter=~Q(quantity=0)),
+                total=Sum("quantity"),
+                value=Sum(F("quantity") * F("product__cost"), output_field=DecimalField()),
+            ).order_by()
+        }
+        recorded = {
+            (location_id, category_id): (lines, quantity, value)
+            for location_id, category_id, lines, quantity, value in StockValuationCell.objects.values_list(
+                "location_id", "category_id", "lines", "quantity", "value"
+            )
+        }
+        count = 0
+        for key in sorted(expected.keys() | recorded.keys(), key=str):
+            empty = (0, 0, 0)
+            if expected.get(key, empty) != recorded.get(key, empty):
+                count += 1
+                self.stdout.write(
+                    f"Location {key[0]}, category {key[1]}: StockLevel (lines, quantity, value) "
+                    f"{expected.get(key, empty)}, valuation cell {recorded.get(key, empty)}"
+                )
+        return count
+
+    def _check_summaries(self):
+        on_hand = (
+            StockLevel.objects.filter(product=OuterRef("pk"))
+            .values("product")
+            .annotate(total=Sum("quantity"))
+            .values("total")
+        )
+        mismatches = (
+            Product.objects.annotate(
+                expected=Coalesce(Subquery(on_hand, output_field=IntegerField()), Value(0)),
+            )
+            .filter(
+                Q(stock_summary__isnull=True)
+                | ~Q(stock_summary__on_hand=F("expected"))
+                | ~Q(stock_summary__below_min=Q(expected__lt=F("min_stock")))
+            )
+            .values_list("sku", "expected", "stock_summary__on_hand")
+        )
+
+        count = 0
+        for sku, expected, recorded in mismatches.iterator():
+            count += 1
+            self.stdout.write(f"{sku}: StockLevel total {expected}, summary {recorded}")
+        return count
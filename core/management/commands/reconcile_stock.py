@@ -0,0 +1,89 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from core.models import ProductStockSummary, Warehouse
+from core.services import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare StockLevel with the balances implied by the stock ledger, one warehouse per worker process. "
+        "Incremental by default: only products moved since the last clean run are checked. "
+        "Exits non-zero when mismatches are left unrepaired."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repair", action="store_true", help="Set mismatched StockLevel rows to the ledger balance.")
+        parser.add_argument(
+            "--rebuild", action="store_true", help="Regenerate StockLevel from the ledger for every warehouse."
+        )
+        parser.add_argument("--full", action="store_true", help="Check every balance, not just recently moved products.")
+        parser.add_argument("--warehouse", action="append", default=[], help="Warehouse code; repeat for several.")
+        parser.add_argument("--workers", type=int, default=4, help="Worker processes (1 runs in this process).")
+
+    def handle(self, *args, **options):
+        if options["repair"] and options["rebuild"]:
+            raise CommandError("Use either --repair or --rebuild.")
+        mode = reconcile.REBUILD if options["rebuild"] else reconcile.REPAIR if options["repair"] else reconcile.CHECK
+
+        warehouses = Warehouse.objects.order_by("code")
+        if options["warehouse"]:
+            warehouses = warehouses.filter(code__in=options["warehouse"])
+        warehouse_ids = list(warehouses.values_list("pk", flat=True))
+        if not warehouse_ids:
+            raise CommandError("No warehouses to reconcile.")
+
+        workers = max(1, min(options["workers"], len(warehouse_ids)))
+        if workers == 1:
+            results = [reconcile.reconcile_warehouse(pk, mode, options["full"]) for pk in warehouse_ids]
+        else:
+            # Spawned workers set Django up themselves and open their own connections
+            connections.close_all()
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(workers, mp_context=context, initializer=django.setup) as pool:
+                results = list(pool.map(
+                    reconcile.reconcile_warehouse, warehouse_ids,
+                    [mode] * len(warehouse_ids), [options["full"]] * len(warehouse_ids),
+                ))
+
+        if mode == reconcile.REBUILD:
+            with transaction.atomic():
+                ProductStockSummary.refresh()
+
+        unresolved = negative = errors = 0
+        for result in results:
+            self._report(result)
+            if "error" in result:
+                errors += 1
+            elif not result["fixed"]:
+                unresolved += result["mismatches"]
+            else:
+                negative += result["negative"]  # left alone by a repair
+
+        if errors:
+            raise CommandError(f"{errors} warehouse(s) changed while being checked; run the command again.")
+        if unresolved:
+            raise CommandError(f"{unresolved} stock level(s) do not match the ledger. Run with --repair to fix them.")
+        if negative:
+            raise CommandError(f"{negative} ledger balance(s) are negative; post an adjustment to correct them.")
+        self.stdout.write(self.style.SUCCESS("Stock levels match the ledger."))
+
+    def _report(self, result):
+        line = f"{result['warehouse']}: {result['checked']} balances checked, {result['mismatches']} mismatched"
+        if result["fixed"]:
+            line += " (fixed)"
+        self.stdout.write(line)
+        for sku, location, recorded, expected in result["sample"]:
+            self.stdout.write(f"  {sku} @ {location}: StockLevel {recorded}, ledger {expected}")
+        if result["mismatches"] > len(result["sample"]):
+            self.stdout.write(f"  ...and {result['mismatches'] - len(result['sample'])} more")
+        if result["negative"]:
+            self.stdout.write(self.style.WARNING(
+                f"  {result['negative']} ledger balance(s) are negative; post an adjustment to correct them."
+            ))
+        if "error" in result:
+            self.stdout.write(self.style.ERROR(f"  aborted: {result['error']}"))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.services import costing
+
+
+class Command(BaseCommand):
+    help = (
+        "Cost the stock ledger by FIFO and/or weighted average: cost of goods delivered per product and month "
+        "(PeriodCost) and the closing cost layers (CostLayer). Incremental, and an interrupted run resumes "
+        "from its last committed segment. Run it from cron after the daily checkpoints."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--method", action="append", choices=costing.METHODS, default=[],
+            help="Costing method; repeat for both (default: both).",
+        )
+        parser.add_argument("--rebuild", action="store_true", help="Discard what was costed and replay the whole ledger.")
+
+    def handle(self, *args, **options):
+        for method in options["method"] or costing.METHODS:
+            if options["rebuild"]:
+                costing.reset(method)
+            started = time.perf_counter()
+            try:
+                result = costing.run(method)
+            except costing.CostingError as e:
+                raise CommandError(str(e))
+            line = (
+                f"{method}: {result['entries']} ledger entries for {result['products']} products "
+                f"in {result['segments']} segment(s), {time.perf_counter() - started:.1f}s"
+            )
+            if result["resumed"]:
+                line += " (resumed)"
+            self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS("Costing is up to date."))
@@ -0,0 +1,103 @@
+import random
+import threading
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+
+from core.models import InventoryOperation, Location, OperationLine, Product, StockLevel, Warehouse
+from core.services import stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Validate many deliveries and transfers against the same SKUs from concurrent "
+        "threads and check that stock never goes negative and no validation deadlocks. "
+        "Creates its own warehouse and products and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=50)
+        parser.add_argument("--products", type=int, default=5)
+        parser.add_argument("--stock", type=int, default=60, help="Opening quantity per product.")
+        parser.add_argument("--quantity", type=int, default=3, help="Quantity per line.")
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8].upper()
+        warehouse = Warehouse.objects.create(name=f"Stress {tag}", code=f"ST{tag}")
+        try:
+            self._run(warehouse, tag, options)
+        finally:
+            InventoryOperation.objects.filter(lines__product__sku__startswith=f"ST-{tag}-").delete()
+            Product.objects.filter(sku__startswith=f"ST-{tag}-").delete()
+            warehouse.delete()
+
+    def _run(self, warehouse, tag, options):
+        shelf = Location.objects.create(warehouse=warehouse, name="Shelf")
+        overflow = Location.objects.create(warehouse=warehouse, name="Overflow")
+        products = Product.objects.bulk_create(
+            Product(name=f"Stress {i}", sku=f"ST-{tag}-{i}") for i in range(options["products"])
+        )
+        StockLevel.objects.bulk_create(
+            StockLevel(product=p, location=shelf, quantity=options["stock"]) for p in products
+        )
+
+        # Every operation takes from the shelf; lines are shuffled so rows are
+        # requested in a different order by each worker.
+        operations = []
+        for i in range(options["workers"]):
+            op_type = "INTERNAL" if i % 3 == 0 else "DELIVERY"
+            operation = InventoryOperation.objects.create(
+                type=op_type,
+                source_location=shelf,
+                destination_location=overflow if op_type == "INTERNAL" else None,
+            )
+            lines = [OperationLine(operation=operation, product=p, quantity=options["quantity"]) for p in products]
+            random.shuffle(lines)
+            OperationLine.objects.bulk_create(lines)
+            operations.append(operation)
+
+        results = {"validated": 0, "insufficient": 0, "deadlocks": 0, "errors": 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(len(operations))
+
+        def worker(operation):
+            outcome = "validated"
+            try:
+                barrier.wait()
+                stock.validate_operation(operation)
+            except stock.InsufficientStock:
+                outcome = "insufficient"
+            except DatabaseError as e:
+                outcome = "deadlocks" if getattr(e.__cause__, "pgcode", None) == "40P01" else "errors"
+            finally:
+                connection.close()
+            with lock:
+                results[outcome] += 1
+
+        threads = [threading.Thread(target=worker, args=(op,)) for op in operations]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        delivered = InventoryOperation.objects.filter(
+            pk__in=[op.pk for op in operations], type="DELIVERY", status="DONE"
+        ).count()
+        moved = results["validated"] - delivered
+        expected_shelf = options["stock"] - results["validated"] * options["quantity"]
+        expected_overflow = moved * options["quantity"]
+        negative = StockLevel.objects.filter(location__warehouse=warehouse, quantity__lt=0).count()
+        mismatched = (
+            StockLevel.objects.filter(location=shelf).exclude(quantity=expected_shelf).count()
+            + StockLevel.objects.filter(location=overflow).exclude(quantity=expected_overflow).count()
+        )
+
+        self.stdout.write(
+            f"workers={len(operations)} validated={results['validated']} "
+            f"insufficient={results['insufficient']} deadlocks={results['deadlocks']} "
+            f"errors={results['errors']} negative_rows={negative} mismatched_rows={mismatched}"
+        )
+        if negative or mismatched or results["deadlocks"] or results["errors"]:
+            raise CommandError("Stock locking stress test failed.")
+        self.stdout.write(self.style.SUCCESS("OK"))
@@ -0,0 +1,82 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Location, Product
+from core.services import replenishment
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute reorder points from delivery history for every active product and list the products to "
+        "reorder. Optionally create DRAFT receipts grouped by supplier and store the reorder points as min_stock."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=replenishment.HISTORY_DAYS, help="Days of delivery history.")
+        parser.add_argument(
+            "--lead-time", type=int, default=replenishment.LEAD_TIME_DAYS, help="Supplier lead time in days."
+        )
+        parser.add_argument(
+            "--review-days", type=int, default=replenishment.REVIEW_DAYS, help="Days between replenishment runs."
+        )
+        parser.add_argument(
+            "--service-level", type=float, default=replenishment.SERVICE_LEVEL,
+            help="Chance of not running out during the lead time, e.g. 0.95.",
+        )
+        parser.add_argument("--show", type=int, default=20, help="Suggestions to print.")
+        parser.add_argument("--create-receipts", action="store_true", help="Create DRAFT receipts for the suggestions.")
+        parser.add_argument(
+            "--destination", metavar="WAREHOUSE_CODE/Location name",
+            help="Where receipts for products never received before go; without it those products are skipped.",
+        )
+        parser.add_argument(
+            "--update-min-stock", action="store_true", help="Store the reorder points as Product.min_stock."
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] < 1 or options["lead_time"] < 1 or options["review_days"] < 0:
+            raise CommandError("--days and --lead-time must be positive and --review-days not negative.")
+        if not 0 < options["service_level"] < 1:
+            raise CommandError("--service-level must be between 0 and 1.")
+
+        destination = None
+        if options["destination"]:
+            code, _, name = options["destination"].partition("/")
+            destination = Location.objects.filter(warehouse__code=code, name=name).first()
+            if destination is None:
+                raise CommandError(f"Unknown location {options['destination']!r}; use WAREHOUSE_CODE/Location name.")
+
+        started = time.perf_counter()
+        plan = replenishment.compute(
+            days=options["days"], lead_time=options["lead_time"],
+            review_days=options["review_days"], service_level=options["service_level"],
+        )
+        rows = replenishment.suggestions(plan)
+        self.stdout.write(
+            f"{len(plan['product_id'])} products, {len(rows)} to reorder ({time.perf_counter() - started:.1f}s)"
+        )
+
+        shown = rows[:options["show"]]
+        skus = dict(Product.objects.filter(pk__in=[row["product_id"] for row in shown]).values_list("pk", "sku"))
+        for row in shown:
+            self.stdout.write(
+                f"  {skus[row['product_id']]}: on hand {row['on_hand']} + incoming {row['incoming']}, "
+                f"reorder point {row['reorder_point']} ({row['daily_demand']:.2f}/day), order {row['order_quantity']}"
+            )
+        if len(rows) > options["show"]:
+            self.stdout.write(f"  ...and {len(rows) - options['show']} more")
+
+        if options["update_min_stock"]:
+            self.stdout.write(f"Updated min_stock of {replenishment.update_min_stock(plan)} product(s).")
+        if options["create_receipts"] and rows:
+            receipts, skipped = replenishment.create_receipts(rows, destination=destination)
+            for receipt in receipts:
+                self.stdout.write(f"  {receipt.reference}: {receipt.partner or 'no supplier'}")
+            self.stdout.write(self.style.SUCCESS(f"Created {len(receipts)} draft receipt(s)."))
+            if skipped:
+                skus = Product.objects.filter(pk__in=[row["product_id"] for row in skipped]).order_by("sku")
+                self.stdout.write(self.style.WARNING(
+                    f"Skipped {len(skipped)} product(s) never received before (pass --destination to order them): "
+                    + ", ".join(skus.values_list("sku", flat=True)[:options["show"]])
+                ))
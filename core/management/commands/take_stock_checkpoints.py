@@ -0,0 +1,40 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import StockCheckpoint
+from core.services import snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Take the daily closing-balance checkpoints that are due (one per local midnight since the "
+        "latest checkpoint, or since the first ledger entry). Run it from cron shortly after midnight."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--day", help="Take (or retake) the closing balance of one day, YYYY-MM-DD.")
+        parser.add_argument("--rebuild", action="store_true", help="Delete every checkpoint and take them again.")
+
+    def handle(self, *args, **options):
+        if options["day"]:
+            try:
+                day = date.fromisoformat(options["day"])
+            except ValueError:
+                raise CommandError("--day must be a date as YYYY-MM-DD.")
+            taken_at = snapshots.day_end(day)
+            if taken_at + snapshots.SETTLE_DELAY > timezone.now():
+                raise CommandError(f"{day} has not closed yet.")
+            # Later checkpoints were built on this one, so they go too and are retaken below
+            StockCheckpoint.objects.filter(taken_at__gte=taken_at).delete()
+            self._take([taken_at])
+        if options["rebuild"]:
+            StockCheckpoint.objects.all().delete()
+        self._take(snapshots.due_checkpoints())
+
+    def _take(self, due):
+        for taken_at in due:
+            checkpoint = snapshots.take_checkpoint(taken_at)
+            self.stdout.write(f"{checkpoint}: {checkpoint.balances.count()} balances")
+        self.stdout.write(self.style.SUCCESS(f"Took {len(due)} checkpoint(s)."))
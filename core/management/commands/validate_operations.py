@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import InventoryOperation
+from core.services import stock
+
+
+class Command(BaseCommand):
+    help = "Validate operations by reference (or every READY operation) and apply their stock moves."
+
+    def add_arguments(self, parser):
+        parser.add_argument("references", nargs="*", help="Operation references, e.g. WH1/IN/2025/0001")
+        parser.add_argument("--all-ready", action="store_true", help="Validate every operation in READY status.")
+
+    def handle(self, *args, **options):
+        if options["all_ready"]:
+            operations = InventoryOperation.objects.filter(status="READY")
+        elif options["references"]:
+            operations = InventoryOperation.objects.filter(reference__in=options["references"])
+        else:
+            raise CommandError("Pass one or more references or --all-ready.")
+
+        failed = 0
+        for operation in operations.order_by("pk"):
+            try:
+                stock.validate_operation(operation)
+                self.stdout.write(self.style.SUCCESS(f"{operation.reference}: validated"))
+            except stock.StockMovementError as e:
+                failed += 1
+                self.stderr.write(f"{operation.reference}: {e}")
+
+        if failed:
+            raise CommandError(f"{failed} operation(s) could not be validated.")
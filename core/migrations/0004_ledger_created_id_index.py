@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_product_cost'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stockledgerentry',
+            index=models.Index(fields=['-created_at', '-id'], name='ledger_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:09
+
+from django.db import migrations, models
+
+
+OPERATION_CODES = {"IN": "RECEIPT", "OUT": "DELIVERY", "MOVE": "INTERNAL", "ADJ": "ADJUST"}
+
+
+def seed_sequences(apps, schema_editor):
+    """Start every sequence after the highest number already issued."""
+    InventoryOperation = apps.get_model('core', 'InventoryOperation')
+    ReferenceSequence = apps.get_model('core', 'ReferenceSequence')
+
+    last_numbers = {}
+    for reference in InventoryOperation.objects.values_list('reference', flat=True).iterator():
+        parts = (reference or '').split('/')
+        if len(parts) != 4 or parts[1] not in OPERATION_CODES:
+            continue
+        try:
+            key = (parts[0], OPERATION_CODES[parts[1]], int(parts[2]))
+            number = int(parts[3])
+        except ValueError:
+            continue
+        last_numbers[key] = max(number, last_numbers.get(key, 0))
+
+    ReferenceSequence.objects.bulk_create(
+        ReferenceSequence(warehouse_code=code, operation_type=op_type, year=year, last_number=number)
+        for (code, op_type, year), number in last_numbers.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_ledger_created_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferenceSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('warehouse_code', models.CharField(max_length=20)),
+                ('operation_type', models.CharField(choices=[('RECEIPT', 'Receipt'), ('DELIVERY', 'Delivery'), ('INTERNAL', 'Internal Transfer'), ('ADJUST', 'Stock Adjustment')], max_length=20)),
+                ('year', models.PositiveIntegerField()),
+                ('last_number', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('warehouse_code', 'operation_type', 'year'), name='unique_reference_sequence')],
+            },
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+
+def build_summaries(apps, schema_editor):
+    Product = apps.get_model('core', 'Product')
+    ProductStockSummary = apps.get_model('core', 'ProductStockSummary')
+
+    totals = Product.objects.annotate(on_hand=Coalesce(Sum('stock_levels__quantity'), 0)).values_list(
+        'id', 'on_hand', 'min_stock'
+    )
+    ProductStockSummary.objects.bulk_create(
+        (
+            ProductStockSummary(product_id=pk, on_hand=on_hand, below_min=on_hand < min_stock)
+            for pk, on_hand, min_stock in totals.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_reference_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStockSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_summary', serialize=False, to='core.product')),
+                ('on_hand', models.IntegerField(default=0)),
+                ('below_min', models.BooleanField(default=False)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['on_hand'], name='summary_on_hand_idx'), models.Index(condition=models.Q(('below_min', True)), fields=['product'], name='summary_below_min_idx')],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventoryoperation',
+            index=models.Index(fields=['type', 'status', '-created_at'], name='op_type_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventoryoperation',
+            index=models.Index(fields=['type', '-created_at'], name='op_type_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventoryoperation',
+            index=models.Index(fields=['-created_at', '-id'], name='op_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventoryoperation',
+            index=models.Index(condition=models.Q(('status__in', ['DONE', 'CANCEL']), _negated=True), fields=['type', 'status'], name='op_open_type_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['name'], name='product_active_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockledgerentry',
+            index=models.Index(fields=['product', '-created_at'], name='ledger_product_created_idx'),
+        ),
+    ]
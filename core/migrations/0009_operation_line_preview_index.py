@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='operationline',
+            index=models.Index(fields=['operation', 'id'], name='opline_operation_id_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.8 on 2026-10-17 04:45
+
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+
+def add_missing_summaries(apps, schema_editor):
+    """Products created outside the stock engine since 0006 have no summary row yet."""
+    Product = apps.get_model('core', 'Product')
+    ProductStockSummary = apps.get_model('core', 'ProductStockSummary')
+
+    totals = Product.objects.filter(stock_summary__isnull=True).annotate(
+        on_hand=Coalesce(Sum('stock_levels__quantity'), 0)
+    ).values_list('id', 'on_hand', 'min_stock')
+    ProductStockSummary.objects.bulk_create(
+        (
+            ProductStockSummary(product_id=pk, on_hand=on_hand, below_min=on_hand < min_stock)
+            for pk, on_hand, min_stock in totals.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_operation_line_preview_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='productstocksummary',
+            name='summary_on_hand_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'id'], name='product_category_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productstocksummary',
+            index=models.Index(fields=['on_hand', 'product'], name='summary_on_hand_idx'),
+        ),
+        migrations.RunPython(add_missing_summaries, migrations.RunPython.noop),
+    ]
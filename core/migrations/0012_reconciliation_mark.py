@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-17 05:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_stock_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationMark',
+            fields=[
+                ('warehouse', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reconciliation_mark', serialize=False, to='core.warehouse')),
+                ('ledger_id', models.BigIntegerField(default=0)),
+                ('checked_at', models.DateTimeField()),
+            ],
+        ),
+    ]
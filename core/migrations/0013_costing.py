@@ -0,0 +1,61 @@
+# Generated by Django 5.2.8 on 2026-10-17 05:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_reconciliation_mark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CostingState',
+            fields=[
+                ('method', models.CharField(choices=[('fifo', 'FIFO'), ('average', 'Weighted average')], max_length=10, primary_key=True, serialize=False)),
+                ('ledger_id', models.BigIntegerField(default=0)),
+                ('costed_through', models.DateTimeField(blank=True, help_text='Latest created_at among the costed entries', null=True)),
+                ('run_ledger_id', models.BigIntegerField(blank=True, null=True)),
+                ('run_product_id', models.BigIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='stockledgerentry',
+            name='unit_cost',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Product cost when the entry was written (costs receipts in core.services.costing)', max_digits=10, null=True),
+        ),
+        migrations.CreateModel(
+            name='CostLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(choices=[('fifo', 'FIFO'), ('average', 'Weighted average')], max_length=10)),
+                ('received_at', models.DateTimeField()),
+                ('quantity', models.IntegerField()),
+                ('unit_cost', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['method', 'product', 'received_at'], name='costlayer_method_product_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PeriodCost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(choices=[('fifo', 'FIFO'), ('average', 'Weighted average')], max_length=10)),
+                ('period', models.DateField(help_text='First day of the month')),
+                ('delivered_quantity', models.IntegerField(default=0)),
+                ('cogs', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('written_off_quantity', models.IntegerField(default=0)),
+                ('written_off_cost', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['method', 'product'], name='periodcost_method_product_idx')],
+                'constraints': [models.UniqueConstraint(fields=('method', 'period', 'product'), name='periodcost_method_period_product_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.8 on 2026-10-17 06:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Q, Sum
+
+
+def build_cells(apps, schema_editor):
+    StockLevel = apps.get_model('core', 'StockLevel')
+    StockValuationCell = apps.get_model('core', 'StockValuationCell')
+
+    cells = StockLevel.objects.values('location_id', 'product__category_id').annotate(
+        lines=Count('pk', filter=~Q(quantity=0)),
+        total=Sum('quantity'),
+        value=Sum(F('quantity') * F('product__cost'), output_field=DecimalField(max_digits=20, decimal_places=2)),
+    ).order_by()
+    StockValuationCell.objects.bulk_create(
+        (
+            StockValuationCell(
+                location_id=cell['location_id'], category_id=cell['product__category_id'],
+                lines=cell['lines'], quantity=cell['total'], value=cell['value'],
+            )
+            for cell in cells.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_shared_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockValuationCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lines', models.BigIntegerField(default=0)),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.category')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.location')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('location', 'category'), name='valuation_cell_unique', nulls_distinct=False)],
+            },
+        ),
+        migrations.RunPython(build_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+# The pg_trgm GIN indexes from 0007 only make sense on PostgreSQL, so they are
+# no longer declared in Meta.indexes (core.search falls back to plain
+# icontains elsewhere). This drops them from the migration state only: the
+# database keeps the indexes 0007 created, and later table rebuilds or
+# autodetected migrations no longer try to recreate gin_trgm_ops indexes.
+TRIGRAM_INDEXES = (
+    ("inventoryoperation", "operation_reference_trgm_idx"),
+    ("product", "product_name_trgm_idx"),
+    ("product", "product_sku_trgm_idx"),
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_stock_valuation_cell'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveIndex(model_name=model_name, name=name) for model_name, name in TRIGRAM_INDEXES
+            ],
+        ),
+    ]
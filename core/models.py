@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, connection, connections, models, router, transaction
 from django.conf import settings
 from django.utils import timezone
 
@@ -63,6 +63,16 @@ class Product(models.Model):
     cost = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, help_text="Product cost per unit")
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # Name / sku icontains search also has pg_trgm indexes on PostgreSQL (migration 0007)
+            # Pickers and reports only list active products, ordered by name
+            models.Index(fields=["name"], condition=models.Q(is_active=True), name="product_active_name_idx"),
+            # Products grid: keyset pages sorted by name or category, ties by id
+            models.Index(fields=["name", "id"], name="product_name_id_idx"),
+            models.Index(fields=["category", "id"], name="product_category_id_idx"),
+        ]
+
     def __str__(self):
         return f"{self.sku} - {self.name}"
 
@@ -164,6 +174,22 @@ class InventoryOperation(models.Model):
 
     notes = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            # Reference search: pg_trgm index on PostgreSQL only (migration 0007)
+            # List views: one type, optionally one status, newest first
+            models.Index(fields=["type", "status", "-created_at"], name="op_type_status_created_idx"),
+            models.Index(fields=["type", "-created_at"], name="op_type_created_idx"),
+            # Dashboard "recent operations" and keyset pagination
+            models.Index(fields=["-created_at", "-id"], name="op_created_id_idx"),
+            # Pending-operation KPIs only ever look at open documents
+            models.Index(
+                fields=["type", "status"],
+                condition=~models.Q(status__in=["DONE", "CANCEL"]),
+                name="op_open_type_status_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.reference or '(no ref)'} ({self.type})"
 
@@ -181,54 +207,89 @@ class InventoryOperation(models.Model):
     # ------------------------------------------------
     # Warehouse deciding logic
     # ------------------------------------------------
-    def _get_warehouse_for_reference(self):
+    def _get_location_id_for_reference(self):
         if self.type == "RECEIPT":
-            loc = self.destination_location
+            return self.destination_location_id
         elif self.type == "DELIVERY":
-            loc = self.source_location
+            return self.source_location_id
         elif self.type == "INTERNAL":
-            loc = self.source_location  # fixed rule
+            return self.source_location_id  # fixed rule
         else:  # ADJUST
-            loc = self.source_location or self.destination_location
-
-        return loc.warehouse if loc else None
+            return self.source_location_id or self.destination_location_id
 
     # ------------------------------------------------
     # Auto-generation logic
     # ------------------------------------------------
     def save(self, *args, **kwargs):
-        if not self.reference:
-            op_code = self._get_operation_code()
-            warehouse = self._get_warehouse_for_reference()
+        if self.reference:
+            return super().save(*args, **kwargs)
 
-            wh_code = warehouse.code if warehouse else "WH"
+        # The sequence row stays locked until the operation is written, so
+        # numbers are handed out in order and a failed save gives its number back.
+        using = kwargs.get("using") or router.db_for_write(self.__class__, instance=self)
+        with transaction.atomic(using=using):
             year = timezone.now().year
-
-            qs = InventoryOperation.objects.filter(
-                type=self.type,
-                created_at__year=year,
+            wh_code, number = ReferenceSequence.next_number(
+                self._get_location_id_for_reference(), self.type, year, using=using
             )
+            self.reference = f"{wh_code}/{self._get_operation_code()}/{year}/{str(number).zfill(4)}"
+            super().save(*args, **kwargs)
 
-            if warehouse:
-                qs = qs.filter(
-                    models.Q(source_location__warehouse=warehouse) |
-                    models.Q(destination_location__warehouse=warehouse)
-                )
 
-            last_number = 0
-            if qs.exists():
-                last_ref = qs.order_by("-id").first().reference
-                try:
-                    last_number = int(last_ref.split("/")[-1])
-                except:
-                    last_number = qs.last().id
+# ==========================
+# REFERENCE SEQUENCES
+# ==========================
 
-            next_number = last_number + 1
-            num_str = str(next_number).zfill(4)
+class ReferenceSequence(models.Model):
+    """
+    Last document number issued per (warehouse code, operation type, year).
+    """
+    warehouse_code = models.CharField(max_length=20)
+    operation_type = models.CharField(max_length=20, choices=InventoryOperation.OPERATION_TYPES)
+    year = models.PositiveIntegerField()
+    last_number = models.PositiveIntegerField(default=0)
 
-            self.reference = f"{wh_code}/{op_code}/{year}/{num_str}"
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["warehouse_code", "operation_type", "year"],
+                name="unique_reference_sequence",
+            ),
+        ]
 
-        super().save(*args, **kwargs)
+    def __str__(self):
+        return f"{self.warehouse_code}/{self.operation_type}/{self.year}: {self.last_number}"
+
+    @classmethod
+    def next_number(cls, location_id, operation_type, year, using=DEFAULT_DB_ALIAS):
+        """
+        Atomically take the next number for the warehouse owning `location_id`
+        ("WH" when there is none) on database `using`. Returns
+        (warehouse_code, number) from a single
+        INSERT ... ON CONFLICT DO UPDATE ... RETURNING statement.
+        """
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO {seq} (warehouse_code, operation_type, year, last_number)
+                SELECT COALESCE(
+                    (SELECT w.code FROM {location} l JOIN {warehouse} w ON w.id = l.warehouse_id
+                     WHERE l.id = %s),
+                    'WH'
+                ), %s, %s, 1
+                ON CONFLICT (warehouse_code, operation_type, year)
+                DO UPDATE SET last_number = {seq}.last_number + 1
+                RETURNING warehouse_code, last_number
+                """.format(
+                    seq=qn(cls._meta.db_table),
+                    location=qn(Location._meta.db_table),
+                    warehouse=qn(Warehouse._meta.db_table),
+                ),
+                [location_id, operation_type, year],
+            )
+            return cursor.fetchone()
 
 
 # ==========================
@@ -240,6 +301,12 @@ class OperationLine(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField()
 
+    class Meta:
+        indexes = [
+            # List views preview the first lines of each operation and count the rest
+            models.Index(fields=["operation", "id"], name="opline_operation_id_idx"),
+        ]
+
     def __str__(self):
         return f"{self.operation.reference} - {self.product.sku} ({self.quantity})"
 
@@ -260,6 +327,248 @@ class StockLevel(models.Model):
         return f"{self.product.sku} @ {self.location}: {self.quantity}"
 
 
+# ==========================
+# STOCK SUMMARY (DASHBOARD KPIs)
+# ==========================
+
+class ProductStockSummary(models.Model):
+    """
+    Denormalized on-hand total per product, maintained by the stock movement
+    engine so dashboard KPIs are indexed lookups instead of aggregates.
+    """
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name="stock_summary"
+    )
+    on_hand = models.IntegerField(default=0)
+    below_min = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Dashboard thresholds and the products grid sorted by stock, ties by product
+            models.Index(fields=["on_hand", "product"], name="summary_on_hand_idx"),
+            models.Index(
+                fields=["product"], condition=models.Q(below_min=True), name="summary_below_min_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.on_hand}"
+
+    @classmethod
+    def refresh(cls, product_ids=None, operation_id=None):
+        """
+        Recompute rows from StockLevel for the given products, for the
+        products on an operation, or (with neither) for every product.
+
+        The rows are locked (created first if missing) in product_id order,
+        like the StockLevel rows in core.services.stock, so two validations
+        that share products queue behind each other instead of deadlocking.
+        Only then are the totals summed: a statement sees the data committed
+        when it starts, so summing before the lock is held could miss the
+        change of the validation it waited for.
+        """
+        qn = connection.ops.quote_name
+        where, params = "", []
+        if operation_id is not None:
+            where = "WHERE p.id IN (SELECT product_id FROM {line} WHERE operation_id = %s)"
+            params = [operation_id]
+        elif product_ids is not None:
+            if not product_ids:
+                return
+            where = "WHERE p.id IN ({})".format(", ".join(["%s"] * len(product_ids)))
+            params = list(product_ids)
+        tables = {
+            "summary": qn(cls._meta.db_table),
+            "product": qn(Product._meta.db_table),
+            "stock": qn(StockLevel._meta.db_table),
+        }
+        where = where.format(line=qn(OperationLine._meta.db_table))
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO {summary} (product_id, on_hand, below_min)
+                SELECT p.id, 0, FALSE FROM {product} p {where}
+                ORDER BY p.id
+                ON CONFLICT (product_id) DO NOTHING
+                """.format(where=where, **tables),
+                params,
+            )
+            cursor.execute(
+                """
+                SELECT product_id FROM {summary}
+                WHERE product_id IN (SELECT p.id FROM {product} p {where})
+                ORDER BY product_id
+                FOR UPDATE
+                """.format(where=where, **tables),
+                params,
+            )
+            cursor.execute(
+                """
+                UPDATE {summary} t SET on_hand = v.on_hand, below_min = v.on_hand < v.min_stock
+                FROM (
+                    SELECT p.id, p.min_stock, COALESCE(SUM(s.quantity), 0) AS on_hand
+                    FROM {product} p
+                    LEFT JOIN {stock} s ON s.product_id = p.id
+                    {where}
+                    GROUP BY p.id, p.min_stock
+                ) v
+                WHERE t.product_id = v.id
+                """.format(where=where, **tables),
+                params,
+            )
+
+
+class StockValuationCell(models.Model):
+    """
+    Stock rows with a non-zero quantity, on-hand quantity and value
+    (quantity x Product.cost) per (location, category): the cells the
+    valuation report (core.services.valuation) rolls up, a few hundred rows
+    however many products there are. Products without a category share the
+    location's category=NULL cell.
+
+    The stock movement engine takes an operation's stock rows out of their
+    cells before applying it and puts them back after (shift), so cells
+    only move by increments. Everything else that changes stock, cost or
+    category (product edits, direct StockLevel edits, the importer,
+    reconciliation) recomputes the cells it touches (refresh).
+    """
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name="+")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name="+")
+    lines = models.BigIntegerField(default=0)
+    quantity = models.BigIntegerField(default=0)
+    value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["location", "category"], nulls_distinct=False, name="valuation_cell_unique"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.location_id}/{self.category_id}: {self.quantity}"
+
+    @classmethod
+    def _tables(cls):
+        qn = connection.ops.quote_name
+        return {
+            "cell": qn(cls._meta.db_table),
+            "stock": qn(StockLevel._meta.db_table),
+            "product": qn(Product._meta.db_table),
+            "line": qn(OperationLine._meta.db_table),
+        }
+
+    @classmethod
+    def shift(cls, sign, operation_id, location_ids):
+        """
+        Add (sign=1) or take out (sign=-1) the stock rows of an operation's
+        products at location_ids, at the products' current cost and category.
+
+        Taking out first locks every (location, category) cell of the
+        operation, stock or not, in one pass in (location, category) order:
+        putting back needs no other cell, and, as in
+        ProductStockSummary.refresh, the stock summed by the next statement
+        is read after any validation that held the cells has committed.
+        """
+        tables = cls._tables()
+        cells = """
+            FROM {product} p
+            CROSS JOIN unnest(%s::bigint[]) AS l(location_id)
+            LEFT JOIN {stock} s ON s.product_id = p.id AND s.location_id = l.location_id
+            WHERE p.id IN (SELECT product_id FROM {line} WHERE operation_id = %s)
+            GROUP BY l.location_id, p.category_id
+            ORDER BY l.location_id, p.category_id NULLS FIRST
+        """.format(**tables)
+        params = [list(location_ids), operation_id]
+        with connection.cursor() as cursor:
+            if sign < 0:
+                cursor.execute(
+                    """
+                    INSERT INTO {cell} (location_id, category_id, lines, quantity, value)
+                    SELECT l.location_id, p.category_id, 0, 0, 0 {cells}
+                    ON CONFLICT (location_id, category_id) DO UPDATE SET lines = {cell}.lines
+                    """.format(cells=cells, **tables),
+                    params,
+                )
+            cursor.execute(
+                """
+                INSERT INTO {cell} (location_id, category_id, lines, quantity, value)
+                SELECT l.location_id, p.category_id, %s * COUNT(s.id) FILTER (WHERE s.quantity <> 0),
+                       %s * COALESCE(SUM(s.quantity), 0), %s * COALESCE(SUM(s.quantity * p.cost), 0)
+                {cells}
+                ON CONFLICT (location_id, category_id) DO UPDATE SET
+                    lines = {cell}.lines + EXCLUDED.lines,
+                    quantity = {cell}.quantity + EXCLUDED.quantity,
+                    value = {cell}.value + EXCLUDED.value
+                """.format(cells=cells, **tables),
+                [sign, sign, sign, *params],
+            )
+
+    @classmethod
+    def refresh(cls, location_ids=None, category_ids=None):
+        """
+        Recompute the cells at location_ids for category_ids (None in the
+        list: products without a category); every location or category when
+        not given. As in ProductStockSummary.refresh, the cells are locked
+        before stock is summed into them: here in one pass, in the order
+        shift() locks them, creating the missing ones on the way.
+        """
+        stock_where, cell_where, params = [], [], []
+        if location_ids is not None:
+            if not location_ids:
+                return
+            placeholders = ", ".join(["%s"] * len(location_ids))
+            stock_where.append(f"s.location_id IN ({placeholders})")
+            cell_where.append(f"c.location_id IN ({placeholders})")
+            params.extend(location_ids)
+        if category_ids is not None:
+            ids = [pk for pk in category_ids if pk is not None]
+            match = "{{column}} IN ({})".format(", ".join(["%s"] * len(ids))) if ids else "FALSE"
+            if len(ids) < len(category_ids):
+                match = f"({match} OR {{column}} IS NULL)"
+            stock_where.append(match.format(column="p.category_id"))
+            cell_where.append(match.format(column="c.category_id"))
+            params.extend(ids)
+        tables = cls._tables()
+        cells = """
+            SELECT s.location_id, p.category_id,
+                   COUNT(*) FILTER (WHERE s.quantity <> 0) AS lines, SUM(s.quantity) AS quantity,
+                   SUM(s.quantity * p.cost) AS value
+            FROM {stock} s
+            JOIN {product} p ON p.id = s.product_id
+            WHERE {where}
+            GROUP BY s.location_id, p.category_id
+        """.format(where=" AND ".join(stock_where or ["TRUE"]), **tables)
+        cell_where = " AND ".join(cell_where or ["TRUE"])
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO {cell} (location_id, category_id, lines, quantity, value)
+                SELECT location_id, category_id, 0, 0, 0 FROM (
+                    SELECT location_id, category_id FROM ({cells}) v
+                    UNION
+                    SELECT location_id, category_id FROM {cell} c WHERE {where}
+                ) k
+                ORDER BY location_id, category_id NULLS FIRST
+                ON CONFLICT (location_id, category_id) DO UPDATE SET lines = {cell}.lines
+                """.format(cells=cells, where=cell_where, **tables),
+                params + params,
+            )
+            cursor.execute(
+                """
+                UPDATE {cell} t SET
+                    lines = COALESCE(v.lines, 0), quantity = COALESCE(v.quantity, 0), value = COALESCE(v.value, 0)
+                FROM {cell} c
+                LEFT JOIN ({cells}) v
+                    ON v.location_id = c.location_id AND v.category_id IS NOT DISTINCT FROM c.category_id
+                WHERE t.id = c.id AND {where}
+                """.format(cells=cells, where=cell_where, **tables),
+                params + params,
+            )
+
+
 # ==========================
 # STOCK LEDGER (MOVE HISTORY)
 # ==========================
@@ -285,10 +594,194 @@ class StockLedgerEntry(models.Model):
     )
 
     quantity_change = models.IntegerField(help_text="Positive=incoming, Negative=outgoing")
+    unit_cost = models.DecimalField(
+        max_digits=10, decimal_places=2, null=True, blank=True,
+        help_text="Product cost when the entry was written (costs receipts in core.services.costing)",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Move history is ordered and keyset-paginated on (created_at, id)
+            models.Index(fields=["-created_at", "-id"], name="ledger_created_id_idx"),
+            # Per-product movement history
+            models.Index(fields=["product", "-created_at"], name="ledger_product_created_idx"),
+        ]
+
     def __str__(self):
         return (
             f"{self.product.sku}: {self.quantity_change} "
             f"({self.source_location} -> {self.destination_location})"
         )
+
+
+# ==========================
+# STOCK CHECKPOINTS (POINT-IN-TIME STOCK)
+# ==========================
+
+class StockCheckpoint(models.Model):
+    """
+    Closing balances at taken_at: every ledger entry created before taken_at
+    is included, none after. Balances are stored sparsely (non-zero only)
+    in StockCheckpointBalance; see core.services.snapshots.
+    """
+    taken_at = models.DateTimeField(unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-taken_at"]
+
+    def __str__(self):
+        return f"Checkpoint {self.taken_at:%Y-%m-%d %H:%M}"
+
+
+class StockCheckpointBalance(models.Model):
+    checkpoint = models.ForeignKey(StockCheckpoint, on_delete=models.CASCADE, related_name="balances")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name="+")
+    quantity = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["checkpoint", "location", "product"], name="checkpoint_location_product_uniq"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["checkpoint", "product"], name="checkpoint_product_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} @ {self.location_id}: {self.quantity}"
+
+
+# ==========================
+# STOCK RECONCILIATION
+# ==========================
+
+class ReconciliationMark(models.Model):
+    """
+    How far reconcile_stock has checked a warehouse: ledger entries up to
+    ledger_id are known to agree with StockLevel, so the next incremental run
+    only looks at products with newer movements.
+    """
+    warehouse = models.OneToOneField(
+        Warehouse, on_delete=models.CASCADE, primary_key=True, related_name="reconciliation_mark"
+    )
+    ledger_id = models.BigIntegerField(default=0)
+    checked_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.warehouse_id}: ledger {self.ledger_id} at {self.checked_at:%Y-%m-%d %H:%M}"
+
+
+# ==========================
+# COSTING (FIFO / WEIGHTED AVERAGE)
+# ==========================
+
+COSTING_METHODS = (
+    ("fifo", "FIFO"),
+    ("average", "Weighted average"),
+)
+
+
+class CostingState(models.Model):
+    """
+    How far the costing engine (core.services.costing) has got for a method.
+    Ledger entries up to ledger_id are costed. While a run is in progress,
+    run_ledger_id is the entry it costs up to and run_product_id the last
+    product whose results are written, so an interrupted run resumes there.
+    """
+    method = models.CharField(max_length=10, choices=COSTING_METHODS, primary_key=True)
+    ledger_id = models.BigIntegerField(default=0)
+    costed_through = models.DateTimeField(null=True, blank=True, help_text="Latest created_at among the costed entries")
+    run_ledger_id = models.BigIntegerField(null=True, blank=True)
+    run_product_id = models.BigIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.method}: ledger {self.ledger_id}"
+
+
+class CostLayer(models.Model):
+    """
+    Closing cost layers of a product: the received quantities still on hand
+    and their unit cost, oldest first. FIFO keeps one layer per receipt,
+    weighted average a single layer at the running average. A negative
+    quantity is stock issued before it was received; the next receipt
+    settles it first.
+    """
+    method = models.CharField(max_length=10, choices=COSTING_METHODS)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    received_at = models.DateTimeField()
+    quantity = models.IntegerField()
+    unit_cost = models.DecimalField(max_digits=14, decimal_places=4)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["method", "product", "received_at"], name="costlayer_method_product_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity} @ {self.unit_cost}"
+
+
+class PeriodCost(models.Model):
+    """Cost of goods delivered, and of stock adjusted out, per product and month."""
+    method = models.CharField(max_length=10, choices=COSTING_METHODS)
+    period = models.DateField(help_text="First day of the month")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    delivered_quantity = models.IntegerField(default=0)
+    cogs = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    written_off_quantity = models.IntegerField(default=0)
+    written_off_cost = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["method", "period", "product"], name="periodcost_method_period_product_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["method", "product"], name="periodcost_method_product_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.method} {self.period:%Y-%m} {self.product_id}: {self.cogs}"
+
+
+# ==========================
+# SHARED COUNTERS
+# ==========================
+
+class SharedCounter(models.Model):
+    """
+    Named counters shared by every worker process (the chat index change
+    sequence, chat router hits). Incremented in the database: cache
+    backends without an atomic incr (file, database) lose concurrent
+    increments, and a culling cache may drop the key altogether.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    @classmethod
+    def increment(cls, name):
+        """Add one to the counter (created at 1) and return the new value, in one statement."""
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (name, value) VALUES (%s, 1)
+                ON CONFLICT (name) DO UPDATE SET value = {table}.value + 1
+                RETURNING value
+                """,
+                [name],
+            )
+            return cursor.fetchone()[0]
+
+    @classmethod
+    def values(cls, *names):
+        """{name: value} for the given names; counters never incremented are 0."""
+        found = dict(cls.objects.filter(name__in=names).values_list("name", "value"))
+        return {name: found.get(name, 0) for name in names}
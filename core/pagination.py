@@ -0,0 +1,175 @@
+"""
+Keyset (seek) pagination on (created_at, id), newest first.
+
+seek_page() does the same, forward only, for an arbitrary (field, id) order.
+
+Pages are addressed by an opaque cursor holding the (created_at, id) of the
+row at the page edge, so fetching page 1,000 is one indexed range scan of
+page_size + 1 rows instead of an OFFSET over everything before it.
+
+Totals, when wanted, are estimates from the planner's statistics (pg_class
+for a whole table, EXPLAIN for a filtered queryset) rather than COUNT(*).
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.db import connections
+from django.db.models import Q
+
+
+def encode_cursor(obj):
+    raw = f"{obj.created_at.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Return (created_at, id) for a cursor, or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        created_at, pk = raw.split("|")
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.estimated_total = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def keyset_paginate(queryset, after=None, before=None, page_size=50):
+    """
+    Return one KeysetPage of `queryset` ordered by (-created_at, -id).
+
+    `after` / `before` are cursors from a previous page's next_cursor /
+    previous_cursor. With neither, the first (newest) page is returned.
+    """
+    after, before = decode_cursor(after), decode_cursor(before)
+
+    if before:
+        created_at, pk = before
+        rows = list(
+            queryset.filter(created_at__gte=created_at)
+            .filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+            .order_by("created_at", "id")[:page_size + 1]
+        )
+        has_more = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(rows[-1]) if rows else None,
+            previous_cursor=encode_cursor(rows[0]) if rows and has_more else None,
+        )
+
+    if after:
+        created_at, pk = after
+        queryset = (
+            queryset.filter(created_at__lte=created_at)
+            .filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+        )
+    rows = list(queryset.order_by("-created_at", "-id")[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1]) if rows and has_more else None,
+        previous_cursor=encode_cursor(rows[0]) if rows and after else None,
+    )
+
+
+def seek_page(queryset, field, descending=False, after=None, page_size=50):
+    """
+    One forward KeysetPage of a values() queryset ordered by (field, id),
+    for lists sorted on something other than created_at (the products grid).
+    `field` must be selected by the queryset and never NULL; the cursor holds
+    the (field, id) of the last row and is opaque to callers.
+    """
+    cursor = decode_seek_cursor(after)
+    if cursor:
+        value, pk = cursor
+        op = "lt" if descending else "gt"
+        queryset = queryset.filter(**{f"{field}__{op}e": value}).filter(
+            Q(**{f"{field}__{op}": value}) | Q(**{field: value, f"id__{op}": pk})
+        )
+    prefix = "-" if descending else ""
+    rows = list(queryset.order_by(f"{prefix}{field}", f"{prefix}id")[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    return KeysetPage(
+        rows,
+        next_cursor=encode_seek_cursor(rows[-1][field], rows[-1]["id"]) if rows and has_more else None,
+    )
+
+
+def encode_seek_cursor(value, pk):
+    return base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode().rstrip("=")
+
+
+def decode_seek_cursor(token):
+    """Return (value, id) for a seek_page() cursor, or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode())
+        return value, int(pk)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return None
+
+
+def estimated_count(queryset):
+    """
+    Approximate row count without COUNT(*): pg_class.reltuples for an
+    unfiltered queryset, the planner's row estimate otherwise. Falls back to
+    count() on other backends or when the table has never been analyzed.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return queryset.count()
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [connection.ops.quote_name(queryset.model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+            estimate = row[0] if row else -1
+        else:
+            sql, params = queryset.order_by().values("pk").query.sql_with_params()
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            estimate = plan[0]["Plan"]["Plan Rows"]
+    return queryset.count() if estimate < 0 else int(estimate)
+
+
+def paginate_request(request, queryset, page_size=50, estimate_total=False):
+    """keyset_paginate() driven by ?after= / ?before=, optionally with page.estimated_total."""
+    page = keyset_paginate(
+        queryset,
+        after=request.GET.get("after"),
+        before=request.GET.get("before"),
+        page_size=page_size,
+    )
+    if estimate_total:
+        page.estimated_total = estimated_count(queryset)
+    return page
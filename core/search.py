@@ -0,0 +1,156 @@
+"""
+Product and operation search.
+
+Matching stays substring (icontains), which Django renders on PostgreSQL as
+UPPER(column) LIKE UPPER('%term%'). The pg_trgm GIN indexes on
+UPPER(name), UPPER(sku) and UPPER(reference) (migration 0007) serve exactly
+that expression, so the searches become bitmap index scans instead of
+sequential scans. Operations match through their lines with an Exists
+subquery rather than a join followed by DISTINCT.
+
+Ranking (SearchVector + trigram similarity) is PostgreSQL only; on other
+backends the same filters run unranked.
+
+The autocomplete_* helpers back the JSON endpoints used by the operation
+forms: prefix matches first, then substring matches, one page at a time,
+in the {"results": [{"id", "text", ...}], "pagination": {"more"}} shape.
+"""
+from django.db import connection
+from django.db.models import Case, Exists, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Greatest
+
+from .models import Location, OperationLine, Partner, Product, StockLevel
+
+RANK_CANDIDATES = 2000
+AUTOCOMPLETE_PAGE_SIZE = 20
+
+
+def is_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def product_q(query, prefix=''):
+    """Q matching products by name or sku; prefix reaches products through a relation."""
+    return Q(**{f'{prefix}name__icontains': query}) | Q(**{f'{prefix}sku__icontains': query})
+
+
+def search_products(queryset, query, rank=False):
+    """
+    Filter a Product queryset by name / sku. With rank=True (PostgreSQL)
+    results are annotated with `rank` and ordered best match first.
+
+    Ranking is computed per matching row, so a broad term (thousands of
+    matches) only ranks the RANK_CANDIDATES matches most similar to the term
+    (trigram similarity of name or sku); apply other filters before
+    searching so the window respects them.
+    """
+    query = query.strip()
+    if not query:
+        return queryset
+    queryset = queryset.filter(product_q(query))
+    if rank and is_postgres():
+        from django.contrib.postgres.search import (
+            SearchQuery, SearchRank, SearchVector, TrigramSimilarity,
+        )
+        similarity = Greatest(TrigramSimilarity('name', query), TrigramSimilarity('sku', query))
+        candidates = queryset.order_by(similarity.desc(), 'pk').values('pk')[:RANK_CANDIDATES]
+        vector = SearchVector('sku', weight='A', config='simple') + SearchVector('name', weight='B', config='simple')
+        queryset = queryset.filter(pk__in=candidates).annotate(
+            rank=SearchRank(vector, SearchQuery(query, search_type='websearch', config='simple'))
+            + TrigramSimilarity('name', query)
+        ).order_by('-rank', '-id')
+    return queryset
+
+
+def lines_matching(query):
+    """Exists() over an operation's lines whose product matches the query."""
+    return Exists(OperationLine.objects.filter(operation=OuterRef('pk')).filter(product_q(query, 'product__')))
+
+
+def search_operations(queryset, query):
+    """Filter an InventoryOperation queryset by reference or by the products on its lines."""
+    query = query.strip()
+    if not query:
+        return queryset
+    return queryset.filter(Q(reference__icontains=query) | lines_matching(query))
+
+
+# ==========================
+# AUTOCOMPLETE
+# ==========================
+
+def _prefix_first(queryset, query, prefix_fields, order):
+    """Order rows whose prefix_fields start with the query ahead of the other matches."""
+    if not query:
+        return queryset.order_by(*order)
+    whens = [When(**{f'{field}__istartswith': query}, then=Value(i)) for i, field in enumerate(prefix_fields)]
+    return queryset.annotate(
+        match=Case(*whens, default=Value(len(whens)), output_field=IntegerField())
+    ).order_by('match', *order)
+
+
+def _page(queryset, page, to_result):
+    start = (max(page, 1) - 1) * AUTOCOMPLETE_PAGE_SIZE
+    rows = list(queryset[start:start + AUTOCOMPLETE_PAGE_SIZE + 1])
+    return {
+        'results': [to_result(row) for row in rows[:AUTOCOMPLETE_PAGE_SIZE]],
+        'pagination': {'more': len(rows) > AUTOCOMPLETE_PAGE_SIZE},
+    }
+
+
+def autocomplete_products(query, page=1, location_id=None):
+    """Active products by sku / name; with location_id each result carries its quantity there."""
+    products = Product.objects.filter(is_active=True)
+    if query:
+        products = products.filter(product_q(query))
+    fields = ['id', 'sku', 'name', 'uom__abbreviation']
+    if location_id:
+        products = products.annotate(quantity=Subquery(
+            StockLevel.objects.filter(product=OuterRef('pk'), location_id=location_id).values('quantity')[:1]
+        ))
+        fields.append('quantity')
+    products = _prefix_first(products, query, ['sku', 'name'], ['sku']).values(*fields)
+
+    def to_result(row):
+        result = {
+            'id': row['id'],
+            'text': f"{row['sku']} - {row['name']}",
+            'uom': row['uom__abbreviation'] or '-',
+        }
+        if location_id:
+            result['quantity'] = row['quantity'] or 0
+        return result
+
+    return _page(products, page, to_result)
+
+
+def autocomplete_locations(query, page=1):
+    """Locations by name or warehouse code / name."""
+    locations = Location.objects.all()
+    if query:
+        locations = locations.filter(
+            Q(name__icontains=query) |
+            Q(warehouse__code__icontains=query) |
+            Q(warehouse__name__icontains=query)
+        )
+    locations = _prefix_first(
+        locations, query, ['warehouse__code', 'name'], ['warehouse__code', 'name']
+    ).values('id', 'name', 'warehouse__code')
+    return _page(locations, page, lambda row: {
+        'id': row['id'],
+        'text': f"{row['warehouse__code']} - {row['name']}",
+    })
+
+
+def autocomplete_partners(query, page=1, partner_type=None):
+    """Partners by name; partner_type 'supplier' or 'customer' also includes 'both'."""
+    partners = Partner.objects.all()
+    if partner_type:
+        partners = partners.filter(partner_type__in=[partner_type, 'both'])
+    if query:
+        partners = partners.filter(name__icontains=query)
+    partners = _prefix_first(partners, query, ['name'], ['name']).values('id', 'name', 'partner_type')
+    return _page(partners, page, lambda row: {
+        'id': row['id'],
+        'text': f"{row['name']} ({row['partner_type']})",
+    })
@@ -0,0 +1,219 @@
+"""
+Chatbot conversation with the model.
+
+The prompt carries a short list of records matching the message (see
+core.services.retrieval) so the model knows which SKUs, codes and
+references exist; the data itself is fetched on demand through the
+read-only tools in core.services.chat_tools. converse() runs the tool-call
+loop: every function call the model makes is answered with the tool's
+result and the model is asked again, up to MAX_TOOL_ROUNDS times.
+
+create_bar_chart is not a data tool: when the model calls it the loop
+stops and the caller draws the chart.
+
+The client only needs client.models.generate_content(model=, contents=,
+config=) returning a google-genai GenerateContentResponse, so tests can pass
+a local stub instead of genai.Client.
+
+stream() is the same loop for the async chatbot view: it uses client.aio,
+yields the model's text as it arrives and runs the retrieval queries and
+tools through sync_to_async. Clients are pooled (get_client(),
+get_async_client()) instead of being built per message; the async client's
+HTTP connections belong to one event loop, so there is one per loop.
+"""
+import asyncio
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import chat_tools, retrieval
+
+GEMINI_MODEL = "gemini-2.5-flash"
+MAX_TOOL_ROUNDS = 5
+CONTEXT_TOP_K = 8
+CONTEXT_TOKEN_BUDGET = 500
+
+CHART_TOOL = "create_bar_chart"
+
+SYSTEM_PROMPT = (
+    "You are a helpful assistant for a stock management system. Use the tools to look up stock, "
+    "operations and movements before answering; do not guess quantities. The records listed below "
+    "match the user's question and tell you which SKUs, warehouse codes and references exist. "
+    "If the user asks to visualize, plot, or graph data, fetch it with the tools and then call "
+    "the create_bar_chart function."
+)
+
+CREATE_CHART_FUNCTION = {
+    "name": CHART_TOOL,
+    "description": "Creates a bar chart given a title, labels, and corresponding values.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "title": {
+                "type": "string",
+                "description": "The title for the chart.",
+            },
+            "labels": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "List of labels for the data points.",
+            },
+            "values": {
+                "type": "array",
+                "items": {"type": "number"},
+                "description": "List of numerical values.",
+            },
+        },
+        "required": ["title", "labels", "values"],
+    },
+}
+
+
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class ChatResult:
+    """The model's final text, or the chart it asked for, plus the tool calls made on the way."""
+
+    def __init__(self, text=None, chart=None, tool_calls=()):
+        self.text = text
+        self.chart = chart
+        self.tool_calls = list(tool_calls)
+
+
+# ==========================
+# CLIENTS
+# ==========================
+
+def _client_options():
+    """(api_key, base_url) from settings; GEMINI_BASE_URL points the client at another server."""
+    return getattr(settings, "GEMINI_API_KEY", None), getattr(settings, "GEMINI_BASE_URL", None)
+
+
+def new_client(api_key, base_url=None):
+    from google import genai
+    from google.genai import types
+
+    return genai.Client(api_key=api_key, http_options=types.HttpOptions(base_url=base_url) if base_url else None)
+
+
+def get_client():
+    """The shared client for sync callers, or None without an API key."""
+    options = _client_options()
+    if not options[0]:
+        return None
+    if options not in _clients:
+        _clients[options] = new_client(*options)
+    return _clients[options]
+
+
+def get_async_client():
+    """The client for the running event loop, or None without an API key; use its .aio side."""
+    options = _client_options()
+    if not options[0]:
+        return None
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if options not in clients:
+        clients[options] = new_client(*options)
+    return clients[options]
+
+
+def reset_clients():
+    """Forget pooled clients, e.g. after the API key or base URL changed."""
+    _clients.clear()
+    _async_clients.clear()
+
+
+# ==========================
+# CONVERSATION
+# ==========================
+
+def build_prompt(message):
+    context = retrieval.build_context(message, k=CONTEXT_TOP_K, token_budget=CONTEXT_TOKEN_BUDGET)
+    return f"System: {SYSTEM_PROMPT}\n\n{context}\n\nUser: {message}"
+
+
+def generate_config():
+    from google.genai import types
+
+    tools = types.Tool(function_declarations=chat_tools.declarations() + [CREATE_CHART_FUNCTION])
+    return types.GenerateContentConfig(tools=[tools])
+
+
+def converse(client, message, model=GEMINI_MODEL, max_rounds=MAX_TOOL_ROUNDS):
+    """Answer one message, running the model's tool calls; returns a ChatResult."""
+    from google.genai import types
+
+    config = generate_config()
+    contents = [types.Content(role="user", parts=[types.Part.from_text(text=build_prompt(message))])]
+    tool_calls = []
+    for _ in range(max_rounds):
+        response = client.models.generate_content(model=model, contents=contents, config=config)
+        if not response.candidates or not response.candidates[0].content or not response.candidates[0].content.parts:
+            return ChatResult(text="No response from Gemini.", tool_calls=tool_calls)
+        content = response.candidates[0].content
+        calls = [part.function_call for part in content.parts if part.function_call]
+        if not calls:
+            text = "".join(part.text for part in content.parts if part.text)
+            return ChatResult(text=text or "No response text generated.", tool_calls=tool_calls)
+
+        for call in calls:
+            if call.name == CHART_TOOL:
+                return ChatResult(chart=dict(call.args or {}), tool_calls=tool_calls)
+        results = []
+        for call in calls:
+            args = dict(call.args or {})
+            tool_calls.append((call.name, args))
+            results.append(types.Part.from_function_response(name=call.name, response=chat_tools.run_tool(call.name, args)))
+        contents.append(content)
+        contents.append(types.Content(role="user", parts=results))
+    return ChatResult(
+        text="I could not finish looking that up. Please ask a narrower question.", tool_calls=tool_calls
+    )
+
+
+async def stream(client, message, model=GEMINI_MODEL, max_rounds=MAX_TOOL_ROUNDS):
+    """
+    converse() for async callers. Yields ("text", chunk) as the model writes,
+    ("chart", args) if it asks for a chart, and finally ("done", tool_calls).
+    """
+    from google.genai import types
+
+    config = generate_config()
+    prompt = await sync_to_async(build_prompt)(message)
+    contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
+    tool_calls = []
+    for _ in range(max_rounds):
+        parts, wrote = [], False
+        async for chunk in await client.aio.models.generate_content_stream(model=model, contents=contents, config=config):
+            if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+                continue
+            for part in chunk.candidates[0].content.parts:
+                parts.append(part)
+                if part.text and not part.function_call:
+                    wrote = True
+                    yield "text", part.text
+        calls = [part.function_call for part in parts if part.function_call]
+        if not calls:
+            if not wrote:
+                yield "text", "No response from Gemini." if not parts else "No response text generated."
+            yield "done", tool_calls
+            return
+
+        for call in calls:
+            if call.name == CHART_TOOL:
+                yield "chart", dict(call.args or {})
+                yield "done", tool_calls
+                return
+        results = []
+        for call in calls:
+            args = dict(call.args or {})
+            tool_calls.append((call.name, args))
+            response = await sync_to_async(chat_tools.run_tool)(call.name, args)
+            results.append(types.Part.from_function_response(name=call.name, response=response))
+        contents.append(types.Content(role="model", parts=parts))
+        contents.append(types.Content(role="user", parts=results))
+    yield "text", "I could not finish looking that up. Please ask a narrower question."
+    yield "done", tool_calls
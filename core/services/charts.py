@@ -0,0 +1,130 @@
+"""
+Chatbot charts, rendered off the request thread and served by URL.
+
+pyplot's global figure state is not thread-safe, so charts are drawn with the
+object-oriented Figure API on an Agg canvas, in a small process pool: a
+render never holds the request worker's GIL or shares matplotlib state.
+
+A chart is addressed by a hash of (title, labels, values). store() keeps the
+cleaned spec in Django's cache and returns the key; the chatbot reply only
+carries <img src="/charts/<key>.png">. chart_png() renders on the first
+request for a key and caches the PNG, so repeated charts (and every
+re-display) are a cache hit, and the URL can be cached by the browser since
+its content never changes.
+"""
+import atexit
+import hashlib
+import io
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.cache import cache
+
+CHART_WORKERS = 2
+CHART_RENDER_TIMEOUT = 30
+CHART_CACHE_TIMEOUT = 60 * 60 * 24
+MAX_BARS = 100
+MAX_TITLE_LENGTH = 200
+BAR_COLOR = "#704a66"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ChartError(ValueError):
+    pass
+
+
+class ChartUnavailable(Exception):
+    """The render timed out or the pool died; the same key may succeed later."""
+
+
+def render_bar_chart(title, labels, values):
+    """PNG bytes of a bar chart. Runs in a pool process; touches no global pyplot state."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(8, 4))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    positions = range(len(values))  # positions, not labels: repeated labels stay separate bars
+    axes.bar(positions, values, color=BAR_COLOR)
+    axes.set_xticks(positions, labels, rotation=45, ha="right")
+    axes.set_title(title)
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: workers start clean instead of inheriting the server's
+            # threads and database connections
+            _pool = ProcessPoolExecutor(CHART_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def _discard_pool(pool):
+    """Forget a broken pool so the next render starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def clean_spec(args):
+    """(title, labels, values) from the model's create_bar_chart arguments; raises ChartError."""
+    title = str(args.get("title") or "Chart")[:MAX_TITLE_LENGTH]
+    labels = [str(label) for label in (args.get("labels") or [])][:MAX_BARS]
+    try:
+        values = [float(value) for value in (args.get("values") or [])][:MAX_BARS]
+    except (TypeError, ValueError):
+        raise ChartError("Chart values must be numbers.")
+    if not values:
+        raise ChartError("There is no data to chart.")
+    labels = (labels + [""] * len(values))[:len(values)]
+    return title, labels, values
+
+
+def chart_key(spec):
+    return hashlib.sha256(json.dumps(spec).encode()).hexdigest()[:32]
+
+
+def store(spec):
+    """Remember a cleaned spec and return its key for the chart URL."""
+    key = chart_key(spec)
+    cache.set(f"chart-spec:{key}", spec, CHART_CACHE_TIMEOUT)
+    return key
+
+
+def chart_png(key):
+    """
+    The PNG for a stored chart, rendered in the pool on first use; None if the
+    key is unknown. Raises ChartUnavailable if the render times out or the
+    pool is broken.
+    """
+    png = cache.get(f"chart-png:{key}")
+    if png is None:
+        spec = cache.get(f"chart-spec:{key}")
+        if spec is None:
+            return None
+        pool = _executor()
+        try:
+            future = pool.submit(render_bar_chart, *spec)
+            png = future.result(timeout=CHART_RENDER_TIMEOUT)
+        except TimeoutError:
+            future.cancel()
+            raise ChartUnavailable("Chart rendering timed out.")
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            raise ChartUnavailable("The chart renderer stopped.")
+        cache.set(f"chart-png:{key}", png, CHART_CACHE_TIMEOUT)
+    return png
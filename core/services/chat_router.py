@@ -0,0 +1,238 @@
+"""
+Local intent router in front of the chatbot.
+
+Common lookups ("how much IMP-12 do we have", "what's below minimum",
+"pending deliveries for WH2", "status of WH/IN/2026/0007") are matched with
+keyword patterns and answered from indexed queries in a few milliseconds.
+Anything open-ended (charts, explanations, comparisons) or not recognised
+returns None and goes to the model.
+
+Hits per intent and fallbacks are counted in the database
+(models.SharedCounter), so the numbers cover every worker process; see
+stats() and the chat_router_stats command.
+"""
+import re
+
+from django.db.models import Q
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from ..filters import in_warehouse
+from ..models import InventoryOperation, Product, ProductStockSummary, SharedCounter, StockLevel, Warehouse
+
+ROW_CAP = 10
+
+OPEN_ENDED_RE = re.compile(
+    r"\b(chart|plot|graph|visuali[sz]e|why|explain|compare|trend|suggest|recommend|forecast|predict|summari[sz]e)\b"
+)
+CODE_RE = re.compile(r"[a-z0-9]+(?:[-/_.][a-z0-9]+)+|[a-z]*\d[a-z0-9]*")
+REFERENCE_RE = re.compile(r"\b[a-z0-9]+(?:/[a-z0-9]+){2,}\b")
+
+HELP_RE = re.compile(r"^\s*(hi|hello|hey|help|what can you do)\s*[!.?]*\s*$")
+STOCK_RE = re.compile(r"\b(how (much|many)|stock (of|for|level)|quantity (of|for)|on hand|in stock|do we have)\b")
+LOW_STOCK_RE = re.compile(r"\b((below|under|less than) (the )?min(imum)?|low[- ]stock|reorder|out of stock)\b")
+OPEN_OPERATIONS_RE = re.compile(r"\b(pending|open|outstanding|waiting|ready|draft|not done|unfinished)\b")
+
+OPERATION_TYPE_WORDS = (
+    (re.compile(r"\b(deliver(y|ies)|shipments?|outgoing)\b"), "DELIVERY"),
+    (re.compile(r"\b(receipts?|incoming)\b"), "RECEIPT"),
+    (re.compile(r"\b(internal )?transfers?\b"), "INTERNAL"),
+    (re.compile(r"\badjustments?\b"), "ADJUST"),
+)
+STATUS_WORDS = {"draft": "DRAFT", "waiting": "WAITING", "ready": "READY"}
+
+METRICS_KEY = "chat-router:{}"
+FALLBACK = "fallback"
+
+
+class RoutedAnswer:
+    def __init__(self, intent, reply):
+        self.intent = intent
+        self.reply = reply
+
+
+# ==========================
+# INTENTS
+# ==========================
+
+def _codes(message):
+    """Words that look like codes (skus, warehouse codes): they contain a digit or a separator."""
+    return set(CODE_RE.findall(message))
+
+
+def _help(message):
+    if not HELP_RE.search(message):
+        return None
+    return mark_safe(
+        "<p>I can look up:</p><ul>"
+        "<li>stock for a SKU: <em>how much IMP-12 do we have</em></li>"
+        "<li>products below minimum: <em>what's below minimum</em></li>"
+        "<li>open operations: <em>pending deliveries for WH2</em></li>"
+        "<li>an operation: <em>status of WH/IN/2026/0007</em></li>"
+        "</ul><p>Anything else goes to the assistant.</p>"
+    )
+
+
+def _operation_status(message):
+    references = REFERENCE_RE.findall(message)
+    if not references:
+        return None
+    query = Q()
+    for reference in references:
+        query |= Q(reference=reference.upper()) | Q(reference=reference)
+    operations = list(InventoryOperation.objects.filter(query).select_related("partner")[:ROW_CAP])
+    if not operations:
+        return None
+    return format_html_join(
+        "", "<p><strong>{}</strong> ({}) is <strong>{}</strong>{}, created {}.</p>",
+        (
+            (
+                op.reference, op.get_type_display(), op.get_status_display(),
+                f" for {op.partner.name}" if op.partner else "", op.created_at.strftime("%Y-%m-%d"),
+            )
+            for op in operations
+        ),
+    )
+
+
+def _stock_for_sku(message):
+    if not STOCK_RE.search(message):
+        return None
+    codes = _codes(message)
+    if not codes:
+        return None
+    products = list(
+        Product.objects.filter(sku__in={variant for code in codes for variant in (code, code.upper())})
+        .select_related("stock_summary", "uom")[:ROW_CAP]
+    )
+    if not products:
+        return None
+    levels = {}
+    for level in StockLevel.objects.filter(product__in=products, quantity__gt=0).select_related("location__warehouse"):
+        levels.setdefault(level.product_id, []).append(level)
+    parts = []
+    for product in products:
+        on_hand = product.stock_summary.on_hand if hasattr(product, "stock_summary") else 0
+        uom = product.uom.abbreviation if product.uom else ""
+        where = format_html_join(
+            ", ", "{}/{}: {}",
+            ((l.location.warehouse.code, l.location.name, l.quantity) for l in levels.get(product.pk, [])[:ROW_CAP]),
+        )
+        parts.append(format_html(
+            "<p><strong>{}</strong> ({}): {} {} on hand{}{}</p>",
+            product.sku, product.name, on_hand, uom,
+            format_html(" ({})", where) if where else "",
+            " - below minimum" if on_hand < product.min_stock else "",
+        ))
+    return format_html_join("", "{}", ((part,) for part in parts))
+
+
+def _below_minimum(message):
+    match = LOW_STOCK_RE.search(message)
+    if not match:
+        return None
+    summaries = ProductStockSummary.objects.filter(product__is_active=True)
+    if "out of stock" in match.group(0):
+        summaries, label = summaries.filter(on_hand__lte=0), "out of stock"
+    else:
+        summaries, label = summaries.filter(below_min=True), "below minimum stock"
+    total = summaries.count()
+    if not total:
+        return format_html("<p>No products are {}.</p>", label)
+    rows = summaries.select_related("product").order_by("on_hand", "product_id")[:ROW_CAP]
+    items = format_html_join(
+        "", "<li>{} ({}): {} on hand, minimum {}</li>",
+        ((s.product.sku, s.product.name, s.on_hand, s.product.min_stock) for s in rows),
+    )
+    more = format_html("<p>...and {} more.</p>", total - ROW_CAP) if total > ROW_CAP else ""
+    return format_html("<p>{} products are {}:</p><ul>{}</ul>{}", total, label, items, more)
+
+
+def _open_operations(message):
+    if not OPEN_OPERATIONS_RE.search(message):
+        return None
+    types = [op_type for pattern, op_type in OPERATION_TYPE_WORDS if pattern.search(message)]
+    if not types:
+        return None
+    operations = InventoryOperation.objects.filter(type__in=types)
+    statuses = [status for word, status in STATUS_WORDS.items() if re.search(rf"\b{word}\b", message)]
+    if statuses:
+        operations = operations.filter(status__in=statuses)
+    else:
+        operations = operations.exclude(status__in=["DONE", "CANCEL"])
+
+    words = _codes(message) | set(re.findall(r"[a-z0-9]+", message))
+    warehouse = Warehouse.objects.filter(code__in={word.upper() for word in words} | words).first()
+    if warehouse:
+        operations = operations.filter(
+            in_warehouse("source_location_id", warehouse.pk) | in_warehouse("destination_location_id", warehouse.pk)
+        )
+    total = operations.count()
+    type_names = dict(InventoryOperation.OPERATION_TYPES)
+    label = " / ".join(type_names[t].lower() for t in types)
+    scope = format_html(" in {}", warehouse.code) if warehouse else ""
+    if not total:
+        return format_html("<p>No open {}{}.</p>", label, scope)
+    rows = operations.select_related("partner").order_by("-created_at", "-id")[:ROW_CAP]
+    items = format_html_join(
+        "", "<li>{} - {}{} (scheduled {})</li>",
+        (
+            (op.reference, op.get_status_display(), f", {op.partner.name}" if op.partner else "", op.scheduled_date)
+            for op in rows
+        ),
+    )
+    more = format_html("<p>...and {} more.</p>", total - ROW_CAP) if total > ROW_CAP else ""
+    return format_html("<p>{} open {}{}:</p><ul>{}</ul>{}", total, label, scope, items, more)
+
+
+# Checked in order; the first intent that answers wins
+INTENTS = (
+    ("help", _help),
+    ("operation_status", _operation_status),
+    ("stock_for_sku", _stock_for_sku),
+    ("below_minimum", _below_minimum),
+    ("open_operations", _open_operations),
+)
+
+
+# ==========================
+# ROUTING & METRICS
+# ==========================
+
+def _count(name):
+    SharedCounter.increment(METRICS_KEY.format(name))
+
+
+def route(message):
+    """A RoutedAnswer for a recognised lookup, or None to fall back to the model."""
+    message = message.lower().strip()
+    if not OPEN_ENDED_RE.search(message):
+        for intent, answer in INTENTS:
+            reply = answer(message)
+            if reply is not None:
+                _count(intent)
+                return RoutedAnswer(intent, reply)
+    _count(FALLBACK)
+    return None
+
+
+def stats():
+    """Hits per intent, fallbacks and the hit rate since the last reset."""
+    names = [intent for intent, _ in INTENTS] + [FALLBACK]
+    values = SharedCounter.values(*(METRICS_KEY.format(name) for name in names))
+    counts = {name: values[METRICS_KEY.format(name)] for name in names}
+    total = sum(counts.values())
+    hits = total - counts[FALLBACK]
+    return {
+        "total": total,
+        "hits": hits,
+        "fallbacks": counts[FALLBACK],
+        "hit_rate": hits / total if total else 0.0,
+        "by_intent": {name: counts[name] for name in names if name != FALLBACK},
+    }
+
+
+def reset_stats():
+    SharedCounter.objects.filter(
+        name__in=[METRICS_KEY.format(intent) for intent, _ in INTENTS] + [METRICS_KEY.format(FALLBACK)]
+    ).delete()
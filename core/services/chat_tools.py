@@ -0,0 +1,253 @@
+"""
+Read-only data tools for the chatbot.
+
+The model is given these function declarations and calls them while it
+answers, so the prompt no longer has to carry the data up front. Each tool
+takes a few parameters, runs the same indexed queries as the list pages
+(core.filters, core.search) and returns at most TOOL_ROW_CAP rows as plain
+JSON-serialisable dicts. Unknown SKUs or warehouse codes come back as an
+"error" entry the model can relay, never as an exception.
+"""
+from datetime import date
+
+from django.db.models import Count, Q, Sum
+
+from ..filters import filter_ledger_entries, filter_operations
+from ..models import InventoryOperation, Product, ProductStockSummary, StockLedgerEntry, StockLevel, Warehouse
+from ..search import search_operations as search_operation_queryset
+
+TOOL_ROW_CAP = 25
+
+OPERATION_TYPES = [code for code, _ in InventoryOperation.OPERATION_TYPES]
+OPERATION_STATUSES = [code for code, _ in InventoryOperation.STATUS_TYPES]
+
+
+class ToolError(Exception):
+    pass
+
+
+def _limit(value):
+    try:
+        return max(1, min(int(value), TOOL_ROW_CAP))
+    except (TypeError, ValueError):
+        return TOOL_ROW_CAP
+
+
+def _text(value, name):
+    """A string argument; the model sometimes sends a code like 12 as a number."""
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ToolError(f"{name} must be a string.")
+    return str(value).strip()
+
+
+def _product(sku):
+    sku = _text(sku, "sku")
+    product = Product.objects.filter(sku__in={sku, sku.upper()}).select_related("uom", "stock_summary").first()
+    if product is None:
+        raise ToolError(f"No product with SKU {sku!r}.")
+    return product
+
+
+def _warehouse(code):
+    code = _text(code, "warehouse_code")
+    warehouse = Warehouse.objects.filter(code__in={code, code.upper()}).first()
+    if warehouse is None:
+        raise ToolError(f"No warehouse with code {code!r}.")
+    return warehouse
+
+
+def _date(value, name):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ToolError(f"{name} must be a date as YYYY-MM-DD.")
+
+
+# ==========================
+# TOOLS
+# ==========================
+
+def stock_by_sku(sku):
+    product = _product(sku)
+    levels = (
+        StockLevel.objects.filter(product=product, quantity__gt=0)
+        .select_related("location__warehouse")
+        .order_by("-quantity")[:TOOL_ROW_CAP]
+    )
+    return {
+        "sku": product.sku,
+        "name": product.name,
+        "uom": product.uom.abbreviation if product.uom else None,
+        "on_hand": product.stock_summary.on_hand if hasattr(product, "stock_summary") else 0,
+        "min_stock": product.min_stock,
+        "locations": [
+            {"warehouse": l.location.warehouse.code, "location": l.location.name, "quantity": l.quantity}
+            for l in levels
+        ],
+    }
+
+
+def stock_by_warehouse(warehouse_code, limit=TOOL_ROW_CAP):
+    warehouse = _warehouse(warehouse_code)
+    levels = StockLevel.objects.filter(location__warehouse=warehouse, quantity__gt=0)
+    totals = levels.aggregate(products=Count("product", distinct=True), quantity=Sum("quantity"))
+    top = (
+        levels.values("product__sku", "product__name")
+        .annotate(quantity=Sum("quantity"))
+        .order_by("-quantity", "product__sku")[:_limit(limit)]
+    )
+    return {
+        "warehouse": warehouse.code,
+        "products_in_stock": totals["products"],
+        "total_quantity": totals["quantity"] or 0,
+        "top_products": [
+            {"sku": row["product__sku"], "name": row["product__name"], "quantity": row["quantity"]} for row in top
+        ],
+    }
+
+
+def low_stock(limit=TOOL_ROW_CAP):
+    summaries = ProductStockSummary.objects.filter(below_min=True, product__is_active=True)
+    rows = summaries.select_related("product").order_by("on_hand", "product_id")[:_limit(limit)]
+    return {
+        "below_minimum": summaries.count(),
+        "products": [
+            {"sku": s.product.sku, "name": s.product.name, "on_hand": s.on_hand, "min_stock": s.product.min_stock}
+            for s in rows
+        ],
+    }
+
+
+def search_operations(query="", operation_type="", status="", warehouse_code="", limit=TOOL_ROW_CAP):
+    params = {}
+    if operation_type:
+        operation_type = _text(operation_type, "operation_type").upper()
+        if operation_type not in OPERATION_TYPES:
+            raise ToolError(f"operation_type must be one of {', '.join(OPERATION_TYPES)}.")
+        params["doc_type"] = operation_type
+    if status:
+        status = _text(status, "status").upper()
+        if status not in OPERATION_STATUSES:
+            raise ToolError(f"status must be one of {', '.join(OPERATION_STATUSES)}.")
+        params["status"] = status
+    if warehouse_code:
+        params["warehouse"] = _warehouse(warehouse_code).pk
+    operations, _ = filter_operations(InventoryOperation.objects.all(), params)
+    operations = search_operation_queryset(operations, _text(query or "", "query"))
+    rows = operations.select_related("partner").order_by("-created_at", "-id")[:_limit(limit)]
+    return {
+        "operations": [
+            {
+                "reference": op.reference,
+                "type": op.type,
+                "status": op.status,
+                "partner": op.partner.name if op.partner else None,
+                "scheduled_date": op.scheduled_date.isoformat() if op.scheduled_date else None,
+                "created": op.created_at.date().isoformat(),
+            }
+            for op in rows
+        ],
+    }
+
+
+def movement_totals(date_from, date_to, sku="", warehouse_code=""):
+    start, end = _date(date_from, "date_from"), _date(date_to, "date_to")
+    params = {"date_from": start.isoformat(), "date_to": end.isoformat()}  # whole days, inclusive
+    if sku:
+        params["product"] = _product(sku).pk
+    if warehouse_code:
+        params["warehouse"] = _warehouse(warehouse_code).pk
+    entries, _ = filter_ledger_entries(StockLedgerEntry.objects.all(), params)
+    rows = (
+        entries.values("operation__type")
+        .annotate(
+            entries=Count("pk"),
+            incoming=Sum("quantity_change", filter=Q(quantity_change__gt=0), default=0),
+            outgoing=Sum("quantity_change", filter=Q(quantity_change__lt=0), default=0),
+        )
+        .order_by("operation__type")
+    )
+    return {
+        "date_from": start.isoformat(),
+        "date_to": end.isoformat(),
+        "by_type": [
+            {
+                "type": row["operation__type"],
+                "entries": row["entries"],
+                "incoming": row["incoming"],
+                "outgoing": -row["outgoing"],
+            }
+            for row in rows
+        ],
+    }
+
+
+# ==========================
+# DECLARATIONS
+# ==========================
+
+def _params(properties, required=()):
+    return {"type": "object", "properties": properties, "required": list(required)}
+
+
+_STRING = {"type": "string"}
+_LIMIT = {"type": "integer", "description": f"Maximum rows to return (at most {TOOL_ROW_CAP})."}
+
+TOOLS = {
+    "stock_by_sku": (stock_by_sku, {
+        "description": "On-hand quantity of one product by SKU, total and per location.",
+        "parameters": _params({"sku": _STRING}, ["sku"]),
+    }),
+    "stock_by_warehouse": (stock_by_warehouse, {
+        "description": "Stock held in one warehouse (by warehouse code): totals and the products with most quantity.",
+        "parameters": _params({"warehouse_code": _STRING, "limit": _LIMIT}, ["warehouse_code"]),
+    }),
+    "low_stock": (low_stock, {
+        "description": "Active products whose on-hand quantity is below their minimum stock.",
+        "parameters": _params({"limit": _LIMIT}),
+    }),
+    "search_operations": (search_operations, {
+        "description": (
+            "Find inventory operations (receipts, deliveries, transfers, adjustments) by reference or product, "
+            "optionally filtered by operation type, status and warehouse code. Newest first."
+        ),
+        "parameters": _params({
+            "query": {"type": "string", "description": "Reference, SKU or product name; may be empty."},
+            "operation_type": {"type": "string", "enum": OPERATION_TYPES},
+            "status": {"type": "string", "enum": OPERATION_STATUSES},
+            "warehouse_code": _STRING,
+            "limit": _LIMIT,
+        }),
+    }),
+    "movement_totals": (movement_totals, {
+        "description": (
+            "Stock moved between two dates (YYYY-MM-DD, inclusive) per operation type, "
+            "optionally for one SKU and/or one warehouse code."
+        ),
+        "parameters": _params(
+            {"date_from": _STRING, "date_to": _STRING, "sku": _STRING, "warehouse_code": _STRING},
+            ["date_from", "date_to"],
+        ),
+    }),
+}
+
+
+def declarations():
+    """Function declarations for the model, in the google-genai dict form."""
+    return [{"name": name, **spec} for name, (_, spec) in TOOLS.items()]
+
+
+def run_tool(name, args):
+    """Call a tool with the model's arguments; always returns a dict."""
+    if name not in TOOLS:
+        return {"error": f"Unknown tool {name!r}."}
+    function, spec = TOOLS[name]
+    allowed = spec["parameters"]["properties"]
+    args = {key: value for key, value in (args or {}).items() if key in allowed}
+    missing = [key for key in spec["parameters"]["required"] if key not in args]
+    if missing:
+        return {"error": f"Missing arguments; {name} needs {', '.join(missing)}."}
+    try:
+        return function(**args)
+    except ToolError as e:
+        return {"error": str(e)}
@@ -0,0 +1,334 @@
+"""
+Cost of goods delivered per month, by FIFO or by weighted average.
+
+The engine replays the stock ledger one product at a time. Entries are
+streamed in (product, created_at, id) order through a server-side cursor
+(QuerySet.iterator), so only the current product's cost layers are worked
+on in Python: a deque of (received_at, quantity, unit_cost) for FIFO, a
+running quantity and average for weighted average.
+
+Receipts and positive adjustments add stock at the product's cost when the
+entry was written (StockLedgerEntry.unit_cost; entries from before that
+column existed fall back to the current Product.cost). Deliveries are
+costed into cogs and negative adjustments into written_off_cost, per
+product and month (PeriodCost). Internal transfers are skipped: moving
+stock between locations does not change what it cost. What is left on
+hand is written to CostLayer, both COPY'd in one round trip per segment.
+
+Products are costed in segments of SEGMENT_PRODUCTS consecutive ids, each
+in its own transaction that also records the last product written
+(CostingState.run_product_id), so memory is bounded by one segment and an
+interrupted run resumes after the last committed segment. Runs are
+incremental: entries up to CostingState.ledger_id are already costed and
+the next run continues from the stored closing layers. A backfill that
+dates entries before what has been costed breaks the replay order, so it
+needs a rebuild.
+"""
+import csv
+import io
+from collections import deque
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ..models import CostingState, CostLayer, PeriodCost, Product, StockLedgerEntry
+from . import snapshots
+
+FIFO, AVERAGE = "fifo", "average"
+METHODS = (FIFO, AVERAGE)
+
+SEGMENT_PRODUCTS = 1000
+CHUNK_SIZE = 5000
+
+UNIT_COST = Decimal("0.0001")
+CENTS = Decimal("0.01")
+
+
+class CostingError(Exception):
+    pass
+
+
+def period_of(moment):
+    """The month (as its first day) a ledger entry is reported in."""
+    return timezone.localdate(moment).replace(day=1)
+
+
+# ==========================
+# COST BOOKS
+# ==========================
+
+class FifoBook:
+    """Open layers oldest first; either all positive, or one negative layer of stock owed."""
+
+    def __init__(self, layers=()):
+        self.layers = deque([received_at, quantity, unit_cost] for received_at, quantity, unit_cost in layers)
+
+    def receive(self, at, quantity, unit_cost):
+        if self.layers and self.layers[0][1] < 0:
+            settled = min(quantity, -self.layers[0][1])
+            self.layers[0][1] += settled
+            quantity -= settled
+            if not self.layers[0][1]:
+                self.layers.popleft()
+        if quantity:
+            self.layers.append([at, quantity, unit_cost])
+
+    def issue(self, at, quantity, unit_cost):
+        """Take quantity off the oldest layers and return what it cost."""
+        cost = 0
+        layers = self.layers
+        while quantity and layers and layers[0][1] > 0:
+            layer = layers[0]
+            taken = min(quantity, layer[1])
+            cost += taken * layer[2]
+            layer[1] -= taken
+            quantity -= taken
+            if not layer[1]:
+                layers.popleft()
+        if quantity:
+            # Issued before it was received: charge the current cost and owe it
+            cost += quantity * unit_cost
+            if layers:
+                layers[0][1] -= quantity
+            else:
+                layers.append([at, -quantity, unit_cost])
+        return cost
+
+    def closing(self):
+        return [tuple(layer) for layer in self.layers]
+
+
+class AverageBook:
+    """Quantity on hand at a running average unit cost."""
+
+    def __init__(self, layers=()):
+        self.received_at, self.quantity, self.unit_cost = None, 0, Decimal(0)
+        for received_at, quantity, unit_cost in layers:
+            self.received_at, self.quantity, self.unit_cost = received_at, quantity, unit_cost
+
+    def receive(self, at, quantity, unit_cost):
+        if self.quantity > 0:
+            total = self.quantity * self.unit_cost + quantity * unit_cost
+            self.unit_cost = (total / (self.quantity + quantity)).quantize(UNIT_COST)
+        elif self.quantity + quantity > 0:
+            self.unit_cost = unit_cost  # nothing (or only stock owed) left at the old average
+        self.quantity += quantity
+        self.received_at = at
+
+    def issue(self, at, quantity, unit_cost):
+        on_hand = max(self.quantity, 0)
+        taken = min(quantity, on_hand)
+        cost = taken * self.unit_cost + (quantity - taken) * unit_cost
+        if quantity > taken:
+            self.unit_cost = unit_cost
+        self.quantity -= quantity
+        return cost
+
+    def closing(self):
+        return [(self.received_at, self.quantity, self.unit_cost)] if self.quantity else []
+
+
+BOOKS = {FIFO: FifoBook, AVERAGE: AverageBook}
+
+
+# ==========================
+# RUNS
+# ==========================
+
+def _cost_product(book, entries):
+    """
+    Replay one product's (product_id, created_at, change, operation type,
+    unit cost) entries. Returns the entry count and {period: [delivered,
+    cogs, written off, written-off cost]}.
+    """
+    periods, count = {}, 0
+    for _, created_at, change, operation_type, unit_cost in entries:
+        count += 1
+        if operation_type == "INTERNAL" or not change:
+            continue
+        if change > 0:
+            book.receive(created_at, change, unit_cost)
+            continue
+        cost = book.issue(created_at, -change, unit_cost)
+        period = period_of(created_at)
+        totals = periods.get(period)
+        if totals is None:
+            totals = periods[period] = [0, Decimal(0), 0, Decimal(0)]
+        if operation_type == "DELIVERY":
+            totals[0] -= change
+            totals[1] += cost
+        else:
+            totals[2] -= change
+            totals[3] += cost
+    return count, periods
+
+
+def _copy(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _write(method, results):
+    """
+    Replace the closing layers of the products costed and add their period
+    totals. Both are COPY'd: building a model instance per row would cost
+    more than the costing itself.
+    """
+    qn = connection.ops.quote_name
+    layer_table, period_table = qn(CostLayer._meta.db_table), qn(PeriodCost._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {layer_table} WHERE method = %s AND product_id = ANY(%s)", [method, list(results)]
+        )
+        _copy(
+            cursor, layer_table, "method, product_id, received_at, quantity, unit_cost",
+            (
+                (method, product_id, at.isoformat(), quantity, unit_cost)
+                for product_id, (layers, _) in results.items()
+                for at, quantity, unit_cost in layers
+            ),
+        )
+
+        # Dropped rather than ON COMMIT DROP: segments nest in the caller's transaction under tests
+        cursor.execute(
+            "CREATE TEMP TABLE costing_period (product_id bigint, period date, delivered_quantity integer, "
+            "cogs numeric(16, 2), written_off_quantity integer, written_off_cost numeric(16, 2))"
+        )
+        _copy(
+            cursor, "costing_period",
+            "product_id, period, delivered_quantity, cogs, written_off_quantity, written_off_cost",
+            (
+                (product_id, period, delivered, cogs.quantize(CENTS), written_off, written_off_cost.quantize(CENTS))
+                for product_id, (_, periods) in results.items()
+                for period, (delivered, cogs, written_off, written_off_cost) in periods.items()
+            ),
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO {period_table} (
+                method, period, product_id, delivered_quantity, cogs, written_off_quantity, written_off_cost
+            )
+            SELECT %s, period, product_id, delivered_quantity, cogs, written_off_quantity, written_off_cost
+            FROM costing_period
+            ON CONFLICT (method, period, product_id) DO UPDATE SET
+                delivered_quantity = {period_table}.delivered_quantity + EXCLUDED.delivered_quantity,
+                cogs = {period_table}.cogs + EXCLUDED.cogs,
+                written_off_quantity = {period_table}.written_off_quantity + EXCLUDED.written_off_quantity,
+                written_off_cost = {period_table}.written_off_cost + EXCLUDED.written_off_cost
+            """,
+            [method],
+        )
+        cursor.execute("DROP TABLE costing_period")
+
+
+def _segment_end(after):
+    """The last product id of the segment starting after `after`, or None for the final segment."""
+    ids = Product.objects.filter(pk__gt=after).order_by("pk").values_list("pk", flat=True)
+    return next(iter(ids[SEGMENT_PRODUCTS - 1:SEGMENT_PRODUCTS]), None)
+
+
+def _cost_segment(method, after, last):
+    """Cost products in (after, last] (last=None: every remaining product); returns (products, entries)."""
+    book_class = BOOKS[method]
+    with transaction.atomic():
+        state = CostingState.objects.select_for_update().get(pk=method)
+        opening = {}
+        if state.ledger_id:
+            layers = CostLayer.objects.filter(method=method, product_id__gt=after)
+            if last is not None:
+                layers = layers.filter(product_id__lte=last)
+            for product_id, *layer in layers.order_by("product_id", "received_at", "pk").values_list(
+                "product_id", "received_at", "quantity", "unit_cost"
+            ):
+                opening.setdefault(product_id, []).append(layer)
+
+        entries = StockLedgerEntry.objects.filter(
+            pk__gt=state.ledger_id, pk__lte=state.run_ledger_id, product_id__gt=after
+        )
+        if last is not None:
+            entries = entries.filter(product_id__lte=last)
+        rows = entries.annotate(entry_cost=Coalesce("unit_cost", "product__cost")).order_by("product_id", "created_at", "pk").values_list(
+            "product_id", "created_at", "quantity_change", "operation__type", "entry_cost"
+        )
+
+        results, count = {}, 0
+        # groupby holds one product's entries at a time, never the segment's
+        for product_id, product_entries in groupby(rows.iterator(chunk_size=CHUNK_SIZE), key=itemgetter(0)):
+            book = book_class(opening.get(product_id, ()))
+            entry_count, periods = _cost_product(book, product_entries)
+            results[product_id] = (book.closing(), periods)
+            count += entry_count
+        _write(method, results)
+
+        state.run_product_id = last if last is not None else max(results, default=after)
+        state.save(update_fields=["run_product_id", "updated_at"])
+    return len(results), count
+
+
+def reset(method):
+    """Forget everything costed by a method, so the next run starts from the first ledger entry."""
+    with transaction.atomic():
+        PeriodCost.objects.filter(method=method).delete()
+        CostLayer.objects.filter(method=method).delete()
+        CostingState.objects.filter(pk=method).delete()
+
+
+def run(method, now=None):
+    """
+    Cost the ledger entries not costed yet (or finish an interrupted run).
+    Returns a dict with the products and entries costed, the segments
+    written and whether an interrupted run was resumed.
+    """
+    if method not in METHODS:
+        raise CostingError(f"Unknown costing method {method!r}; use one of {', '.join(METHODS)}.")
+    now = now or timezone.now()
+    with transaction.atomic():
+        CostingState.objects.get_or_create(pk=method)
+        state = CostingState.objects.select_for_update().get(pk=method)
+        resumed = state.run_ledger_id is not None
+        if not resumed:
+            # Entries written this close to now may still be committing behind the high-water mark
+            high_water = StockLedgerEntry.objects.filter(
+                created_at__lt=now - snapshots.SETTLE_DELAY
+            ).aggregate(top=Max("pk"))["top"] or 0
+            if high_water <= state.ledger_id:
+                return {"method": method, "products": 0, "entries": 0, "segments": 0, "resumed": False}
+            if state.costed_through and StockLedgerEntry.objects.filter(
+                pk__gt=state.ledger_id, pk__lte=high_water, created_at__lt=state.costed_through
+            ).exists():
+                raise CostingError(
+                    "The ledger has entries dated before the last costing run (backfilled?); "
+                    "rebuild the costing to include them."
+                )
+            state.run_ledger_id, state.run_product_id = high_water, 0
+            state.save()
+
+    products = entries = segments = 0
+    while True:
+        after = state.run_product_id
+        last = _segment_end(after)
+        costed, count = _cost_segment(method, after, last)
+        products += costed
+        entries += count
+        segments += 1
+        state.run_product_id = last
+        if last is None:
+            break
+
+    with transaction.atomic():
+        state = CostingState.objects.select_for_update().get(pk=method)
+        latest = StockLedgerEntry.objects.filter(
+            pk__gt=state.ledger_id, pk__lte=state.run_ledger_id
+        ).aggregate(latest=Max("created_at"))["latest"]
+        if latest and (state.costed_through is None or latest > state.costed_through):
+            state.costed_through = latest
+        state.ledger_id, state.run_ledger_id, state.run_product_id = state.run_ledger_id, None, None
+        state.save()
+    return {"method": method, "products": products, "entries": entries, "segments": segments, "resumed": resumed}
@@ -0,0 +1,160 @@
+"""
+Streaming CSV / NDJSON exports.
+
+Rows come from QuerySet.values_list().iterator(chunk_size=...), which on
+PostgreSQL reads through a server-side cursor, and are encoded as they
+arrive. Nothing is materialised, so memory stays flat whatever the row
+count, and the header (CSV) goes out before the query has returned
+anything. Querysets are expected to be filtered already (see core.filters).
+"""
+import csv
+import json
+from itertools import chain, groupby
+from operator import itemgetter
+
+EXPORT_CHUNK_SIZE = 2000
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+STOCK_LEVEL_COLUMNS = [
+    ("sku", "product__sku"),
+    ("product", "product__name"),
+    ("category", "product__category__name"),
+    ("warehouse", "location__warehouse__code"),
+    ("location", "location__name"),
+    ("quantity", "quantity"),
+    ("min_stock", "product__min_stock"),
+    ("cost", "product__cost"),
+]
+
+OPERATION_COLUMNS = [
+    ("reference", "reference"),
+    ("type", "type"),
+    ("status", "status"),
+    ("partner", "partner__name"),
+    ("source_warehouse", "source_location__warehouse__code"),
+    ("source_location", "source_location__name"),
+    ("destination_warehouse", "destination_location__warehouse__code"),
+    ("destination_location", "destination_location__name"),
+    ("scheduled_date", "scheduled_date"),
+    ("created_at", "created_at"),
+    ("created_by", "created_by__username"),
+]
+OPERATION_LINE_COLUMNS = [
+    ("sku", "lines__product__sku"),
+    ("product", "lines__product__name"),
+    ("quantity", "lines__quantity"),
+]
+
+LEDGER_COLUMNS = [
+    ("created_at", "created_at"),
+    ("reference", "operation__reference"),
+    ("type", "operation__type"),
+    ("sku", "product__sku"),
+    ("product", "product__name"),
+    ("source_warehouse", "source_location__warehouse__code"),
+    ("source_location", "source_location__name"),
+    ("destination_warehouse", "destination_location__warehouse__code"),
+    ("destination_location", "destination_location__name"),
+    ("quantity_change", "quantity_change"),
+    ("created_by", "operation__created_by__username"),
+]
+
+VALUATION_COLUMNS = [
+    "level", "warehouse", "location", "category", "lines", "quantity", "value",
+]
+
+
+class _Echo:
+    """File-like object whose write() hands the encoded line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def _rows(queryset, columns):
+    return queryset.values_list(*(field for _, field in columns)).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def _batched(lines):
+    """Join encoded lines into roughly chunk-sized writes instead of one write per row."""
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= EXPORT_CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer = []
+    if buffer:
+        yield "".join(buffer)
+
+
+def _csv(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    yield from _batched(writer.writerow(row) for row in rows)
+
+
+def _ndjson(records):
+    yield from _batched(json.dumps(record, default=str) + "\n" for record in records)
+
+
+def _encode(fmt, columns, rows):
+    names = [name for name, _ in columns]
+    if fmt == "csv":
+        return _csv(names, rows)
+    return _ndjson(dict(zip(names, row)) for row in rows)
+
+
+# ==========================
+# EXPORTS
+# ==========================
+
+def stock_levels(queryset, fmt):
+    """One row per (product, location) balance."""
+    queryset = queryset.order_by("product__sku", "location__warehouse__code", "location__name")
+    return _encode(fmt, STOCK_LEVEL_COLUMNS, _rows(queryset, STOCK_LEVEL_COLUMNS))
+
+
+def ledger_entries(queryset, fmt):
+    """One row per ledger entry, newest first (same order as move history)."""
+    queryset = queryset.order_by("-created_at", "-id")
+    return _encode(fmt, LEDGER_COLUMNS, _rows(queryset, LEDGER_COLUMNS))
+
+
+def valuation(rows, fmt):
+    """Valuation report rows (core.services.valuation), rollups included and tagged by level."""
+    columns = [(name, name) for name in VALUATION_COLUMNS]
+    return _encode(fmt, columns, ([row[name] for name in VALUATION_COLUMNS] for row in rows))
+
+
+def operations(queryset, fmt):
+    """
+    Operations with their lines, newest first. CSV repeats the operation
+    columns on every line; NDJSON writes one object per operation with a
+    nested "lines" list, emitted piece by piece so a very large operation
+    is never held in memory either.
+    """
+    columns = [("id", "id")] + OPERATION_COLUMNS + OPERATION_LINE_COLUMNS
+    rows = _rows(queryset.order_by("-created_at", "-id", "lines__id"), columns)
+    if fmt == "csv":
+        return _csv([name for name, _ in columns[1:]], (row[1:] for row in rows))
+
+    header_size = 1 + len(OPERATION_COLUMNS)
+    operation_names = [name for name, _ in OPERATION_COLUMNS]
+    line_names = [name for name, _ in OPERATION_LINE_COLUMNS]
+
+    def pieces():
+        for _, group in groupby(rows, key=itemgetter(0)):
+            first = next(group)
+            head = json.dumps(dict(zip(operation_names, first[1:header_size])), default=str)
+            yield head[:-1] + ', "lines": ['
+            separator = ""
+            for row in chain([first], group):
+                if row[header_size] is not None:  # operation without lines
+                    yield separator + json.dumps(dict(zip(line_names, row[header_size:])), default=str)
+                    separator = ", "
+            yield "]}\n"
+
+    return _batched(pieces())
@@ -0,0 +1,409 @@
+"""
+Streaming product / opening-balance importer.
+
+Records are read lazily from CSV or JSON Lines and processed in batches,
+each in its own transaction:
+
+- products are COPY'd into a temporary staging table and upserted by sku
+  with one INSERT ... ON CONFLICT statement;
+- missing categories and units of measure are created through an in-memory
+  lookup cache, so each name costs at most one query per import;
+- optional opening balances are staged the same way and applied with one
+  upsert. They are recorded as a DONE "opening balance"
+  adjustment per location (lines and ledger entries written from the same
+  staging rows), so the ledger keeps agreeing with StockLevel;
+- the valuation cells of new balances and of products whose cost or
+  category changed are recomputed.
+
+Memory use is bounded by the batch size, not the file size.
+"""
+import csv
+import io
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+
+from ..caching import bump_stock_version
+from . import retrieval
+from ..models import (
+    Category, UnitOfMeasure, Product, Warehouse, Location,
+    InventoryOperation, OperationLine, StockLevel, StockLedgerEntry, ProductStockSummary, StockValuationCell,
+)
+
+TRUE_VALUES = {"1", "true", "yes", "y", "active"}
+
+# Out-of-range values would abort the whole batch's COPY, so rows are checked first
+INTEGER_MAX = 2 ** 31 - 1
+COST_FIELD = Product._meta.get_field("cost")
+UOM_NAME_LENGTH = UnitOfMeasure._meta.get_field("name").max_length
+UOM_ABBREVIATION_LENGTH = UnitOfMeasure._meta.get_field("abbreviation").max_length
+
+
+class RejectedRow(Exception):
+    pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.products = 0
+        self.balances = 0
+        self.rejected = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0
+
+    def __str__(self):
+        return (
+            f"{self.rows} rows, {self.products} products upserted, {self.balances} opening balances, "
+            f"{self.rejected} rejected in {self.elapsed:.1f}s ({self.rows_per_second:,.0f} rows/s)"
+        )
+
+
+# ==========================
+# READING
+# ==========================
+
+def read_records(stream, fmt):
+    """Yield (line_number, dict) from a text stream without loading it into memory."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == "jsonl":
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                record = RejectedRow(f"invalid JSON: {e.msg}")
+            if not isinstance(record, (dict, RejectedRow)):
+                record = RejectedRow("each line must be a JSON object")
+            yield line_number, record
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def _text(record, key):
+    value = record.get(key)
+    return str(value).strip() if value is not None else ""
+
+
+def _integer(record, key):
+    value = int(_text(record, key) or 0)
+    if not -INTEGER_MAX - 1 <= value <= INTEGER_MAX:
+        raise RejectedRow(f"{key} out of range")
+    return value
+
+
+def _cost(record):
+    cost = Decimal(_text(record, "cost") or 0)
+    if not cost.is_finite():
+        raise InvalidOperation
+    places = COST_FIELD.decimal_places
+    if abs(cost) >= 10 ** (COST_FIELD.max_digits - places) or cost.normalize().as_tuple().exponent < -places:
+        raise RejectedRow(
+            f"cost must be below {10 ** (COST_FIELD.max_digits - places):,} with at most {places} decimal places"
+        )
+    return cost
+
+
+def _clean(record, load_balances):
+    """Validate one record into (sku, product fields, (location key, quantity) or None)."""
+    sku, name = _text(record, "sku"), _text(record, "name")
+    if not sku or not name:
+        raise RejectedRow("sku and name are required")
+    try:
+        fields = {
+            "name": name[:200],
+            "category": _text(record, "category") or None,
+            "uom": _text(record, "uom") or None,
+            "min_stock": _integer(record, "min_stock"),
+            "cost": _cost(record),
+            "is_active": (_text(record, "is_active") or "true").lower() in TRUE_VALUES,
+        }
+    except (ValueError, InvalidOperation):
+        raise RejectedRow("min_stock and cost must be numbers")
+    if len(sku) > 100:
+        raise RejectedRow("sku longer than 100 characters")
+    if fields["uom"] and len(fields["uom"]) > UOM_NAME_LENGTH:
+        raise RejectedRow(f"uom longer than {UOM_NAME_LENGTH} characters")
+
+    balance = None
+    if load_balances and _text(record, "quantity"):
+        location = _text(record, "location")
+        try:
+            quantity = _integer(record, "quantity")
+        except ValueError:
+            raise RejectedRow("quantity must be a whole number")
+        if "/" not in location or quantity < 0:
+            raise RejectedRow('opening balances need location "WAREHOUSE_CODE/Location name" and quantity >= 0')
+        balance = (tuple(location.split("/", 1)), quantity)
+    return sku, fields, balance
+
+
+# ==========================
+# LOOKUPS
+# ==========================
+
+class _Lookups:
+    """Name -> id caches for categories, units and locations, filled on demand."""
+
+    def __init__(self):
+        self.categories = dict(Category.objects.values_list("name", "id"))
+        self.uoms = dict(UnitOfMeasure.objects.values_list("name", "id"))
+        self.abbreviations = set(UnitOfMeasure.objects.values_list("abbreviation", flat=True))
+        self.locations = {
+            (code, name): pk
+            for pk, code, name in Location.objects.values_list("id", "warehouse__code", "name")
+        }
+        self.opening_operations = {}
+
+    def category(self, name):
+        if name and name not in self.categories:
+            self.categories[name] = Category.objects.get_or_create(name=name[:100])[0].pk
+        return self.categories.get(name)
+
+    def uom(self, name):
+        """Units are matched by name; new ones get the first free abbreviation."""
+        if name and name not in self.uoms:
+            unit = UnitOfMeasure.objects.get_or_create(
+                name=name, defaults={"abbreviation": self._free_abbreviation(name)}
+            )[0]
+            self.uoms[name] = unit.pk
+            self.abbreviations.add(unit.abbreviation)
+        return self.uoms.get(name)
+
+    def _free_abbreviation(self, name):
+        """name cut to the column, or with a ~2, ~3... suffix if that is taken."""
+        abbreviation, n = name[:UOM_ABBREVIATION_LENGTH], 1
+        while abbreviation in self.abbreviations:
+            n += 1
+            suffix = f"~{n}"
+            abbreviation = name[:UOM_ABBREVIATION_LENGTH - len(suffix)] + suffix
+        return abbreviation
+
+    def opening_operation(self, location_id):
+        if location_id not in self.opening_operations:
+            self.opening_operations[location_id] = InventoryOperation.objects.create(
+                type="ADJUST",
+                status="DONE",
+                source_location_id=location_id,
+                destination_location_id=location_id,
+                notes="Opening balances loaded by import_products.",
+            ).pk
+        return self.opening_operations[location_id]
+
+
+# ==========================
+# WRITING
+# ==========================
+
+def _tables():
+    qn = connection.ops.quote_name
+    return {
+        "stock": qn(StockLevel._meta.db_table),
+        "line": qn(OperationLine._meta.db_table),
+        "ledger": qn(StockLedgerEntry._meta.db_table),
+        "product": qn(Product._meta.db_table),
+    }
+
+
+def _stage(cursor, table, columns, rows):
+    """Create a transaction-scoped temp table and COPY rows into it."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.execute(f"CREATE TEMP TABLE {table} ({columns}) ON COMMIT DROP")
+    cursor.copy_expert(f"COPY {table} FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _upsert_products(cursor, batch, lookups):
+    """
+    COPY the batch into a staging table and upsert it into Product by sku.
+    Returns the product ids, and (id, previous category) for the existing
+    products whose cost or category changes.
+    """
+    _stage(
+        cursor,
+        "import_product",
+        "sku varchar(100), name varchar(200), category_id bigint, uom_id bigint, "
+        "min_stock integer, cost numeric(10, 2), is_active boolean",
+        (
+            [
+                sku, fields["name"], lookups.category(fields["category"]), lookups.uom(fields["uom"]),
+                fields["min_stock"], fields["cost"], fields["is_active"],
+            ]
+            for sku, fields in batch.items()
+        ),
+    )
+    # Products whose stock is about to change value, and the category it was counted under
+    cursor.execute(
+        """
+        SELECT p.id, p.category_id FROM {product} p
+        JOIN import_product st ON st.sku = p.sku
+        WHERE p.cost <> st.cost OR p.category_id IS DISTINCT FROM st.category_id
+        """.format(**_tables())
+    )
+    revalued = cursor.fetchall()
+    cursor.execute(
+        """
+        INSERT INTO {product} (sku, name, category_id, uom_id, min_stock, cost, is_active)
+        SELECT sku, name, category_id, uom_id, min_stock, cost, is_active FROM import_product
+        ON CONFLICT (sku) DO UPDATE SET
+            name = EXCLUDED.name, category_id = EXCLUDED.category_id, uom_id = EXCLUDED.uom_id,
+            min_stock = EXCLUDED.min_stock, cost = EXCLUDED.cost, is_active = EXCLUDED.is_active
+        RETURNING id
+        """.format(**_tables())
+    )
+    return [row[0] for row in cursor.fetchall()], revalued
+
+
+def _load_balances(cursor, balances, lookups):
+    """
+    COPY (sku, location, quantity, opening operation) rows into a staging table,
+    record the differences as opening-balance lines and ledger entries, then
+    set StockLevel to the staged quantities with one upsert.
+    """
+    _stage(
+        cursor,
+        "import_opening_balance",
+        "sku varchar(100), location_id bigint, quantity integer, operation_id bigint",
+        (
+            [sku, location_id, quantity, lookups.opening_operation(location_id)]
+            for (sku, location_id), quantity in balances.items()
+        ),
+    )
+    cursor.execute(
+        """
+        WITH staged AS (
+            SELECT st.operation_id, st.location_id, p.id AS product_id,
+                   st.quantity - COALESCE(s.quantity, 0) AS difference
+            FROM import_opening_balance st
+            JOIN {product} p ON p.sku = st.sku
+            LEFT JOIN {stock} s ON s.product_id = p.id AND s.location_id = st.location_id
+        ), new_lines AS (
+            INSERT INTO {line} (operation_id, product_id, quantity)
+            SELECT operation_id, product_id, difference FROM staged WHERE difference <> 0
+            RETURNING id, operation_id, product_id, quantity
+        )
+        INSERT INTO {ledger} (
+            operation_id, line_id, product_id,
+            source_location_id, destination_location_id, quantity_change, unit_cost, created_at
+        )
+        SELECT l.operation_id, l.id, l.product_id, st.location_id, st.location_id, l.quantity, p.cost, NOW()
+        FROM new_lines l
+        JOIN staged st ON st.operation_id = l.operation_id AND st.product_id = l.product_id
+        JOIN {product} p ON p.id = l.product_id
+        """.format(**_tables())
+    )
+    cursor.execute(
+        """
+        INSERT INTO {stock} (product_id, location_id, quantity)
+        SELECT p.id, st.location_id, st.quantity
+        FROM import_opening_balance st
+        JOIN {product} p ON p.sku = st.sku
+        ORDER BY p.id, st.location_id
+        ON CONFLICT (product_id, location_id) DO UPDATE SET quantity = EXCLUDED.quantity
+        """.format(**_tables())
+    )
+    return cursor.rowcount
+
+
+def _refresh_valuation(cursor, revalued, balances):
+    """
+    Recompute the valuation cells of the revalued products' stock and of
+    the opening balances: their locations, under both the old and the new
+    categories.
+    """
+    product_ids = [pk for pk, _ in revalued]
+    cursor.execute(
+        """
+        SELECT DISTINCT location_id FROM {stock} WHERE product_id = ANY(%s)
+        """.format(**_tables()),
+        [product_ids],
+    )
+    location_ids = {pk for pk, in cursor.fetchall()} | {location_id for _, location_id in balances}
+    if not location_ids:
+        return
+    cursor.execute(
+        """
+        SELECT DISTINCT category_id FROM {product} WHERE id = ANY(%s) OR sku = ANY(%s)
+        """.format(**_tables()),
+        [product_ids, [sku for sku, _ in balances]],
+    )
+    category_ids = {pk for pk, in cursor.fetchall()} | {category_id for _, category_id in revalued}
+    StockValuationCell.refresh(location_ids=sorted(location_ids), category_ids=category_ids)
+
+
+def _flush(products, balances, lookups, report):
+    if not products:
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        product_ids, revalued = _upsert_products(cursor, products, lookups)
+        if balances:
+            report.balances += _load_balances(cursor, balances, lookups)
+        _refresh_valuation(cursor, revalued, balances)  # cells before summaries, as everywhere
+        ProductStockSummary.refresh(product_ids=product_ids)
+    report.products += len(products)
+
+
+# ==========================
+# PUBLIC API
+# ==========================
+
+def import_products(stream, fmt="csv", batch_size=5000, load_balances=False, on_reject=None, on_batch=None):
+    """
+    Import products (and optionally opening balances) from a text stream.
+
+    on_reject(line_number, record, reason) is called for every rejected row and
+    on_batch(report) after every committed batch. Returns an ImportReport.
+    """
+    report = ImportReport()
+    lookups = _Lookups()
+    products, balances = {}, {}
+
+    def reject(line_number, record, reason):
+        report.rejected += 1
+        if on_reject:
+            on_reject(line_number, record, reason)
+
+    for line_number, record in read_records(stream, fmt):
+        report.rows += 1
+        if isinstance(record, RejectedRow):
+            reject(line_number, None, str(record))
+            continue
+        try:
+            sku, fields, balance = _clean(record, load_balances)
+            if balance:
+                location_id = lookups.locations.get(balance[0])
+                if location_id is None:
+                    raise RejectedRow(f"unknown location {'/'.join(balance[0])}")
+                balances[(sku, location_id)] = balance[1]
+        except RejectedRow as e:
+            reject(line_number, record, str(e))
+            continue
+
+        products[sku] = fields  # last row wins for repeated skus
+        if len(products) >= batch_size:
+            _flush(products, balances, lookups, report)
+            products, balances = {}, {}
+            if on_batch:
+                on_batch(report)
+
+    _flush(products, balances, lookups, report)
+    bump_stock_version(*Warehouse.objects.filter(
+        locations__in=lookups.opening_operations.keys()
+    ).values_list("pk", flat=True))
+    if report.products:
+        retrieval.mark_stale()  # products were upserted without signals
+    return report
@@ -0,0 +1,97 @@
+"""
+Line ingestion for the operation create views.
+
+Posted rows are parsed and validated up front, products are resolved with a
+single in_bulk() query, and the operation and all of its lines are written
+in one transaction (one bulk_create for the lines). A bad row rejects the
+whole document instead of leaving a half-built operation behind.
+"""
+from django.db import transaction
+
+from ..models import OperationLine, Product
+
+
+# Larger values would fail the integer columns mid-insert
+INTEGER_MAX = 2 ** 31 - 1
+
+
+class LineError(Exception):
+    """A posted line cannot be accepted."""
+
+
+class NoLines(LineError):
+    """Nothing left to save once blank rows are skipped."""
+
+
+def _to_int(value, label):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise LineError(f'"{value}" is not a valid {label}.')
+
+
+def _quantity(value, label):
+    quantity = _to_int(value, label)
+    if abs(quantity) > INTEGER_MAX:
+        raise LineError(f'"{value}" is too large for a {label}.')
+    return quantity
+
+
+def parse_lines(product_ids, quantities):
+    """
+    Pair posted product ids with quantities. Rows missing either value or
+    with a zero quantity are skipped; negative or non-numeric values raise
+    LineError.
+    """
+    lines = []
+    for product_id, quantity in zip(product_ids, quantities):
+        if not product_id or not quantity:
+            continue
+        quantity = _quantity(quantity, "quantity")
+        if quantity < 0:
+            raise LineError("Quantities cannot be negative.")
+        if quantity:
+            lines.append((_to_int(product_id, "product"), quantity))
+    return lines
+
+
+def parse_adjustment_lines(product_ids, system_quantities, physical_quantities):
+    """
+    Turn counted rows into signed difference lines (physical - system).
+    Rows without a physical count, or whose count matches the system, are skipped.
+    """
+    lines = []
+    for product_id, system_qty, physical_qty in zip(product_ids, system_quantities, physical_quantities):
+        if not product_id or not physical_qty:
+            continue
+        physical_qty = _quantity(physical_qty, "physical quantity")
+        if physical_qty < 0:
+            raise LineError("Physical quantities cannot be negative.")
+        difference = physical_qty - (_quantity(system_qty, "system quantity") if system_qty else 0)
+        if abs(difference) > INTEGER_MAX:
+            raise LineError("The difference between the counts is too large.")
+        if difference:
+            lines.append((_to_int(product_id, "product"), difference))
+    return lines
+
+
+def save_operation_with_lines(operation, lines):
+    """
+    Save an unsaved operation together with its (product_id, quantity) lines.
+    Raises NoLines / LineError without writing anything if the lines are unusable.
+    """
+    if not lines:
+        raise NoLines("Please add at least one product with quantity.")
+
+    products = Product.objects.filter(is_active=True).only("id").in_bulk({pk for pk, _ in lines})
+    missing = {pk for pk, _ in lines} - products.keys()
+    if missing:
+        raise LineError(f"Unknown or inactive product id(s): {', '.join(map(str, sorted(missing)))}.")
+
+    with transaction.atomic():
+        operation.save()
+        OperationLine.objects.bulk_create(
+            OperationLine(operation=operation, product=products[pk], quantity=quantity)
+            for pk, quantity in lines
+        )
+    return operation
@@ -0,0 +1,174 @@
+"""
+Stock reconciliation: does StockLevel agree with the stock ledger?
+
+The expected balance of a (product, location) is what its ledger entries add
+up to, read through core.services.snapshots (latest checkpoint plus the
+entries since). StockLevel can drift from it when it is edited outside the
+stock engine, which leaves no trace. Quantities are compared as they are:
+the ledger records what an adjustment actually applied, clamp included.
+A negative ledger balance cannot be written back to StockLevel and is
+never repaired; it is reported on its own since it needs an adjustment
+(adjustments backfilled from before the ledger record what was requested,
+so a clamp among them shows up this way).
+
+reconcile_warehouse() checks one warehouse. It runs in its own REPEATABLE
+READ transaction, so the ledger and StockLevel are read from one snapshot
+and a movement committing meanwhile cannot show up as drift; a repair that
+races a movement fails with a serialization error instead of overwriting
+it. Each warehouse keeps a ReconciliationMark: incremental runs only check
+products with ledger entries past the mark, and the mark only advances
+once the warehouse is clean (or repaired).
+
+The function takes and returns plain values so the reconcile_stock
+command can run one warehouse per pool process.
+"""
+from django.db import OperationalError, connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from ..caching import bump_stock_version
+from ..models import (
+    Location, Product, ProductStockSummary, ReconciliationMark, StockLedgerEntry, StockLevel, StockValuationCell,
+    Warehouse,
+)
+from . import snapshots
+
+MISMATCH_SAMPLE = 20
+REBUILD_BATCH_SIZE = 5000
+
+CHECK, REPAIR, REBUILD = "check", "repair", "rebuild"
+
+
+def _repeatable_read():
+    with connection.cursor() as cursor:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+
+
+def _touched_products(since_id, location_ids):
+    """Products with ledger entries after since_id at any of the locations."""
+    return list(
+        StockLedgerEntry.objects.filter(pk__gt=since_id)
+        .annotate(entry_location=snapshots.ENTRY_LOCATION)
+        .filter(entry_location__in=location_ids)
+        .values_list("product_id", flat=True)
+        .distinct()
+    )
+
+
+def _describe(mismatches):
+    """Readable (sku, location, recorded, expected) rows for the first few mismatches."""
+    sample = mismatches[:MISMATCH_SAMPLE]
+    skus = dict(Product.objects.filter(pk__in={p for p, _, _, _ in sample}).values_list("pk", "sku"))
+    names = dict(Location.objects.filter(pk__in={l for _, l, _, _ in sample}).values_list("pk", "name"))
+    return [(skus.get(p, p), names.get(l, l), recorded, expected) for p, l, recorded, expected in sample]
+
+
+def _repair(mismatches, location_ids):
+    """Write the ledger balance over each mismatch, except negative ones."""
+    mismatches = [mismatch for mismatch in mismatches if mismatch[3] >= 0]
+    levels = {
+        (level.product_id, level.location_id): level
+        for level in StockLevel.objects.select_for_update().filter(
+            location_id__in=location_ids, product_id__in={p for p, _, _, _ in mismatches}
+        )
+    }
+    changed, missing = [], []
+    for product_id, location_id, _, expected in mismatches:
+        level = levels.get((product_id, location_id))
+        if level is None:
+            missing.append(StockLevel(product_id=product_id, location_id=location_id, quantity=expected))
+        else:
+            level.quantity = expected
+            changed.append(level)
+    StockLevel.objects.bulk_update(changed, ["quantity"])
+    StockLevel.objects.bulk_create(missing)
+
+
+def _rebuild(expected, location_ids):
+    # One statement rather than QuerySet.delete(), whose per-row post_delete
+    # handlers would each bump the stock version the caller bumps once
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM {} WHERE location_id = ANY(%s)".format(connection.ops.quote_name(StockLevel._meta.db_table)),
+            [location_ids],
+        )
+    StockLevel.objects.bulk_create(
+        (
+            StockLevel(product_id=product_id, location_id=location_id, quantity=quantity)
+            for (product_id, location_id), quantity in expected.items()
+            if quantity > 0
+        ),
+        batch_size=REBUILD_BATCH_SIZE,
+    )
+
+
+def reconcile_warehouse(warehouse_id, mode=CHECK, full=False):
+    """
+    Check (and with mode=REPAIR or REBUILD, fix) one warehouse. Returns a
+    dict with the number of balances checked, the mismatch count and a
+    sample, the negative ledger balances, whether StockLevel was changed,
+    and "error" if the transaction was aborted by a concurrent movement.
+    """
+    warehouse = Warehouse.objects.get(pk=warehouse_id)
+    mark = ReconciliationMark.objects.filter(warehouse=warehouse).first()
+    incremental = mark is not None and not full and mode != REBUILD
+    result = {"warehouse": warehouse.code, "checked": 0, "mismatches": 0, "sample": [], "negative": 0, "fixed": False}
+    outermost = not connection.in_atomic_block  # otherwise the caller's transaction decides
+    try:
+        with transaction.atomic():
+            if outermost:
+                _repeatable_read()
+            location_ids = list(Location.objects.filter(warehouse=warehouse).values_list("pk", flat=True))
+            # Everything in the snapshot was created before this; entries dated
+            # before the settle delay can no longer appear behind the mark
+            now = timezone.now()
+            high_water = StockLedgerEntry.objects.filter(
+                created_at__lt=now - snapshots.SETTLE_DELAY
+            ).aggregate(top=Max("pk"))["top"] or 0
+            high_water = max(high_water, mark.ledger_id if mark else 0)
+
+            product_ids = None
+            if incremental:
+                product_ids = _touched_products(mark.ledger_id, location_ids)
+            if location_ids and product_ids != []:
+                expected = snapshots.stock_at(now, location_ids=location_ids, product_ids=product_ids)
+                levels = StockLevel.objects.filter(location_id__in=location_ids)
+                if product_ids is not None:
+                    levels = levels.filter(product_id__in=product_ids)
+                recorded = {
+                    (product_id, location_id): quantity
+                    for product_id, location_id, quantity in levels.values_list("product_id", "location_id", "quantity")
+                }
+                keys = recorded.keys() | expected.keys()
+                mismatches = []
+                for product_id, location_id in sorted(keys):
+                    have = recorded.get((product_id, location_id), 0)
+                    should = expected.get((product_id, location_id), 0)
+                    if have != should:
+                        mismatches.append((product_id, location_id, have, should))
+                result.update(
+                    checked=len(keys),
+                    mismatches=len(mismatches),
+                    sample=_describe(mismatches),
+                    negative=sum(1 for quantity in expected.values() if quantity < 0),
+                )
+                if mode == REBUILD:
+                    _rebuild(expected, location_ids)
+                    StockValuationCell.refresh(location_ids=location_ids)
+                    result["fixed"] = True
+                elif mode == REPAIR and mismatches:
+                    _repair(mismatches, location_ids)
+                    StockValuationCell.refresh(location_ids=sorted({l for _, l, _, _ in mismatches}))
+                    ProductStockSummary.refresh(product_ids=sorted({p for p, _, _, _ in mismatches}))
+                    result["fixed"] = True
+                if result["fixed"]:
+                    bump_stock_version(warehouse.pk)
+
+            # Negative balances are left as they are, so they keep the mark back
+            if not result["mismatches"] or (result["fixed"] and not result["negative"]):
+                ReconciliationMark.objects.update_or_create(
+                    warehouse=warehouse, defaults={"ledger_id": high_water, "checked_at": now}
+                )
+    except OperationalError as e:
+        result["error"] = str(e).strip()
+    return result
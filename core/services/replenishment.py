@@ -0,0 +1,234 @@
+"""
+Reorder points and replenishment suggestions from delivery history.
+
+One query streams the DELIVERY ledger entries of the history window as
+(product, local day, quantity) rows, through a binary COPY read straight
+into a NumPy record array. Summing them per (product, day) gives the
+non-zero cells of the product x day consumption matrix, kept in coordinate
+form: a dense matrix of 100k products x 730 days would take half a
+gigabyte for mostly zeros, while the statistics only need per-product sums
+of the cells and of their squares (np.bincount), from which come the daily
+mean and standard deviation (days without deliveries count as zero
+demand). Nothing loops per product, and the database does no grouping:
+hashing millions of (product, day) groups took it longer than the scan.
+
+With lead time L, review period R and the service level's z-score:
+
+    reorder point = mean * L + z * std * sqrt(L)
+    order-up-to   = mean * (L + R) + z * std * sqrt(L + R)
+
+A product is suggested when its stock position (on hand plus open receipts)
+is at or below the reorder point, for the quantity that brings it back to
+the order-up-to level. Suggestions become DRAFT receipts, one per supplier
+and destination, both taken from the product's latest done receipt.
+Products never received have neither: they go on a receipt without a
+supplier to a destination given by the caller, or are left out (a receipt
+without a destination could never be validated).
+"""
+import io
+import math
+from datetime import datetime, time, timedelta
+from statistics import NormalDist
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from ..caching import bump_stock_version
+from ..models import InventoryOperation, OperationLine, Product, ProductStockSummary, StockLedgerEntry
+
+HISTORY_DAYS = 730
+LEAD_TIME_DAYS = 7
+REVIEW_DAYS = 14
+SERVICE_LEVEL = 0.95
+
+OPEN_STATUSES = ("DRAFT", "WAITING", "READY")
+
+
+# COPY ... (FORMAT binary) rows of (bigint, integer, integer): a field count,
+# then a length before each field. Fixed width, so NumPy reads them in place.
+_ENTRY = np.dtype([
+    ("fields", ">i2"), ("product_len", ">i4"), ("product", ">i8"),
+    ("day_len", ">i4"), ("day", ">i4"), ("quantity_len", ">i4"), ("quantity", ">i4"),
+])
+_COPY_HEADER = 19  # signature, flags, header extension length
+_COPY_TRAILER = 2
+
+
+def _deliveries(start, days):
+    """(product_ids, day offsets from start, quantities) of the delivery entries in the window."""
+    qn = connection.ops.quote_name
+    start_at = timezone.make_aware(datetime.combine(start, time.min))
+    query = """
+        SELECT e.product_id::bigint, (e.created_at AT TIME ZONE %s)::date - %s::date, -e.quantity_change
+        FROM {ledger} e
+        JOIN {operation} o ON o.id = e.operation_id
+        WHERE o.type = 'DELIVERY' AND e.quantity_change < 0
+          AND e.created_at >= %s AND e.created_at < %s
+    """.format(
+        ledger=qn(StockLedgerEntry._meta.db_table),
+        operation=qn(InventoryOperation._meta.db_table),
+    )
+    buffer = io.BytesIO()
+    with connection.cursor() as cursor:
+        # COPY takes no parameters, so they are bound here with the driver's quoting
+        query = cursor.mogrify(query, [
+            timezone.get_current_timezone_name(), start, start_at, start_at + timedelta(days=days),
+        ]).decode()
+        cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT binary)", buffer)
+    entries = np.frombuffer(buffer.getbuffer()[_COPY_HEADER:-_COPY_TRAILER], dtype=_ENTRY)
+    return entries["product"].astype(np.int64), entries["day"].astype(np.int64), entries["quantity"].astype(np.int64)
+
+
+def _locate(product_ids, keys):
+    """Positions of keys in the sorted product_ids array, and which keys are there at all."""
+    index = np.searchsorted(product_ids, keys)
+    found = index < len(product_ids)
+    found[found] = product_ids[index[found]] == keys[found]
+    return index, found
+
+
+def _per_product(product_ids, pairs):
+    """Spread (product_id, value) pairs over the product_ids array; products without a pair get 0."""
+    pairs = np.array(list(pairs), dtype=np.int64).reshape(-1, 2)
+    index, found = _locate(product_ids, pairs[:, 0])
+    result = np.zeros(len(product_ids), dtype=np.int64)
+    result[index[found]] = pairs[found, 1]
+    return result
+
+
+def compute(
+    days=HISTORY_DAYS, lead_time=LEAD_TIME_DAYS, review_days=REVIEW_DAYS, service_level=SERVICE_LEVEL, today=None,
+):
+    """
+    Demand statistics and reorder levels for every active product, as a
+    dict of equal-length arrays keyed by product_id (ascending), on_hand,
+    incoming, daily_demand, demand_std, reorder_point, order_up_to and
+    order_quantity. The history is the `days` full days before today.
+    """
+    today = today or timezone.localdate()
+    start = today - timedelta(days=days)
+    product_ids = np.fromiter(
+        Product.objects.filter(is_active=True).order_by("pk").values_list("pk", flat=True), dtype=np.int64
+    )
+
+    entry_products, entry_days, quantities = _deliveries(start, days)
+    index, active = _locate(product_ids, entry_products)  # drops inactive products
+    # Non-zero cells of the product x day matrix, as flat row-major positions
+    cells, cell_of_entry = np.unique(index[active] * days + entry_days[active], return_inverse=True)
+    cell_quantities = np.bincount(cell_of_entry, weights=quantities[active])
+    cell_products = cells // days
+    total = np.bincount(cell_products, weights=cell_quantities, minlength=len(product_ids))
+    squares = np.bincount(cell_products, weights=cell_quantities * cell_quantities, minlength=len(product_ids))
+    mean = total / days
+    std = np.sqrt(np.maximum(squares / days - mean * mean, 0))
+
+    z = NormalDist().inv_cdf(service_level)
+    reorder_point = np.ceil(mean * lead_time + z * std * math.sqrt(lead_time)).astype(np.int64)
+    cycle = lead_time + review_days
+    order_up_to = np.ceil(mean * cycle + z * std * math.sqrt(cycle)).astype(np.int64)
+
+    on_hand = _per_product(product_ids, ProductStockSummary.objects.values_list("product_id", "on_hand"))
+    incoming = _per_product(
+        product_ids,
+        OperationLine.objects.filter(operation__type="RECEIPT", operation__status__in=OPEN_STATUSES)
+        .values("product_id").annotate(quantity=Sum("quantity")).values_list("product_id", "quantity"),
+    )
+    position = on_hand + incoming
+    order_quantity = np.where(
+        (mean > 0) & (position <= reorder_point), np.maximum(order_up_to - position, 0), 0
+    )
+    return {
+        "product_id": product_ids,
+        "on_hand": on_hand,
+        "incoming": incoming,
+        "daily_demand": mean,
+        "demand_std": std,
+        "reorder_point": reorder_point,
+        "order_up_to": order_up_to,
+        "order_quantity": order_quantity,
+    }
+
+
+def suggestions(plan):
+    """One dict per product to reorder, largest quantity first."""
+    rows = np.flatnonzero(plan["order_quantity"])
+    rows = rows[np.argsort(-plan["order_quantity"][rows], kind="stable")]
+    return [{key: values[row].item() for key, values in plan.items()} for row in rows]
+
+
+# ==========================
+# ACTING ON THE PLAN
+# ==========================
+
+def _suppliers(product_ids):
+    """{product_id: (partner_id, destination_location_id)} from each product's latest done receipt."""
+    return {
+        product_id: (partner_id, destination_id)
+        for product_id, partner_id, destination_id in OperationLine.objects.filter(
+            product_id__in=product_ids, operation__type="RECEIPT", operation__status="DONE"
+        )
+        .order_by("product_id", "-operation__created_at", "-operation_id")
+        .distinct("product_id")
+        .values_list("product_id", "operation__partner_id", "operation__destination_location_id")
+    }
+
+
+def create_receipts(rows, user=None, destination=None):
+    """
+    DRAFT receipts for the suggestion rows, one per (supplier, destination).
+    Products never received go on a receipt without a supplier to the
+    `destination` location, or are skipped when there is none. Returns the
+    receipts created and the rows skipped.
+    """
+    suppliers = _suppliers([row["product_id"] for row in rows])
+    destination_id = destination.pk if destination else None
+    groups, skipped = {}, []
+    for row in rows:
+        key = suppliers.get(row["product_id"], (None, destination_id))
+        if key[1] is None:
+            skipped.append(row)
+        else:
+            groups.setdefault(key, []).append(row)
+
+    receipts, lines = [], []
+    with transaction.atomic():
+        for (partner_id, destination_id), group in groups.items():
+            receipt = InventoryOperation.objects.create(
+                type="RECEIPT", status="DRAFT", partner_id=partner_id, destination_location_id=destination_id,
+                created_by=user, notes="Suggested by replenishment: stock position at or below the reorder point.",
+            )
+            receipts.append(receipt)
+            lines.extend(
+                OperationLine(operation=receipt, product_id=row["product_id"], quantity=row["order_quantity"])
+                for row in group
+            )
+        OperationLine.objects.bulk_create(lines)
+    return receipts, skipped
+
+
+def update_min_stock(plan):
+    """
+    Store the computed reorder points as Product.min_stock, so the dashboard's
+    below-minimum list follows demand. Products without deliveries in the
+    window keep the minimum someone typed in. Returns the products changed.
+    """
+    moved = plan["daily_demand"] > 0
+    qn = connection.ops.quote_name
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE {product} p SET min_stock = v.reorder_point
+                FROM unnest(%s::bigint[], %s::integer[]) AS v(id, reorder_point)
+                WHERE p.id = v.id AND p.min_stock <> v.reorder_point
+                RETURNING p.id
+                """.format(product=qn(Product._meta.db_table)),
+                [plan["product_id"][moved].tolist(), plan["reorder_point"][moved].tolist()],
+            )
+            changed = [pk for pk, in cursor.fetchall()]
+        if changed:
+            ProductStockSummary.refresh(product_ids=changed)
+            bump_stock_version()
+    return len(changed)
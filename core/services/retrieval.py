@@ -0,0 +1,398 @@
+"""
+Retrieval index for the chatbot prompt.
+
+Instead of dumping every product, warehouse, partner and operation into the
+prompt, each message is matched against an in-process BM25 index over those
+records and only the best matches are described, within a token budget.
+
+The index holds searchable text only (sku, name, category, reference, ...).
+Numbers that change all the time (stock, status) are read from the database
+for the selected records when the context is built. Stock movements do not
+touch the index; saving an operation (validating one included) re-indexes
+just that operation.
+
+Keeping it fresh across worker processes: signals (core/signals.py) append
+(kind, pk) to a change log in Django's cache, numbered by a shared sequence
+kept in the database (models.SharedCounter): two processes incrementing a
+cache key can take the same number. Before searching, each process replays
+the entries after the last sequence it saw and reloads just those records.
+If entries have expired, the backlog is too long, or mark_stale() was
+called (bulk imports), the index is rebuilt.
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+from array import array
+from collections import Counter, defaultdict
+from itertools import groupby
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+
+from ..models import InventoryOperation, Location, Partner, Product, SharedCounter, StockLevel, Warehouse
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-/_.][a-z0-9]+)*")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+DEFAULT_TOP_K = 20
+DEFAULT_TOKEN_BUDGET = 1500
+CHARS_PER_TOKEN = 4  # conservative estimate for English text and codes
+
+# Only the most recent operations are searchable; older ones are reached
+# through references on the operation pages
+INDEXED_OPERATIONS = 5000
+
+CHANGE_SEQUENCE = "chat-index:seq"
+CHANGE_TIMEOUT = 60 * 60
+MAX_REPLAYED_CHANGES = 2000
+FULL_REBUILD = "*"
+
+KINDS = ("product", "partner", "warehouse", "operation")
+COMMON_TERM_RATIO = 0.05
+COMMON_TERM_MIN_DOCS = 1000
+
+def tokenize(text):
+    """Lowercase words; codes like WH/IN/0007 or IMP-12 also yield their parts."""
+    tokens = []
+    for match in TOKEN_RE.findall(text.lower()):
+        tokens.append(match)
+        if not match.isalnum():
+            tokens.extend(re.findall(r"[a-z0-9]+", match))
+    return tokens
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class BM25Index:
+    """
+    Inverted index with BM25 scoring. Documents are (kind, pk) pairs, stored
+    as one int (pk << 2 | kind); each term's postings are a sorted array of
+    those ints, a document repeated once per occurrence, so a posting costs
+    8 bytes and a term frequency is a bisect.
+    """
+
+    def __init__(self):
+        self.postings = {}  # term -> sorted array('q') of docs
+        self.lengths = {}  # doc -> number of tokens
+        self.terms = {}  # doc -> its distinct terms, for removal
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @staticmethod
+    def doc(key):
+        kind, pk = key
+        return pk << 2 | KINDS.index(kind)
+
+    @staticmethod
+    def key(doc):
+        return KINDS[doc & 3], doc >> 2
+
+    def add(self, key, text):
+        doc = self.doc(key)
+        self.remove(key)
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        for term, tf in counts.items():
+            docs = self.postings.get(term)
+            if docs is None:
+                docs = self.postings[term] = array("q")
+            if not docs or docs[-1] < doc:
+                docs.extend([doc] * tf)  # the common case: a full rebuild adds docs in order
+            else:
+                at = bisect.bisect_left(docs, doc)
+                docs[at:at] = array("q", [doc] * tf)
+        self.terms[doc] = tuple(counts)
+        self.lengths[doc] = len(tokens)
+        self.total_length += len(tokens)
+
+    def remove(self, key):
+        doc = self.doc(key)
+        if doc not in self.lengths:
+            return
+        self.total_length -= self.lengths.pop(doc)
+        for term in self.terms.pop(doc):
+            docs = self.postings[term]
+            del docs[bisect.bisect_left(docs, doc):bisect.bisect_right(docs, doc)]
+            if not docs:
+                del self.postings[term]
+
+    def search(self, query, k=DEFAULT_TOP_K):
+        """
+        Return up to k (key, score) pairs, best first. Terms found in more
+        than COMMON_TERM_RATIO of the documents (e.g. a shared sku prefix)
+        only add to the scores of documents matched by rarer terms.
+        """
+        if not self.lengths:
+            return []
+        count = len(self.lengths)
+        average = self.total_length / count or 1
+        common_limit = max(COMMON_TERM_MIN_DOCS, int(count * COMMON_TERM_RATIO))
+
+        def bm25(doc, tf, idf):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc] / average)
+            return idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        def idf(df):
+            return math.log(1 + (count - df + 0.5) / (df + 0.5))
+
+        scores = defaultdict(float)
+        common = []
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            if len(docs) > common_limit:
+                # Postings length as df: a term rarely repeats within a document
+                common.append((docs, idf(len(docs))))
+                continue
+            matches = [(doc, sum(1 for _ in occurrences)) for doc, occurrences in groupby(docs)]
+            weight = idf(len(matches))
+            for doc, tf in matches:
+                scores[doc] += bm25(doc, tf, weight)
+        for docs, weight in common:
+            for doc in scores:
+                tf = bisect.bisect_right(docs, doc) - bisect.bisect_left(docs, doc)
+                if tf:
+                    scores[doc] += bm25(doc, tf, weight)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.key(doc), score) for doc, score in best]
+
+
+# ==========================
+# DOCUMENTS
+# ==========================
+
+def _product_texts(pks=None):
+    products = Product.objects.filter(is_active=True).order_by("pk")
+    if pks is not None:
+        products = products.filter(pk__in=pks)
+    for pk, sku, name, category in products.values_list("pk", "sku", "name", "category__name").iterator():
+        yield pk, f"{sku} {name} {category or ''}"
+
+
+def _partner_texts(pks=None):
+    partners = Partner.objects.order_by("pk")
+    if pks is not None:
+        partners = partners.filter(pk__in=pks)
+    for pk, name, partner_type, email in partners.values_list("pk", "name", "partner_type", "email").iterator():
+        yield pk, f"{name} {partner_type} partner {email}"
+
+
+def _warehouse_texts(pks=None):
+    warehouses = Warehouse.objects.prefetch_related(Prefetch("locations", queryset=Location.objects.only("name")))
+    if pks is not None:
+        warehouses = warehouses.filter(pk__in=pks)
+    for warehouse in warehouses:
+        locations = " ".join(location.name for location in warehouse.locations.all())
+        yield warehouse.pk, f"{warehouse.code} {warehouse.name} warehouse {locations}"
+
+
+def _operation_texts(pks=None):
+    operations = InventoryOperation.objects.all()
+    if pks is None:
+        operations = operations.order_by("-created_at", "-id")[:INDEXED_OPERATIONS]
+    else:
+        operations = operations.filter(pk__in=pks)
+    types = dict(InventoryOperation.OPERATION_TYPES)
+    for pk, reference, op_type, partner in operations.values_list("pk", "reference", "type", "partner__name"):
+        yield pk, f"{reference} {types.get(op_type, op_type)} {partner or ''}"
+
+
+TEXTS = {
+    "product": _product_texts,
+    "partner": _partner_texts,
+    "warehouse": _warehouse_texts,
+    "operation": _operation_texts,
+}
+
+
+# ==========================
+# CHANGE LOG
+# ==========================
+
+def _change_key(seq):
+    return f"chat-index:change:{seq}"
+
+
+def _current_sequence():
+    return SharedCounter.values(CHANGE_SEQUENCE)[CHANGE_SEQUENCE]
+
+
+def record_change(kind, pk):
+    """Queue a record for re-indexing in every process once the transaction commits."""
+
+    def append():
+        seq = SharedCounter.increment(CHANGE_SEQUENCE)
+        cache.set(_change_key(seq), (kind, pk), CHANGE_TIMEOUT)
+
+    transaction.on_commit(append)
+
+
+def mark_stale():
+    """Make every process rebuild its index (after bulk changes that bypass signals)."""
+    record_change(FULL_REBUILD, None)
+
+
+class RetrievalIndex:
+    """The process-wide index, synced with the change log before each search."""
+
+    def __init__(self):
+        self.index = BM25Index()
+        self.sequence = None
+        self.lock = threading.Lock()
+
+    def rebuild(self):
+        sequence = _current_sequence()  # read first: changes made while loading are replayed later
+        index = BM25Index()
+        for kind, texts in TEXTS.items():
+            for pk, text in texts():
+                index.add((kind, pk), text)
+        self.index, self.sequence = index, sequence
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    def _sync(self):
+        if self.sequence is None:
+            self.rebuild()
+            return
+        current = _current_sequence()
+        if current <= self.sequence:
+            return
+        if current - self.sequence > MAX_REPLAYED_CHANGES:
+            self.rebuild()
+            return
+        keys = [_change_key(seq) for seq in range(self.sequence + 1, current + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys) or any(kind == FULL_REBUILD for kind, _ in changes.values()):
+            self.rebuild()
+            return
+        changed = defaultdict(set)
+        for kind, pk in changes.values():
+            changed[kind].add(pk)
+        for kind, pks in changed.items():
+            found = dict(TEXTS[kind](pks))
+            for pk in pks:
+                if pk in found:
+                    self.index.add((kind, pk), found[pk])
+                else:
+                    self.index.remove((kind, pk))
+        self.sequence = current
+
+    def search(self, query, k=DEFAULT_TOP_K):
+        # Under the lock: an incremental sync changes the index's postings in place
+        with self.lock:
+            self._sync()
+            return self.index.search(query, k)
+
+
+_index = RetrievalIndex()
+
+
+def get_index():
+    return _index
+
+
+# ==========================
+# PROMPT CONTEXT
+# ==========================
+
+def _describe_products(pks):
+    products = Product.objects.filter(pk__in=pks).select_related("stock_summary").prefetch_related(
+        Prefetch(
+            "stock_levels",
+            queryset=StockLevel.objects.filter(quantity__gt=0).select_related("location__warehouse"),
+        )
+    )
+    lines = {}
+    for p in products:
+        total_stock = p.stock_summary.on_hand if hasattr(p, "stock_summary") else 0
+        stock_details = ", ".join(
+            f"{sl.location.warehouse.code}/{sl.location.name}: {sl.quantity}" for sl in p.stock_levels.all()
+        )
+        lines[p.pk] = (
+            f"- Product {p.sku}: {p.name} | Cost: ${p.cost} | Min Stock: {p.min_stock} | "
+            f"Total Stock: {total_stock} ({stock_details})"
+        )
+    return lines
+
+
+def _describe_partners(pks):
+    return {
+        p.pk: f"- Partner {p.name} ({p.partner_type}) {p.email}".rstrip()
+        for p in Partner.objects.filter(pk__in=pks)
+    }
+
+
+def _describe_warehouses(pks):
+    lines = {}
+    for wh in Warehouse.objects.filter(pk__in=pks).prefetch_related("locations"):
+        locs = ", ".join(l.name for l in wh.locations.all())
+        lines[wh.pk] = f"- Warehouse {wh.code} ({wh.name}): Locations [{locs}]"
+    return lines
+
+
+def _describe_operations(pks):
+    return {
+        op.pk: (
+            f"- {op.reference} ({op.get_type_display()}) Status: {op.status} "
+            f"Partner: {op.partner.name if op.partner else '-'} Date: {op.created_at.strftime('%Y-%m-%d')}"
+        )
+        for op in InventoryOperation.objects.filter(pk__in=pks).select_related("partner")
+    }
+
+
+DESCRIBE = {
+    "product": _describe_products,
+    "partner": _describe_partners,
+    "warehouse": _describe_warehouses,
+    "operation": _describe_operations,
+}
+
+
+def select_context(message, k=DEFAULT_TOP_K, token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Lines describing the top-k records for the message, best first, cut off
+    at token_budget. With no match, the most recent operations are used.
+    """
+    hits = [key for key, _ in get_index().search(message, k)]
+    if not hits:
+        hits = [("operation", pk) for pk in InventoryOperation.objects.order_by("-created_at", "-id").values_list(
+            "pk", flat=True
+        )[:10]]
+
+    by_kind = defaultdict(list)
+    for kind, pk in hits:
+        by_kind[kind].append(pk)
+    described = {}
+    for kind, pks in by_kind.items():
+        for pk, line in DESCRIBE[kind](pks).items():
+            described[(kind, pk)] = line
+
+    lines, used = [], 0
+    for key in hits:
+        line = described.get(key)
+        if line is None:
+            continue
+        cost = estimate_tokens(line) + 1
+        if used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+    return lines
+
+
+def build_context(message, k=DEFAULT_TOP_K, token_budget=DEFAULT_TOKEN_BUDGET):
+    """The DATABASE CONTEXT section of the chatbot prompt for one message."""
+    lines = select_context(message, k, token_budget)
+    return "DATABASE CONTEXT (records relevant to the question):\n" + ("\n".join(lines) or "- none found")
@@ -0,0 +1,179 @@
+"""
+Point-in-time stock from ledger checkpoints.
+
+StockLevel only holds the current quantity. A checkpoint stores the closing
+balance per (product, location) at an instant, derived from the stock
+ledger: the previous checkpoint plus the entries since, in one INSERT ..
+SELECT. Checkpoints are taken daily at local midnight by the
+take_stock_checkpoints command.
+
+stock_at(when) reads the checkpoint nearest to `when` (before or after) and
+applies the ledger entries between the two, so a query never replays more
+than about half a day of movements once daily checkpoints exist. Balances
+include every entry created strictly before `when`.
+
+A ledger entry's location is its source when it takes stock out and its
+destination (or, for adjustments, its source) when it brings stock in.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Case, F, Sum, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ..models import Location, StockCheckpoint, StockCheckpointBalance, StockLedgerEntry
+
+# Entries are dated when they are written, not when they commit; wait this
+# long after a cutoff before taking its checkpoint so slow transactions land
+SETTLE_DELAY = timedelta(hours=1)
+
+ENTRY_LOCATION = Case(
+    When(quantity_change__lt=0, then=F("source_location_id")),
+    default=Coalesce("destination_location_id", "source_location_id"),
+)
+
+
+def day_end(day):
+    """The instant a day's closing balance is taken: the following local midnight."""
+    return timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+# ==========================
+# TAKING CHECKPOINTS
+# ==========================
+
+def take_checkpoint(taken_at):
+    """Write the checkpoint at taken_at from the latest earlier checkpoint and the ledger since."""
+    previous = StockCheckpoint.objects.filter(taken_at__lt=taken_at).order_by("-taken_at").first()
+    qn = connection.ops.quote_name
+    where, params = "created_at < %s", [taken_at]
+    if previous is not None:
+        where, params = "created_at >= %s AND " + where, [previous.taken_at] + params
+    with transaction.atomic():
+        checkpoint = StockCheckpoint.objects.create(taken_at=taken_at)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO {balance} (checkpoint_id, product_id, location_id, quantity)
+                SELECT %s, product_id, location_id, SUM(quantity)
+                FROM (
+                    SELECT product_id, location_id, quantity FROM {balance} WHERE checkpoint_id = %s
+                    UNION ALL
+                    SELECT product_id,
+                           CASE WHEN quantity_change < 0 THEN source_location_id
+                                ELSE COALESCE(destination_location_id, source_location_id) END,
+                           quantity_change
+                    FROM {ledger}
+                    WHERE {where}
+                ) moves
+                WHERE location_id IS NOT NULL
+                GROUP BY product_id, location_id
+                HAVING SUM(quantity) <> 0
+                """.format(
+                    balance=qn(StockCheckpointBalance._meta.db_table),
+                    ledger=qn(StockLedgerEntry._meta.db_table),
+                    where=where,
+                ),
+                [checkpoint.pk, previous.pk if previous else None] + params,
+            )
+    return checkpoint
+
+
+def due_checkpoints(now=None):
+    """Daily cutoffs after the latest checkpoint (or the first ledger day) that have settled."""
+    now = now or timezone.now()
+    latest = StockCheckpoint.objects.order_by("-taken_at").values_list("taken_at", flat=True).first()
+    if latest is None:
+        first_entry = StockLedgerEntry.objects.order_by("created_at").values_list("created_at", flat=True).first()
+        if first_entry is None:
+            return []
+        latest = first_entry
+    due = []
+    cutoff = day_end(timezone.localdate(latest))
+    while cutoff + SETTLE_DELAY <= now:
+        due.append(cutoff)
+        cutoff = day_end(timezone.localdate(cutoff))
+    return due
+
+
+def invalidate_from(moment):
+    """Drop checkpoints that should have included ledger entries dated at or after `moment`."""
+    return StockCheckpoint.objects.filter(taken_at__gt=moment).delete()[1].get(StockCheckpoint._meta.label, 0)
+
+
+# ==========================
+# POINT-IN-TIME QUERIES
+# ==========================
+
+def nearest_checkpoint(when):
+    before = StockCheckpoint.objects.filter(taken_at__lte=when).order_by("-taken_at").first()
+    after = StockCheckpoint.objects.filter(taken_at__gt=when).order_by("taken_at").first()
+    if before is None or after is None:
+        return before or after
+    return before if when - before.taken_at <= after.taken_at - when else after
+
+
+def _location_filter(warehouse_id=None, location_ids=None):
+    if location_ids is not None:
+        return list(location_ids)
+    if warehouse_id is not None:
+        return list(Location.objects.filter(warehouse_id=warehouse_id).values_list("pk", flat=True))
+    return None
+
+
+def ledger_deltas(start, end, location_ids=None, product_ids=None):
+    """(product_id, location_id, change) for ledger entries created in [start, end)."""
+    entries = StockLedgerEntry.objects.filter(created_at__lt=end)
+    if start is not None:
+        entries = entries.filter(created_at__gte=start)
+    if product_ids is not None:
+        entries = entries.filter(product_id__in=product_ids)
+    entries = entries.annotate(entry_location=ENTRY_LOCATION).filter(entry_location__isnull=False)
+    if location_ids is not None:
+        entries = entries.filter(entry_location__in=location_ids)
+    return (
+        entries.values("product_id", "entry_location")
+        .annotate(change=Sum("quantity_change"))
+        .values_list("product_id", "entry_location", "change")
+    )
+
+
+def stock_at(when, warehouse_id=None, location_ids=None, product_ids=None):
+    """
+    {(product_id, location_id): quantity} of non-zero balances as of `when`,
+    optionally limited to a warehouse, some locations and/or some products.
+    """
+    location_ids = _location_filter(warehouse_id, location_ids)
+    balances = {}
+    checkpoint = nearest_checkpoint(when)
+    if checkpoint is None:
+        start, end, sign = None, when, 1
+    else:
+        rows = StockCheckpointBalance.objects.filter(checkpoint=checkpoint)
+        if location_ids is not None:
+            rows = rows.filter(location_id__in=location_ids)
+        if product_ids is not None:
+            rows = rows.filter(product_id__in=product_ids)
+        for product_id, location_id, quantity in rows.values_list("product_id", "location_id", "quantity"):
+            balances[product_id, location_id] = quantity
+        if checkpoint.taken_at <= when:
+            start, end, sign = checkpoint.taken_at, when, 1
+        else:  # walk back from a later checkpoint
+            start, end, sign = when, checkpoint.taken_at, -1
+
+    for product_id, location_id, change in ledger_deltas(start, end, location_ids, product_ids):
+        balances[product_id, location_id] = balances.get((product_id, location_id), 0) + sign * change
+    return {key: quantity for key, quantity in balances.items() if quantity}
+
+
+def stock_diff(start, end, warehouse_id=None, location_ids=None, product_ids=None):
+    """{(product_id, location_id): (quantity at start, quantity at end)} where the two differ."""
+    location_ids = _location_filter(warehouse_id, location_ids)
+    before = stock_at(start, location_ids=location_ids, product_ids=product_ids)
+    after = stock_at(end, location_ids=location_ids, product_ids=product_ids)
+    return {
+        key: (before.get(key, 0), after.get(key, 0))
+        for key in before.keys() | after.keys()
+        if before.get(key, 0) != after.get(key, 0)
+    }
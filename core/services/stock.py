@@ -0,0 +1,312 @@
+"""
+Stock movement engine.
+
+Every path that turns an InventoryOperation into stock changes (the four
+validate views, the admin action and the management commands) goes through
+validate_operation(). All lines of an operation are applied with set-based
+statements inside one transaction, so the number of queries does not depend
+on the number of lines.
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ..caching import bump_stock_version
+from ..models import (
+    InventoryOperation, OperationLine, StockLevel, StockLedgerEntry, Product, ProductStockSummary,
+    StockValuationCell, Location,
+)
+
+
+class StockMovementError(Exception):
+    """Base error for operations that cannot be validated."""
+
+
+class AlreadyValidated(StockMovementError):
+    pass
+
+
+class EmptyOperation(StockMovementError):
+    pass
+
+
+class MissingLocation(StockMovementError):
+    pass
+
+
+class InsufficientStock(StockMovementError):
+    def __init__(self, sku, available, required):
+        self.sku = sku
+        self.available = available
+        self.required = required
+        super().__init__(f"Insufficient stock for {sku}. Available: {available}, Required: {required}")
+
+
+# ==========================
+# MOVEMENT PLANS
+# ==========================
+
+def _movements(operation):
+    """
+    Return (location_id, sign) pairs describing where the lines of an
+    operation land. Raises MissingLocation when a required side is not set.
+    """
+    if operation.type == "RECEIPT":
+        if not operation.destination_location_id:
+            raise MissingLocation("Destination location is required.")
+        return [(operation.destination_location_id, 1)]
+    if operation.type == "DELIVERY":
+        if not operation.source_location_id:
+            raise MissingLocation("Source location is required.")
+        return [(operation.source_location_id, -1)]
+    if operation.type == "INTERNAL":
+        if not operation.source_location_id or not operation.destination_location_id:
+            raise MissingLocation("Source and destination locations are required.")
+        return [(operation.source_location_id, -1), (operation.destination_location_id, 1)]
+    # ADJUST: line quantity is the signed difference at the counted location
+    if not operation.source_location_id:
+        raise MissingLocation("Location is required.")
+    return [(operation.source_location_id, 1)]
+
+
+def _tables():
+    qn = connection.ops.quote_name
+    return {
+        "stock": qn(StockLevel._meta.db_table),
+        "line": qn(OperationLine._meta.db_table),
+        "product": qn(Product._meta.db_table),
+        "ledger": qn(StockLedgerEntry._meta.db_table),
+    }
+
+
+# ==========================
+# SET-BASED STATEMENTS
+# ==========================
+
+def _lock_rows(cursor, operation_id, location_ids):
+    """
+    Lock every existing StockLevel row the operation touches, always in
+    (product_id, location_id) order so concurrent validations queue behind
+    each other instead of deadlocking.
+    """
+    cursor.execute(
+        """
+        SELECT id FROM {stock}
+        WHERE location_id IN ({locations})
+          AND product_id IN (SELECT product_id FROM {line} WHERE operation_id = %s)
+        ORDER BY product_id, location_id
+        FOR UPDATE
+        """.format(locations=", ".join(["%s"] * len(location_ids)), **_tables()),
+        [*location_ids, operation_id],
+    )
+
+
+def _decrement(cursor, operation_id, location_id):
+    """
+    Take SUM(line.quantity) per product out of the location with a
+    conditional UPDATE ... WHERE quantity >= required. If fewer rows are
+    updated than the operation has products, some product is short and
+    InsufficientStock is raised (the caller's transaction rolls back).
+    """
+    cursor.execute(
+        """
+        WITH required AS (
+            SELECT product_id, SUM(quantity) AS quantity
+            FROM {line}
+            WHERE operation_id = %s
+            GROUP BY product_id
+        ), updated AS (
+            UPDATE {stock} s SET quantity = s.quantity - r.quantity
+            FROM required r
+            WHERE s.product_id = r.product_id AND s.location_id = %s
+              AND s.quantity >= r.quantity
+            RETURNING s.id
+        )
+        SELECT (SELECT COUNT(*) FROM required), (SELECT COUNT(*) FROM updated)
+        """.format(**_tables()),
+        [operation_id, location_id],
+    )
+    expected, updated = cursor.fetchone()
+    if not expected:
+        raise EmptyOperation("Cannot validate an operation without line items.")
+    if updated < expected:
+        raise InsufficientStock(*_shortfall(cursor, operation_id, location_id))
+
+
+def _shortfall(cursor, operation_id, location_id):
+    """Return (sku, available, required) for the first product the location cannot cover."""
+    cursor.execute(
+        """
+        SELECT p.sku, COALESCE(s.quantity, 0), l.required
+        FROM (
+            SELECT product_id, SUM(quantity) AS required
+            FROM {line}
+            WHERE operation_id = %s
+            GROUP BY product_id
+        ) l
+        JOIN {product} p ON p.id = l.product_id
+        LEFT JOIN {stock} s ON s.product_id = l.product_id AND s.location_id = %s
+        WHERE COALESCE(s.quantity, 0) < l.required
+        ORDER BY p.sku
+        LIMIT 1
+        """.format(**_tables()),
+        [operation_id, location_id],
+    )
+    return cursor.fetchone()
+
+
+def _upsert(cursor, operation_id, location_id, sign):
+    """
+    Add sign * SUM(line.quantity) per product to the location in one
+    INSERT ... ON CONFLICT statement. Returns the number of products touched.
+    """
+    cursor.execute(
+        """
+        INSERT INTO {stock} (product_id, location_id, quantity)
+        SELECT product_id, %s, %s * SUM(quantity)
+        FROM {line}
+        WHERE operation_id = %s
+        GROUP BY product_id
+        ORDER BY product_id
+        ON CONFLICT (product_id, location_id)
+        DO UPDATE SET quantity = {stock}.quantity + EXCLUDED.quantity
+        """.format(**_tables()),
+        [location_id, sign, operation_id],
+    )
+    return cursor.rowcount
+
+
+def _adjust(cursor, operation, location_id, created_at):
+    """
+    Apply an adjustment's signed SUM(line.quantity) per product, stopping at
+    zero, and record the change actually applied in the ledger: one entry
+    per product that changed, on its first line. The UPDATE joins each row to itself as
+    it was before the statement, so the applied change comes out of the same
+    statement that makes it. Returns the number of products adjusted.
+    """
+    cursor.execute(
+        """
+        INSERT INTO {stock} (product_id, location_id, quantity)
+        SELECT DISTINCT product_id, %s, 0 FROM {line} WHERE operation_id = %s
+        ORDER BY product_id
+        ON CONFLICT (product_id, location_id) DO NOTHING
+        """.format(**_tables()),
+        [location_id, operation.pk],
+    )
+    cursor.execute(
+        """
+        WITH required AS (
+            SELECT product_id, SUM(quantity) AS quantity, MIN(id) AS line_id
+            FROM {line}
+            WHERE operation_id = %s
+            GROUP BY product_id
+        ), applied AS (
+            UPDATE {stock} s SET quantity = GREATEST(s.quantity + r.quantity, 0)
+            FROM required r, {stock} before
+            WHERE s.product_id = r.product_id AND s.location_id = %s AND before.id = s.id
+            RETURNING r.product_id, r.line_id, s.quantity - before.quantity AS change
+        ), logged AS (
+            INSERT INTO {ledger} (
+                operation_id, line_id, product_id,
+                source_location_id, destination_location_id,
+                quantity_change, unit_cost, created_at
+            )
+            SELECT %s, a.line_id, a.product_id, %s, %s, a.change, p.cost, %s
+            FROM applied a
+            JOIN {product} p ON p.id = a.product_id
+            WHERE a.change <> 0
+            ORDER BY a.line_id
+        )
+        SELECT COUNT(*) FROM applied
+        """.format(**_tables()),
+        [
+            operation.pk, location_id,
+            operation.pk, operation.source_location_id, operation.destination_location_id, created_at,
+        ],
+    )
+    return cursor.fetchone()[0]
+
+
+def _insert_ledger(cursor, operation, sign, created_at):
+    """
+    One signed StockLedgerEntry per line. The entry moves stock out of
+    source_location when negative and into destination_location when positive.
+    """
+    cursor.execute(
+        """
+        INSERT INTO {ledger} (
+            operation_id, line_id, product_id,
+            source_location_id, destination_location_id,
+            quantity_change, unit_cost, created_at
+        )
+        SELECT l.operation_id, l.id, l.product_id, %s, %s, %s * l.quantity, p.cost, %s
+        FROM {line} l
+        JOIN {product} p ON p.id = l.product_id
+        WHERE l.operation_id = %s
+        ORDER BY l.id
+        """.format(**_tables()),
+        [
+            operation.source_location_id, operation.destination_location_id,
+            sign, created_at, operation.pk,
+        ],
+    )
+
+
+# ==========================
+# PUBLIC API
+# ==========================
+
+def write_ledger(operation, created_at=None):
+    """
+    Write the ledger entries for an operation: one per line, or two per line
+    (out of source, into destination) for internal transfers. Adjustments
+    validated by validate_operation() record the change actually applied
+    instead; for a past adjustment only the requested change is known.
+    """
+    created_at = created_at or timezone.now()
+    with connection.cursor() as cursor:
+        for _, sign in _movements(operation):
+            _insert_ledger(cursor, operation, sign, created_at)
+
+
+def validate_operation(operation):
+    """
+    Apply all lines of an operation to StockLevel, record them in the stock
+    ledger, refresh the product summaries and valuation cells and mark the
+    operation DONE.
+
+    The operation row and the affected StockLevel rows are locked for the
+    duration of the transaction, so the same document cannot be validated
+    twice and two documents cannot oversell the same stock. Raises a
+    StockMovementError subclass (and rolls back) when it cannot be applied.
+    """
+    with transaction.atomic():
+        operation = InventoryOperation.objects.select_for_update().get(pk=operation.pk)
+        if operation.status == "DONE":
+            raise AlreadyValidated(f'"{operation.reference}" has already been validated.')
+
+        movements = _movements(operation)
+        location_ids = [location_id for location_id, _ in movements]
+        with connection.cursor() as cursor:
+            _lock_rows(cursor, operation.pk, location_ids)
+            StockValuationCell.shift(-1, operation_id=operation.pk, location_ids=location_ids)
+            if operation.type == "ADJUST":
+                (location_id, _), = movements
+                if not _adjust(cursor, operation, location_id, timezone.now()):
+                    raise EmptyOperation("Cannot validate an operation without line items.")
+            else:
+                for location_id, sign in movements:
+                    if sign < 0:
+                        _decrement(cursor, operation.pk, location_id)
+                    elif not _upsert(cursor, operation.pk, location_id, sign):
+                        raise EmptyOperation("Cannot validate an operation without line items.")
+        if operation.type != "ADJUST":
+            write_ledger(operation)
+        # Locks go stock rows, valuation cells, summaries, wherever they are taken
+        StockValuationCell.shift(1, operation_id=operation.pk, location_ids=location_ids)
+        if operation.type != "INTERNAL":  # transfers do not change product totals
+            ProductStockSummary.refresh(operation_id=operation.pk)
+        bump_stock_version(*Location.objects.filter(pk__in=location_ids).values_list("warehouse_id", flat=True))
+
+        operation.status = "DONE"
+        operation.save(update_fields=["status"])
+    return operation
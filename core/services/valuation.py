@@ -0,0 +1,97 @@
+"""
+Inventory valuation: on-hand quantity x Product.cost.
+
+One query computes every level of the report from the maintained
+StockValuationCell rows, which hold stock already summed per (location,
+category) (see core.models and the stock movement engine). GROUPING SETS
+rolls those cells up per location, per warehouse, per category within each
+warehouse, per category overall, and into the grand total. GROUPING()
+tells a rolled-up row apart from a real NULL (products without a category),
+so nothing is aggregated in Python and neither the query nor its row count
+depends on the number of products or stock rows. "lines" counts stock rows
+(product/location pairs) with a non-zero quantity.
+
+The report is still cached per filter, against the stock version
+(core.caching), which validations, direct stock edits and product changes
+bump.
+"""
+from django.db import connection
+
+from ..caching import cached_block
+from ..models import Category, Location, StockValuationCell, Warehouse
+
+# GROUPING(warehouse, location, category): a bit is set when the column is rolled up
+LEVELS = {
+    0b001: "location",
+    0b011: "warehouse",
+    0b010: "warehouse_category",
+    0b110: "category",
+    0b111: "total",
+}
+
+COLUMNS = [
+    "level", "warehouse_id", "warehouse", "location_id", "location", "category_id", "category",
+    "lines", "quantity", "value",
+]
+
+
+def _sql(warehouse_id=None, category_id=None):
+    qn = connection.ops.quote_name
+    where, params = ["v.lines <> 0"], []
+    if warehouse_id is not None:
+        where.append("l.warehouse_id = %s")
+        params.append(warehouse_id)
+    if category_id is not None:
+        where.append("v.category_id = %s")
+        params.append(category_id)
+    return (
+        """
+        SELECT GROUPING(w.id, l.id, c.id),
+               w.id, w.code, l.id, l.name, c.id, c.name,
+               SUM(v.lines)::bigint, SUM(v.quantity)::bigint, SUM(v.value)
+        FROM {cell} v
+        JOIN {location} l ON l.id = v.location_id
+        JOIN {warehouse} w ON w.id = l.warehouse_id
+        LEFT JOIN {category} c ON c.id = v.category_id
+        WHERE {where}
+        GROUP BY GROUPING SETS (
+            (w.id, w.code, l.id, l.name),
+            (w.id, w.code),
+            (w.id, w.code, c.id, c.name),
+            (c.id, c.name),
+            ()
+        )
+        ORDER BY GROUPING(w.id, l.id, c.id) DESC, w.code, l.name, c.name NULLS LAST
+        """.format(
+            cell=qn(StockValuationCell._meta.db_table),
+            location=qn(Location._meta.db_table),
+            warehouse=qn(Warehouse._meta.db_table),
+            category=qn(Category._meta.db_table),
+            where=" AND ".join(where),
+        ),
+        params,
+    )
+
+
+def _query(warehouse_id=None, category_id=None):
+    with connection.cursor() as cursor:
+        cursor.execute(*_sql(warehouse_id, category_id))
+        return [
+            dict(zip(COLUMNS, (LEVELS[grouping], *row[:-2], row[-2] or 0, row[-1] or 0)))
+            for grouping, *row in cursor.fetchall()
+        ]
+
+
+def valuation(warehouse_id=None, category_id=None):
+    """Report rows (dicts with the COLUMNS keys), cached for the current stock version."""
+    # The global version, even for one warehouse: cost edits only bump that one
+    return cached_block(f"valuation:{warehouse_id}:{category_id}", lambda: _query(warehouse_id, category_id))
+
+
+def by_level(rows):
+    """{level: [rows]}, with "total" as a single row (zeros when there is no stock)."""
+    levels = {level: [] for level in LEVELS.values()}
+    for row in rows:
+        levels[row["level"]].append(row)
+    levels["total"] = levels["total"][0] if levels["total"] else {"lines": 0, "quantity": 0, "value": 0}
+    return levels
@@ -0,0 +1,126 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .caching import bump_stock_version
+from .models import (
+    Category, InventoryOperation, Location, Partner, Product, ProductStockSummary, StockLevel, StockValuationCell,
+    Warehouse,
+)
+from .services import retrieval
+
+
+# Valuation cells are refreshed before summaries: the stock movement engine
+# locks cells first, and locks are always taken in that order
+
+@receiver(pre_save, sender=Product)
+def remember_product_valuation(sender, instance, **kwargs):
+    instance._valuation_before = instance.pk and (
+        Product.objects.filter(pk=instance.pk).values_list("category_id", "cost").first()
+    )
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_valuation(sender, instance, **kwargs):
+    before = instance._valuation_before
+    cost = Product._meta.get_field("cost").to_python(instance.cost)
+    if before == (instance.category_id, cost):
+        return
+    StockValuationCell.refresh(
+        location_ids=list(StockLevel.objects.filter(product=instance).values_list("location_id", flat=True)),
+        category_ids={instance.category_id, before[0]} if before else [instance.category_id],
+    )
+
+
+@receiver(pre_delete, sender=Product)
+def remember_product_locations(sender, instance, **kwargs):
+    instance._valuation_locations = list(
+        StockLevel.objects.filter(product=instance).values_list("location_id", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Product)
+def refresh_deleted_product_valuation(sender, instance, **kwargs):
+    # Its stock rows went with it, uncounted (see refresh_deleted_stock_level_valuation)
+    StockValuationCell.refresh(location_ids=instance._valuation_locations, category_ids=[instance.category_id])
+
+
+@receiver(post_delete, sender=Category)
+def refresh_uncategorized_valuation(sender, instance, **kwargs):
+    # The category's products now have none; its own cells went with it
+    StockValuationCell.refresh(category_ids=[None])
+
+
+def _refresh_stock_level_cell(level):
+    category_ids = list(Product.objects.filter(pk=level.product_id).values_list("category_id", flat=True))
+    if category_ids:  # a fixture may load stock before its product
+        StockValuationCell.refresh(location_ids=[level.location_id], category_ids=category_ids)
+
+
+@receiver(post_save, sender=StockLevel)
+def refresh_stock_level_valuation(sender, instance, **kwargs):
+    # Direct edits (admin, fixtures); the stock movement engine shifts cells itself
+    _refresh_stock_level_cell(instance)
+
+
+@receiver(post_delete, sender=StockLevel)
+def refresh_deleted_stock_level_valuation(sender, instance, origin=None, **kwargs):
+    # Rows deleted along with their product or location are left to the
+    # product's refresh or to the cascade (one refresh, not one per row)
+    if isinstance(origin, StockLevel) or isinstance(origin, QuerySet) and origin.model is StockLevel:
+        _refresh_stock_level_cell(instance)
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_summary(sender, instance, **kwargs):
+    # Every product has a summary row (the products grid joins on it), and
+    # below_min follows min_stock edits; fixtures (raw saves) included
+    ProductStockSummary.refresh(product_ids=[instance.pk])
+
+
+@receiver(post_save, sender=StockLevel)
+def refresh_fixture_stock_summary(sender, instance, raw=False, **kwargs):
+    # Stock loaded from fixtures, in whichever order the products come: a
+    # product loaded later is summed by refresh_product_summary
+    if raw:
+        ProductStockSummary.refresh(product_ids=[instance.product_id])
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=InventoryOperation)
+def invalidate_global_blocks(sender, instance, **kwargs):
+    bump_stock_version()
+
+
+@receiver([post_save, post_delete], sender=Warehouse)
+def invalidate_warehouse_blocks(sender, instance, **kwargs):
+    bump_stock_version(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Location)
+def invalidate_location_blocks(sender, instance, **kwargs):
+    bump_stock_version(instance.warehouse_id)
+
+
+@receiver([post_save, post_delete], sender=StockLevel)
+def invalidate_stock_level_blocks(sender, instance, **kwargs):
+    # Direct edits (admin); the stock movement engine bumps versions itself
+    # (the location may already be gone when this runs as part of a cascade)
+    bump_stock_version(*Location.objects.filter(pk=instance.location_id).values_list("warehouse_id", flat=True))
+
+
+CHAT_INDEX_KINDS = {Product: "product", Partner: "partner", Warehouse: "warehouse", InventoryOperation: "operation"}
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Partner)
+@receiver([post_save, post_delete], sender=Warehouse)
+@receiver([post_save, post_delete], sender=InventoryOperation)
+def reindex_chat_record(sender, instance, **kwargs):
+    retrieval.record_change(CHAT_INDEX_KINDS[sender], instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Location)
+def reindex_chat_warehouse(sender, instance, **kwargs):
+    # Warehouse documents list their locations
+    retrieval.record_change("warehouse", instance.warehouse_id)
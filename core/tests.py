@@ -1,3 +1,1519 @@
-from django.test import TestCase
+import base64
+import importlib
+import io
+import json
+import re
+import tempfile
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.core import serializers
+from django.core.exceptions import ValidationError
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from google.genai import types
+
+from users.models import User
+
+from .models import (
+    Category, CostingState, CostLayer, InventoryOperation, Location, OperationLine, Partner, PeriodCost,
+    Product, ProductStockSummary, ReconciliationMark, ReferenceSequence, SharedCounter, StockCheckpoint,
+    StockLedgerEntry, StockLevel, StockValuationCell, UnitOfMeasure, Warehouse,
+)
+from .services import (
+    assistant, charts, chat_router, chat_tools, costing, importer, lines, reconcile, replenishment, retrieval,
+    snapshots, stock, valuation,
+)
+from . import search
+from .pagination import decode_cursor, encode_cursor, keyset_paginate
+
+
+LOCMEM_CACHES = {
+    alias: {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": alias}
+    for alias in ("default", "stock_versions")
+}
+
+
+class StubModels:
+    """Replays canned responses and records the contents it was sent."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def generate_content(self, model, contents, config):
+        self.calls.append(list(contents))
+        return self.responses.pop(0)
+
+
+class StubClient:
+    def __init__(self, *responses):
+        self.models = StubModels(responses)
+
+
+def function_call(name, **args):
+    return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(
+        role="model", parts=[types.Part(function_call=types.FunctionCall(name=name, args=args))],
+    ))])
+
+
+def text(value):
+    return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(
+        role="model", parts=[types.Part.from_text(text=value)],
+    ))])
+
+
+class FakeModelServer(ThreadingHTTPServer):
+    """
+    A local stand-in for the Gemini API's streamGenerateContent endpoint. Each
+    request is answered with the next canned list of chunks, sent as SSE; the
+    request bodies are kept in .requests.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeModelHandler)
+        self.replies = []
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeModelHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.server.requests.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+        if ":streamGenerateContent" not in self.path or not self.server.replies:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for chunk in self.server.replies.pop(0):
+            self.wfile.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+def text_chunk(value):
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": value}]}}]}
+
+
+def call_chunk(name, **args):
+    return {"candidates": [{"content": {"role": "model", "parts": [{"functionCall": {"name": name, "args": args}}]}}]}
+
+
+class StockEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        warehouse = Warehouse.objects.create(name="Main", code="WH1")
+        cls.stock = Location.objects.create(warehouse=warehouse, name="Stock")
+        cls.shelf = Location.objects.create(warehouse=warehouse, name="Shelf")
+        cls.bolt = Product.objects.create(sku="BOLT-1", name="Hex bolt")
+        cls.nut = Product.objects.create(sku="NUT-1", name="Hex nut")
+
+    def operation(self, op_type, lines, source=None, destination=None):
+        operation = InventoryOperation.objects.create(type=op_type, source_location=source, destination_location=destination)
+        for product, quantity in lines:
+            OperationLine.objects.create(operation=operation, product=product, quantity=quantity)
+        return operation
+
+    def validate(self, *args, **kwargs):
+        return stock.validate_operation(self.operation(*args, **kwargs))
+
+    def levels(self):
+        return sorted(StockLevel.objects.values_list("product__sku", "location__name", "quantity"))
+
+    def test_receipt_delivery_and_transfer(self):
+        # Two lines of one product are applied together
+        operation = self.validate("RECEIPT", [(self.bolt, 30), (self.bolt, 10), (self.nut, 5)], destination=self.stock)
+        self.assertEqual(operation.status, "DONE")
+        self.validate("DELIVERY", [(self.bolt, 15)], source=self.stock)
+        self.validate("INTERNAL", [(self.bolt, 5), (self.nut, 5)], source=self.stock, destination=self.shelf)
+        self.assertEqual(self.levels(), [
+            ("BOLT-1", "Shelf", 5), ("BOLT-1", "Stock", 20), ("NUT-1", "Shelf", 5), ("NUT-1", "Stock", 0),
+        ])
+        self.assertEqual(ProductStockSummary.objects.get(product=self.bolt).on_hand, 25)
+
+    def test_insufficient_stock_rolls_back_every_line(self):
+        self.validate("RECEIPT", [(self.bolt, 10), (self.nut, 10)], destination=self.stock)
+        operation = self.operation("DELIVERY", [(self.bolt, 5), (self.nut, 11)], source=self.stock)
+        with self.assertRaisesMessage(stock.InsufficientStock, "NUT-1. Available: 10, Required: 11"):
+            stock.validate_operation(operation)
+        self.assertEqual(self.levels(), [("BOLT-1", "Stock", 10), ("NUT-1", "Stock", 10)])
+        operation.refresh_from_db()
+        self.assertEqual(operation.status, "DRAFT")
+        self.assertFalse(operation.ledger_entries.exists())
+
+    def test_validating_twice_is_refused(self):
+        operation = self.validate("RECEIPT", [(self.bolt, 10)], destination=self.stock)
+        with self.assertRaises(stock.AlreadyValidated):
+            stock.validate_operation(operation)
+        self.assertEqual(self.levels(), [("BOLT-1", "Stock", 10)])
+
+    def test_unusable_operations(self):
+        with self.assertRaises(stock.MissingLocation):
+            self.validate("DELIVERY", [(self.bolt, 1)])
+        with self.assertRaises(stock.EmptyOperation):
+            self.validate("RECEIPT", [], destination=self.stock)
+
+    def test_adjustments_are_signed_and_stop_at_zero(self):
+        self.validate("RECEIPT", [(self.bolt, 10)], destination=self.stock)
+        self.validate("ADJUST", [(self.bolt, -3), (self.nut, 4)], source=self.stock)
+        self.assertEqual(self.levels(), [("BOLT-1", "Stock", 7), ("NUT-1", "Stock", 4)])
+        self.validate("ADJUST", [(self.bolt, -20)], source=self.stock)
+        self.assertEqual(self.levels(), [("BOLT-1", "Stock", 0), ("NUT-1", "Stock", 4)])
+
+    def test_ledger_records_the_applied_adjustment(self):
+        self.validate("RECEIPT", [(self.bolt, 10)], destination=self.stock)
+        adjust = self.validate("ADJUST", [(self.bolt, -15), (self.bolt, -5)], source=self.stock)
+        self.validate("RECEIPT", [(self.bolt, 5)], destination=self.stock)
+        self.assertEqual(
+            list(StockLedgerEntry.objects.filter(operation=adjust).values_list("quantity_change", flat=True)), [-10]
+        )
+        ledger = StockLedgerEntry.objects.filter(product=self.bolt).aggregate(total=Sum("quantity_change"))["total"]
+        self.assertEqual(ledger, StockLevel.objects.get(product=self.bolt, location=self.stock).quantity)
+        self.assertEqual(ledger, 5)
+
+    def test_product_summary_follows_min_stock(self):
+        self.validate("RECEIPT", [(self.bolt, 10)], destination=self.stock)
+        self.assertFalse(ProductStockSummary.objects.get(product=self.bolt).below_min)
+        self.bolt.min_stock = 11
+        self.bolt.save()
+        self.assertTrue(ProductStockSummary.objects.get(product=self.bolt).below_min)
+
+    def test_products_loaded_from_fixtures_get_a_summary(self):
+        washer = Product.objects.create(sku="WASH-1", name="Washer")
+        level = StockLevel.objects.create(product=washer, location=self.stock, quantity=7)
+        # Stock before its product, as a fixture may list them
+        fixture = serializers.serialize("json", [level, washer])
+        washer.delete()
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as file:
+            file.write(fixture)
+            file.flush()
+            call_command("loaddata", file.name, verbosity=0)
+        self.assertEqual(ProductStockSummary.objects.get(product__sku="WASH-1").on_hand, 7)
+
+    def test_rebuild_stock_summary(self):
+        self.validate("RECEIPT", [(self.bolt, 10)], destination=self.stock)
+        ProductStockSummary.objects.filter(product=self.bolt).update(on_hand=3)
+        ProductStockSummary.objects.filter(product=self.nut).delete()
+        out = io.StringIO()
+        StockValuationCell.objects.all().delete()
+        with self.assertRaisesMessage(CommandError, "3 summaries do not match"):
+            call_command("rebuild_stock_summary", check=True, stdout=out)
+        self.assertIn("BOLT-1: StockLevel total 10, summary 3", out.getvalue())
+        self.assertIn(f"Location {self.stock.pk}, category None: StockLevel (lines, quantity, value) (1, 10,", out.getvalue())
+        call_command("rebuild_stock_summary", stdout=io.StringIO())
+        call_command("rebuild_stock_summary", check=True, stdout=io.StringIO())
+        self.assertEqual(
+            sorted(ProductStockSummary.objects.values_list("product__sku", "on_hand")), [("BOLT-1", 10), ("NUT-1", 0)]
+        )
+
+
+
+class StockLockingTests(TransactionTestCase):
+    """Validations from concurrent threads, each on its own connection."""
+
+    WORKERS = 12
+
+    def setUp(self):
+        warehouse = Warehouse.objects.create(name="Main", code="WH1")
+        self.shelf = Location.objects.create(warehouse=warehouse, name="Shelf")
+        self.overflow = Location.objects.create(warehouse=warehouse, name="Overflow")
+        self.products = [Product.objects.create(sku=f"SKU-{i}", name=f"Part {i}") for i in range(4)]
+        StockLevel.objects.bulk_create(StockLevel(product=p, location=self.shelf, quantity=20) for p in self.products)
+        StockValuationCell.refresh()
+        ProductStockSummary.refresh()
+
+    def operation(self, op_type, source=None, destination=None, quantity=3):
+        operation = InventoryOperation.objects.create(
+            type=op_type, source_location=source, destination_location=destination
+        )
+        # Lines in a different product order per operation
+        shift = operation.pk % len(self.products)
+        products = self.products[shift:] + self.products[:shift]
+        OperationLine.objects.bulk_create(
+            OperationLine(operation=operation, product=p, quantity=quantity) for p in products
+        )
+        return operation
+
+    def validate_concurrently(self, operations):
+        outcomes = []
+        barrier = threading.Barrier(len(operations))
+
+        def worker(operation):
+            try:
+                barrier.wait()
+                stock.validate_operation(operation)
+                outcomes.append("validated")
+            except stock.InsufficientStock:
+                outcomes.append("insufficient")
+            except Exception as e:
+                outcomes.append(repr(e))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(operation,)) for operation in operations]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_concurrent_deliveries_never_oversell(self):
+        operations = [
+            self.operation("INTERNAL", self.shelf, self.overflow) if i % 3 == 0
+            else self.operation("DELIVERY", self.shelf)
+            for i in range(self.WORKERS)
+        ]
+        outcomes = self.validate_concurrently(operations)
+        self.assertEqual(set(outcomes), {"validated", "insufficient"})
+        validated = outcomes.count("validated")
+        self.assertEqual(validated, 20 // 3)
+        moved = InventoryOperation.objects.filter(type="INTERNAL", status="DONE").count()
+        for product in self.products:
+            self.assertEqual(StockLevel.objects.get(product=product, location=self.shelf).quantity, 20 - 3 * validated)
+            overflow = StockLevel.objects.filter(product=product, location=self.overflow).first()
+            self.assertEqual(overflow.quantity if overflow else 0, 3 * moved)
+        call_command("rebuild_stock_summary", check=True, stdout=io.StringIO())
+
+    def test_deliveries_and_receipts_at_other_locations_do_not_deadlock(self):
+        # Disjoint StockLevel rows, shared summary rows
+        operations = [
+            self.operation("DELIVERY", self.shelf, quantity=1) if i % 2
+            else self.operation("RECEIPT", destination=self.overflow, quantity=1)
+            for i in range(self.WORKERS)
+        ]
+        self.assertEqual(self.validate_concurrently(operations), ["validated"] * self.WORKERS)
+        call_command("rebuild_stock_summary", check=True, stdout=io.StringIO())
+
+    def test_summary_counts_every_concurrent_validation(self):
+        operations = [
+            self.operation("RECEIPT", destination=self.shelf if i % 2 else self.overflow, quantity=i)
+            for i in range(1, self.WORKERS + 1)
+        ]
+        self.assertEqual(self.validate_concurrently(operations), ["validated"] * self.WORKERS)
+        call_command("rebuild_stock_summary", check=True, stdout=io.StringIO())
+        received = sum(range(1, self.WORKERS + 1))
+        self.assertEqual(
+            sorted(ProductStockSummary.objects.values_list("on_hand", flat=True)), [20 + received] * len(self.products)
+        )
+
+
+class OperationLinesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        warehouse = Warehouse.objects.create(name="Main", code="WH1")
+        cls.location = Location.objects.create(warehouse=warehouse, name="Stock")
+        cls.bolt = Product.objects.create(sku="BOLT-1", name="Hex bolt")
+        cls.nut = Product.objects.create(sku="NUT-1", name="Hex nut")
+        cls.old = Product.objects.create(sku="OLD-1", name="Retired bolt", is_active=False)
+        StockLevel.objects.create(product=cls.bolt, location=cls.location, quantity=10)
+
+    def delivery(self):
+        return InventoryOperation(type="DELIVERY", source_location=self.location)
+
+    def test_parse_lines(self):
+        bolt, nut = str(self.bolt.pk), str(self.nut.pk)
+        self.assertEqual(
+            lines.parse_lines([bolt, "", nut, bolt, nut], ["3", "5", "", "2", "0"]),
+            [(self.bolt.pk, 3), (self.bolt.pk, 2)],
+        )
+        for product_ids, quantities, message in [
+            ([bolt], ["-1"], "cannot be negative"),
+            ([bolt], ["two"], '"two" is not a valid quantity'),
+            (["bolt"], ["1"], '"bolt" is not a valid product'),
+            ([bolt], [str(2 ** 31)], "too large for a quantity"),
+        ]:
+            with self.assertRaisesMessage(lines.LineError, message):
+                lines.parse_lines(product_ids, quantities)
+
+    def test_parse_adjustment_lines(self):
+        bolt, nut = str(self.bolt.pk), str(self.nut.pk)
+        self.assertEqual(
+            lines.parse_adjustment_lines([bolt, nut, nut, ""], ["10", "", "4", "1"], ["7", "3", "4", "2"]),
+            [(self.bolt.pk, -3), (self.nut.pk, 3)],
+        )
+        with self.assertRaisesMessage(lines.LineError, "too large"):
+            lines.parse_adjustment_lines([bolt], [str(-(2 ** 31 - 1))], [str(2 ** 31 - 1)])
+
+    def test_duplicate_lines_are_kept_and_validated_together(self):
+        operation = lines.save_operation_with_lines(self.delivery(), [(self.bolt.pk, 4), (self.bolt.pk, 5)])
+        self.assertEqual(list(operation.lines.order_by("id").values_list("quantity", flat=True)), [4, 5])
+        stock.validate_operation(operation)
+        self.assertEqual(StockLevel.objects.get(product=self.bolt).quantity, 1)
+
+    def test_unknown_or_inactive_products_reject_the_document(self):
+        for product_ids, missing in [([self.old.pk], str(self.old.pk)), ([self.bolt.pk, 0, -5], "-5, 0")]:
+            with self.assertRaisesMessage(lines.LineError, f"Unknown or inactive product id(s): {missing}."):
+                lines.save_operation_with_lines(self.delivery(), [(pk, 1) for pk in product_ids])
+        with self.assertRaises(lines.NoLines):
+            lines.save_operation_with_lines(self.delivery(), [])
+        self.assertFalse(InventoryOperation.objects.exists())
+
+    def test_a_failed_line_insert_rolls_back_the_operation(self):
+        with mock.patch.object(OperationLine.objects, "bulk_create", side_effect=DatabaseError("line rejected")):
+            with self.assertRaises(DatabaseError):
+                lines.save_operation_with_lines(self.delivery(), [(self.bolt.pk, 1)])
+        self.assertFalse(InventoryOperation.objects.exists())
+        self.assertFalse(ReferenceSequence.objects.exists())  # the reference number is given back too
+
+    def test_create_view_reports_bad_lines(self):
+        self.client.force_login(User.objects.create_user(username="clerk", password="pw"))
+        response = self.client.post("/internal-transfers/create/", {
+            "source_location": self.location.pk, "destination_location": self.location.pk,
+            "scheduled_date": "2024-01-31", "products": [self.bolt.pk, self.old.pk], "quantities": [1, 1],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [str(message) for message in response.context["messages"]],
+            [f"Unknown or inactive product id(s): {self.old.pk}."],
+        )
+        self.assertFalse(InventoryOperation.objects.exists())
+
+
+class ReferenceNumberingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.main = Location.objects.create(warehouse=Warehouse.objects.create(name="Main", code="WH1"), name="Stock")
+        cls.depot = Location.objects.create(warehouse=Warehouse.objects.create(name="Depot", code="WH2"), name="Yard")
+        cls.year = timezone.now().year
+
+    def create(self, op_type, source=None, destination=None, **fields):
+        return InventoryOperation.objects.create(
+            type=op_type, source_location=source, destination_location=destination, **fields
+        ).reference
+
+    def test_numbers_per_warehouse_type_and_year(self):
+        year = self.year
+        self.assertEqual(
+            [
+                self.create("RECEIPT", destination=self.main),
+                self.create("RECEIPT", destination=self.main),
+                self.create("RECEIPT", destination=self.depot),
+                self.create("DELIVERY", source=self.main),
+                self.create("INTERNAL", source=self.depot, destination=self.main),
+                self.create("ADJUST", destination=self.main),
+                self.create("ADJUST"),
+            ],
+            [
+                f"WH1/IN/{year}/0001", f"WH1/IN/{year}/0002", f"WH2/IN/{year}/0001", f"WH1/OUT/{year}/0001",
+                f"WH2/MOVE/{year}/0001", f"WH1/ADJ/{year}/0001", f"WH/ADJ/{year}/0001",
+            ],
+        )
+        self.assertEqual(self.create("RECEIPT", destination=self.main, reference="KEEP/1"), "KEEP/1")
+        self.assertEqual(self.create("RECEIPT", destination=self.main), f"WH1/IN/{year}/0003")
+
+    def test_a_failed_save_gives_its_number_back(self):
+        with self.assertRaises(ValidationError):
+            self.create("RECEIPT", destination=self.main, scheduled_date="someday")
+        self.assertEqual(self.create("RECEIPT", destination=self.main), f"WH1/IN/{self.year}/0001")
+
+    def test_numbers_come_from_the_database_being_written(self):
+        with mock.patch("core.models.connection") as default_connection:
+            self.assertEqual(
+                ReferenceSequence.next_number(self.main.pk, "RECEIPT", 2024, using="default"), ("WH1", 1)
+            )
+            InventoryOperation(type="DELIVERY", source_location=self.depot).save(using="default")
+        default_connection.cursor.assert_not_called()
+        self.assertEqual(ReferenceSequence.objects.get(operation_type="DELIVERY").warehouse_code, "WH2")
+
+    def test_sequences_are_seeded_from_existing_references(self):
+        seed_sequences = importlib.import_module("core.migrations.0005_reference_sequence").seed_sequences
+        for reference in [
+            "WH1/IN/2024/0007", "WH1/IN/2024/0012", "WH1/OUT/2024/0003", "WH2/IN/2023/0040",
+            "legacy-17", "WH1/XX/2024/0099", "WH1/IN/soon/0001", "WH1/IN/2024/00x1",
+        ]:
+            InventoryOperation.objects.create(type="RECEIPT", reference=reference)
+        seed_sequences(apps, None)
+        self.assertEqual(
+            set(ReferenceSequence.objects.values_list("warehouse_code", "operation_type", "year", "last_number")),
+            {("WH1", "RECEIPT", 2024, 12), ("WH1", "DELIVERY", 2024, 3), ("WH2", "RECEIPT", 2023, 40)},
+        )
+        self.assertEqual(ReferenceSequence.next_number(self.main.pk, "RECEIPT", 2024), ("WH1", 13))
+
+
+class ImporterTests(TestCase):
+    CSV = (
+        "sku,name,min_stock,cost\n"
+        "BOLT-1,Hex bolt,5,1.25\n"
+        "NUT-1,Hex nut,0,100000000\n"
+        "NUT-2,Wing nut,0,0.125\n"
+        "NUT-3,Lock nut,0,NaN\n"
+        "NUT-4,Cap nut,2147483648,1\n"
+        "WASHER-1,Washer,0,2.50000\n"
+    )
+
+    def import_csv(self, data):
+        rejected = []
+        report = importer.import_products(
+            io.StringIO(data), fmt="csv", on_reject=lambda line, record, reason: rejected.append((line, reason))
+        )
+        return report, rejected
+
+    def test_out_of_range_values_reject_only_their_row(self):
+        report, rejected = self.import_csv(self.CSV)
+        self.assertEqual((report.products, report.rejected), (2, 4))
+        self.assertEqual([line for line, _ in rejected], [3, 4, 5, 6])
+        self.assertIn("min_stock out of range", rejected[3][1])
+        self.assertEqual(
+            sorted(Product.objects.values_list("sku", "cost")),
+            [("BOLT-1", Decimal("1.25")), ("WASHER-1", Decimal("2.50"))],
+        )
+
+    def test_admin_import(self):
+        url = "/admin/core/product/import/"
+        staff = User.objects.create_user(username="clerk", password="pw", is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(User.objects.create_superuser(username="admin", password="pw"))
+        upload = io.BytesIO("\ufeffsku,name\nBOLT-1,Hex bolt\n".encode())
+        upload.name = "products.csv"
+        self.assertEqual(self.client.post(url, {"file": upload, "format": "csv"}).status_code, 302)
+        self.assertEqual(Product.objects.get().sku, "BOLT-1")
+
+        upload = io.BytesIO("sku,name\nNUT-1,Écrou\n".encode("latin-1"))
+        upload.name = "products.csv"
+        response = self.client.post(url, {"file": upload, "format": "csv"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("not UTF-8", str(response.context["form"].errors["file"]))
+        self.assertFalse(Product.objects.filter(sku="NUT-1").exists())
+
+    def test_units_are_matched_by_name(self):
+        UnitOfMeasure.objects.create(name="Kilogram", abbreviation="kg")
+        report, rejected = self.import_csv(
+            "sku,name,uom\n"
+            "A-1,Flour,Kilogram\n"
+            "A-2,Sugar,kg\n"
+            "A-3,Rope,Metre reel 100\n"
+            "A-4,Cable,Metre reel 250\n"
+            "A-5,Wire,Metre reel 250\n"
+            f"A-6,Tape,{'x' * 51}\n"
+        )
+        self.assertEqual((report.products, rejected), (5, [(7, "uom longer than 50 characters")]))
+        units = dict(Product.objects.values_list("sku", "uom__abbreviation"))
+        self.assertEqual(units, {
+            "A-1": "kg", "A-2": "kg~2", "A-3": "Metre reel", "A-4": "Metre re~2", "A-5": "Metre re~2",
+        })
+        self.assertEqual(UnitOfMeasure.objects.get(abbreviation="Metre re~2").name, "Metre reel 250")
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Broad matches first, so they lead the table's natural order
+        cls.broad = [
+            Product.objects.create(sku=f"HW-{i}", name=f"Galvanised carriage bolt with square neck, pack {i}")
+            for i in range(5)
+        ]
+        cls.bolt = Product.objects.create(sku="BOLT", name="Bolt")
+        cls.nut = Product.objects.create(sku="NUT-1", name="Hex nut", is_active=False)
+        location = Location.objects.create(warehouse=Warehouse.objects.create(name="Main", code="WH1"), name="Stock")
+        cls.receipt = InventoryOperation.objects.create(type="RECEIPT", destination_location=location)
+        OperationLine.objects.create(operation=cls.receipt, product=cls.nut, quantity=1)
+        cls.other = InventoryOperation.objects.create(type="RECEIPT", destination_location=location)
+
+    def test_substring_match_on_name_or_sku(self):
+        products = Product.objects.all()
+        self.assertEqual(search.search_products(products, "  "), products)
+        self.assertEqual(set(search.search_products(products, "bolt")), {*self.broad, self.bolt})
+        self.assertEqual(list(search.search_products(products, "hw-3")), [self.broad[3]])
+        self.assertEqual(list(search.search_products(products.filter(is_active=False), "nut")), [self.nut])
+
+    def test_rank_orders_the_best_match_first(self):
+        ranked = search.search_products(Product.objects.all(), "bolt", rank=True)
+        self.assertEqual(ranked[0], self.bolt)
+        self.assertEqual(len(ranked), 6)
+
+    def test_rank_window_keeps_the_most_similar_matches(self):
+        with mock.patch.object(search, "RANK_CANDIDATES", 2):
+            ranked = list(search.search_products(Product.objects.all(), "bolt", rank=True))
+        self.assertEqual(len(ranked), 2)
+        self.assertEqual(ranked[0], self.bolt)
+
+    def test_operations_match_reference_or_line_products(self):
+        operations = InventoryOperation.objects.all()
+        self.assertEqual(list(search.search_operations(operations, "hex")), [self.receipt])
+        self.assertEqual(list(search.search_operations(operations, self.other.reference.lower())), [self.other])
+        self.assertEqual(list(search.search_operations(operations, "washer")), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ChatTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        retrieval.get_index().sequence = None  # rebuild from this test's data
+        assistant.reset_clients()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH1")
+        cls.location = Location.objects.create(warehouse=cls.warehouse, name="Stock")
+        cls.bolt = Product.objects.create(sku="BOLT-1", name="Hex bolt", min_stock=50)
+        cls.nut = Product.objects.create(sku="NUT-1", name="Hex nut", min_stock=0)
+        StockLevel.objects.create(product=cls.bolt, location=cls.location, quantity=20)
+        StockLevel.objects.create(product=cls.nut, location=cls.location, quantity=300)
+        ProductStockSummary.refresh()
+
+
+class ChatToolsTests(ChatTestCase):
+    def test_stock_by_sku(self):
+        result = chat_tools.run_tool("stock_by_sku", {"sku": "bolt-1"})
+        self.assertEqual(result["on_hand"], 20)
+        self.assertEqual(result["locations"], [{"warehouse": "WH1", "location": "Stock", "quantity": 20}])
+
+    def test_unknown_sku_is_an_error_result(self):
+        self.assertIn("error", chat_tools.run_tool("stock_by_sku", {"sku": "NOPE"}))
+
+    def test_missing_arguments_and_unknown_tool(self):
+        self.assertEqual(
+            chat_tools.run_tool("movement_totals", {"date_to": "2024-01-31", "sku": "BOLT-1"}),
+            {"error": "Missing arguments; movement_totals needs date_from."},
+        )
+        self.assertEqual(chat_tools.run_tool("drop_tables", {}), {"error": "Unknown tool 'drop_tables'."})
+
+    def test_other_type_errors_are_not_reported_as_missing_arguments(self):
+        function, spec = chat_tools.TOOLS["stock_by_sku"]
+        broken = mock.Mock(side_effect=TypeError("unsupported operand"))
+        with mock.patch.dict(chat_tools.TOOLS, {"stock_by_sku": (broken, spec)}):
+            with self.assertRaisesMessage(TypeError, "unsupported operand"):
+                chat_tools.run_tool("stock_by_sku", {"sku": "BOLT-1"})
+
+    def test_non_string_arguments(self):
+        self.assertEqual(chat_tools.run_tool("stock_by_sku", {"sku": 12}), {"error": "No product with SKU '12'."})
+        self.assertEqual(
+            chat_tools.run_tool("stock_by_warehouse", {"warehouse_code": ["WH1"]}),
+            {"error": "warehouse_code must be a string."},
+        )
+        self.assertEqual(
+            chat_tools.run_tool("search_operations", {"operation_type": {"op": "RECEIPT"}}),
+            {"error": "operation_type must be a string."},
+        )
+
+    def test_stock_by_warehouse_is_capped(self):
+        result = chat_tools.run_tool("stock_by_warehouse", {"warehouse_code": "wh1", "limit": 1})
+        self.assertEqual(result["total_quantity"], 320)
+        self.assertEqual(result["top_products"], [{"sku": "NUT-1", "name": "Hex nut", "quantity": 300}])
+
+    def test_low_stock(self):
+        result = chat_tools.run_tool("low_stock", {})
+        self.assertEqual(result["below_minimum"], 1)
+        self.assertEqual(result["products"][0]["sku"], "BOLT-1")
+
+    def test_movement_totals_include_the_last_day(self):
+        operation = InventoryOperation.objects.create(
+            type="RECEIPT", status="DONE", destination_location=self.location, scheduled_date=timezone.now().date(),
+        )
+        line = OperationLine.objects.create(operation=operation, product=self.bolt, quantity=20)
+        StockLedgerEntry.objects.create(
+            operation=operation, line=line, product=self.bolt, destination_location=self.location, quantity_change=20,
+        )
+        today = timezone.now().date()
+        result = chat_tools.run_tool("movement_totals", {
+            "date_from": (today - timedelta(days=1)).isoformat(), "date_to": today.isoformat(), "sku": "BOLT-1",
+        })
+        self.assertEqual(result["by_type"], [{"type": "RECEIPT", "entries": 1, "incoming": 20, "outgoing": 0}])
+        self.assertIn("error", chat_tools.run_tool("movement_totals", {"date_from": "soon", "date_to": "later"}))
+
+
+class RetrievalIndexTests(ChatTestCase):
+    def test_changes_are_replayed_into_the_index(self):
+        index = retrieval.get_index()
+        index.search("bolt")
+        before = index.sequence
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.nut.pk).update(name="Wing nut")
+            retrieval.record_change("product", self.nut.pk)
+            retrieval.record_change("product", self.bolt.pk)
+        self.assertEqual(SharedCounter.values(retrieval.CHANGE_SEQUENCE)[retrieval.CHANGE_SEQUENCE], before + 2)
+        self.assertEqual(index.search("wing")[0][0], ("product", self.nut.pk))
+        self.assertEqual(index.sequence, before + 2)
+
+    def test_index_is_searched_under_the_sync_lock(self):
+        index = retrieval.get_index()
+        index.search("bolt")
+        held = []
+        unlocked_search = index.index.search
+
+        def locked_search(query, k):
+            held.append(index.lock.locked())
+            return unlocked_search(query, k)
+
+        with mock.patch.object(index.index, "search", side_effect=locked_search):
+            self.assertEqual(index.search("bolt")[0][0], ("product", self.bolt.pk))
+        self.assertEqual(held, [True])
+
+
+class ChatRouterTests(ChatTestCase):
+    def intent(self, message):
+        answer = chat_router.route(message)
+        return answer.intent if answer else None
+
+    def test_greetings_alone_get_the_help_text(self):
+        for message in ("hi", "Hello!", "  help ?", "what can you do?"):
+            self.assertEqual(self.intent(message), "help", message)
+
+    def test_greeting_prefixed_questions_are_answered(self):
+        self.assertEqual(self.intent("hi, how much BOLT-1 do we have?"), "stock_for_sku")
+        self.assertEqual(self.intent("hello what's below minimum"), "below_minimum")
+        self.assertIsNone(self.intent("hey, why did we run out of nuts?"))
+
+    def test_lookups_and_fallback_are_counted(self):
+        chat_router.reset_stats()
+        self.assertIn("20", str(chat_router.route("how much bolt-1 do we have").reply))
+        self.assertEqual(self.intent("pending deliveries for wh1"), "open_operations")
+        self.assertIsNone(self.intent("write me a poem"))
+        stats = chat_router.stats()
+        self.assertEqual((stats["hits"], stats["fallbacks"]), (2, 1))
+
+
+class ConverseTests(ChatTestCase):
+    def test_tool_results_are_sent_back_to_the_model(self):
+        client = StubClient(function_call("stock_by_sku", sku="BOLT-1"), text("We have 20 hex bolts."))
+        result = assistant.converse(client, "do we have enough hex bolts?")
+
+        self.assertEqual(result.text, "We have 20 hex bolts.")
+        self.assertEqual(result.tool_calls, [("stock_by_sku", {"sku": "BOLT-1"})])
+        follow_up = client.models.calls[1][-1].parts[0].function_response
+        self.assertEqual(follow_up.name, "stock_by_sku")
+        self.assertEqual(follow_up.response["on_hand"], 20)
+
+    def test_prompt_lists_matching_records_best_first(self):
+        client = StubClient(text("ok"))
+        assistant.converse(client, "is the hex nut shelf full?")
+        prompt = client.models.calls[0][0].parts[0].text
+        self.assertLess(prompt.index("NUT-1"), prompt.index("BOLT-1"))
+
+    def test_chart_call_stops_the_loop(self):
+        client = StubClient(function_call("create_bar_chart", title="Stock", labels=["a"], values=[1]))
+        result = assistant.converse(client, "plot it")
+        self.assertEqual(result.chart["labels"], ["a"])
+        self.assertEqual(len(client.models.calls), 1)
+
+    def test_rounds_are_bounded(self):
+        client = StubClient(*[function_call("low_stock") for _ in range(assistant.MAX_TOOL_ROUNDS)])
+        result = assistant.converse(client, "keep going")
+        self.assertEqual(len(result.tool_calls), assistant.MAX_TOOL_ROUNDS)
+        self.assertIn("narrower", result.text)
+
+
+@override_settings(GEMINI_API_KEY="test-key")
+class ChatbotViewTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="chat", password="pw")
+        self.client.force_login(self.user)
+
+    def post(self, message):
+        return self.client.post("/chatbot/", {"message": message}, content_type="application/json").json()
+
+    def test_open_question_runs_the_tool_loop(self):
+        stub = StubClient(function_call("low_stock"), text("Only BOLT-1 needs reordering."))
+        with mock.patch("google.genai.Client", return_value=stub):
+            reply = self.post("Which items should purchasing look at first?")
+        self.assertEqual(reply["reply"], "Only BOLT-1 needs reordering.")
+        self.assertEqual(len(stub.models.calls), 2)
+
+    def test_simple_lookup_is_answered_without_the_model(self):
+        with mock.patch("google.genai.Client") as client:
+            reply = self.post("How much BOLT-1 do we have?")
+        client.assert_not_called()
+        self.assertEqual(reply["intent"], "stock_for_sku")
+
+    def test_chart_is_served_by_url(self):
+        stub = StubClient(function_call("create_bar_chart", title="Stock", labels=["BOLT-1", "NUT-1"], values=[20, 300]))
+        with mock.patch("google.genai.Client", return_value=stub):
+            reply = self.post("Plot stock for the hex parts")
+        url = reply["reply"].split('src="')[1].split('"')[0]
+        self.assertNotIn("base64", reply["reply"])
+
+        response = self.client.get(url)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertTrue(response.content.startswith(b"\x89PNG"))
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        self.assertEqual(self.client.get("/charts/unknown.png").status_code, 404)
+
+    def test_failed_render_is_a_retryable_503(self):
+        key = charts.store(charts.clean_spec({"title": "Stock", "labels": ["BOLT-1"], "values": [20]}))
+        future = mock.Mock()
+        future.result.side_effect = TimeoutError
+        pool = mock.Mock()
+        pool.submit.return_value = future
+        with mock.patch.object(charts, "_pool", pool):
+            response = self.client.get(f"/charts/{key}.png")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "5")
+            future.cancel.assert_called_once_with()
+
+            pool.submit.side_effect = BrokenProcessPool
+            self.assertEqual(self.client.get(f"/charts/{key}.png").status_code, 503)
+            pool.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+            self.assertIsNone(charts._pool)  # the next render starts a new pool
+
+
+def parse_events(body):
+    events = []
+    for raw in body.decode().strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in raw.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+@override_settings(GEMINI_API_KEY="test-key")
+class ChatbotStreamTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="chat", password="pw")
+        self.server = FakeModelServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.enterContext(override_settings(GEMINI_BASE_URL=self.server.base_url))
+
+    async def post(self, message):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post("/chatbot/stream/", {"message": message}, content_type="application/json")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        return parse_events(b"".join([chunk async for chunk in response.streaming_content]))
+
+    async def test_model_text_streams_in_pieces(self):
+        self.server.replies = [[text_chunk("We have "), text_chunk("20 hex bolts.")]]
+        events = await self.post("Are the hex bolts running out?")
+        self.assertEqual(events, [
+            ("delta", {"text": "We have "}), ("delta", {"text": "20 hex bolts."}), ("done", {}),
+        ])
+
+    async def test_tool_calls_run_between_streamed_rounds(self):
+        self.server.replies = [[call_chunk("stock_by_sku", sku="BOLT-1")], [text_chunk("20 on hand.")]]
+        events = await self.post("Are the hex bolts running out?")
+        self.assertEqual(events[0], ("delta", {"text": "20 on hand."}))
+        function_response = self.server.requests[1]["contents"][-1]["parts"][0]["functionResponse"]
+        self.assertEqual(function_response["response"]["on_hand"], 20)
+
+    async def test_chart_is_sent_as_a_reply(self):
+        self.server.replies = [[call_chunk("create_bar_chart", title="Stock", labels=["BOLT-1"], values=[20])]]
+        events = await self.post("Plot the hex bolts")
+        self.assertEqual(events[0][0], "reply")
+        self.assertIn("/charts/", events[0][1]["reply"])
+
+    async def test_simple_lookup_skips_the_model(self):
+        events = await self.post("How much BOLT-1 do we have?")
+        self.assertEqual(events[0][1]["intent"], "stock_for_sku")
+        self.assertEqual(self.server.requests, [])
+
+    async def test_model_failure_is_an_error_event(self):
+        events = await self.post("Are the hex bolts running out?")  # no reply queued: 404
+        self.assertEqual([event for event, _ in events], ["error", "done"])
+
+
+
+def table_rows(content):
+    """The cells of each body row of a rendered table, as whitespace-collapsed text."""
+    body = content.decode().split("<tbody>", 1)[1].split("</tbody>", 1)[0]
+    return [
+        [" ".join(re.sub(r"<[^>]+>", " ", cell).split()) for cell in re.findall(r"<td[^>]*>(.*?)</td>", row, re.S)]
+        for row in re.findall(r"<tr>(.*?)</tr>", body, re.S)
+    ]
+
+
+class ViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH1")
+        cls.stock = Location.objects.create(warehouse=cls.warehouse, name="Stock")
+        cls.shelf = Location.objects.create(warehouse=cls.warehouse, name="Shelf")
+        cls.bolt = Product.objects.create(sku="BOLT-1", name="Hex bolt")
+        cls.nut = Product.objects.create(sku="NUT-1", name="Hex nut")
+        cls.user = User.objects.create_user(username="clerk", password="pw")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    @classmethod
+    def validate(cls, op_type, lines, source=None, destination=None):
+        operation = InventoryOperation.objects.create(
+            type=op_type, source_location=source, destination_location=destination, created_by=cls.user
+        )
+        OperationLine.objects.bulk_create(
+            OperationLine(operation=operation, product=product, quantity=quantity) for product, quantity in lines
+        )
+        return stock.validate_operation(operation)
+
+
+class MoveHistoryViewTests(ViewTestCase):
+    def moves(self, **params):
+        response = self.client.get("/move-history/", params)
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content) if response.streaming else response.content
+        rows = [row for row in table_rows(content) if len(row) > 1]  # not the "no movements" row
+        return [(sku.split()[0], source, destination, quantity) for _, sku, source, destination, quantity, *_ in rows]
+
+    def test_each_entry_shows_its_own_location(self):
+        self.validate("RECEIPT", [(self.bolt, 10)], destination=self.stock)
+        self.validate("INTERNAL", [(self.bolt, 4)], source=self.stock, destination=self.shelf)
+        self.validate("ADJUST", [(self.nut, -3)], source=self.stock)  # nothing to take: no entry
+        expected = [
+            ("BOLT-1", "-", "WH1 - Shelf", "+4"),
+            ("BOLT-1", "WH1 - Stock", "-", "-4"),
+            ("BOLT-1", "-", "WH1 - Stock", "+10"),
+        ]
+        self.assertEqual(self.moves(), expected)
+        self.assertEqual(self.moves(stream=1), expected)
+        self.assertEqual(self.moves(location=self.shelf.pk, doc_type="RECEIPT"), [])
+
+
+class KeysetPaginationTests(ViewTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        start = timezone.make_aware(datetime(2024, 1, 1, 9))
+        # r1..r3 share a created_at, so their order (and the cursors) fall back to id
+        cls.receipts = []
+        for minutes in (0, 5, 5, 5, 10):
+            receipt = InventoryOperation.objects.create(type="RECEIPT", destination_location=cls.stock)
+            InventoryOperation.objects.filter(pk=receipt.pk).update(created_at=start + timedelta(minutes=minutes))
+            cls.receipts.append(InventoryOperation.objects.get(pk=receipt.pk))
+        cls.newest_first = cls.receipts[::-1]
+
+    def page(self, **params):
+        with mock.patch("core.views.OPERATION_LIST_PAGE_SIZE", 2):
+            response = self.client.get("/receipts/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.context["page"]
+
+    def test_walks_forward_and_back_through_ties(self):
+        r0, r1, r2, r3, r4 = self.receipts
+        first = self.page()
+        self.assertEqual(list(first), [r4, r3])
+        self.assertFalse(first.has_previous)
+        second = self.page(after=first.next_cursor)
+        self.assertEqual(list(second), [r2, r1])
+        last = self.page(after=second.next_cursor)
+        self.assertEqual((list(last), last.has_next), ([r0], False))
+
+        back = self.page(before=last.previous_cursor)
+        self.assertEqual(list(back), [r2, r1])
+        self.assertEqual((back.next_cursor, back.previous_cursor), (second.next_cursor, second.previous_cursor))
+        start = self.page(before=back.previous_cursor)
+        self.assertEqual((list(start), start.has_previous, start.next_cursor), ([r4, r3], False, first.next_cursor))
+
+    def test_single_page(self):
+        page = keyset_paginate(InventoryOperation.objects.all(), page_size=5)
+        self.assertEqual((list(page), page.has_next, page.has_previous), (self.newest_first, False, False))
+        self.assertEqual(list(keyset_paginate(InventoryOperation.objects.none())), [])
+
+    def test_past_either_end_is_empty(self):
+        oldest, newest = encode_cursor(self.receipts[0]), encode_cursor(self.receipts[-1])
+        for page in (self.page(after=oldest), self.page(before=newest)):
+            self.assertEqual((list(page), page.has_next, page.has_previous), ([], False, False))
+
+    def test_tampered_cursors_fall_back_to_the_first_page(self):
+        def token(raw):
+            return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+        tampered = [
+            "garbage!", "\u00e9", token(b"\xff|1"), token(b"yesterday|3"), token(b"a|b|c"),
+            token(b"2024-01-01T09:05:00+00:00|x"),
+        ]
+        for cursor in tampered:
+            self.assertEqual(list(self.page(after=cursor)), self.newest_first[:2])
+            self.assertEqual(list(self.page(before=cursor)), self.newest_first[:2])
+        # Well-formed but out of the id range: still a position, not a database error
+        huge = token(b"2024-01-01T09:05:00+00:00|99999999999999999999")
+        self.assertEqual(list(self.page(after=huge)), self.newest_first[1:3])
+        self.assertEqual(list(self.page(before=huge)), self.newest_first[:1])
+
+
+class ExportViewTests(ViewTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for day, product in [(10, cls.bolt), (31, cls.nut)]:
+            moment = timezone.make_aware(datetime(2024, 1, day, 23, 30))
+            cls.validate("RECEIPT", [(product, day)], destination=cls.stock)
+            operation = InventoryOperation.objects.latest("id")
+            InventoryOperation.objects.filter(pk=operation.pk).update(created_at=moment)
+            StockLedgerEntry.objects.filter(operation=operation).update(created_at=moment)
+
+    def export(self, kind, **params):
+        response = self.client.get(f"/exports/{kind}.ndjson", params)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+
+    def test_operations_by_date(self):
+        def skus(**params):
+            return [[line["sku"] for line in op["lines"]] for op in self.export("operations", **params)]
+
+        self.assertEqual(skus(), [["NUT-1"], ["BOLT-1"]])
+        self.assertEqual(skus(date_from="2024-01-10", date_to="2024-01-10"), [["BOLT-1"]])  # whole day
+        self.assertEqual(skus(date_from="2024-01-11"), [["NUT-1"]])
+        self.assertEqual(skus(date_to="2024-01-30", product=self.nut.pk), [])
+
+    def test_ledger_by_date(self):
+        def entries(**params):
+            return [(row["sku"], row["quantity_change"]) for row in self.export("ledger", **params)]
+
+        self.assertEqual(entries(), [("NUT-1", 31), ("BOLT-1", 10)])
+        self.assertEqual(entries(date_to="2024-01-31"), [("NUT-1", 31), ("BOLT-1", 10)])
+        self.assertEqual(entries(date_from="2024-01-31", location=self.stock.pk), [("NUT-1", 31)])
+        self.assertEqual(entries(date_from="2024-02-01"), [])
+
+    def test_malformed_dates_are_rejected_before_streaming(self):
+        for url in ("/exports/operations.csv", "/exports/ledger.ndjson", "/move-history/"):
+            for params in ({"date_from": "yesterday"}, {"date_to": "2024-02-30"}, {"date_to": "2024-01-31T00:00"}):
+                response = self.client.get(url, {**params, "stream": 1})
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.streaming)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AutocompleteViewTests(ViewTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.washer = Product.objects.create(sku="WASH-1", name="Flat washer for bolts", is_active=False)
+        StockLevel.objects.create(product=cls.bolt, location=cls.shelf, quantity=7)
+        cls.acme = Partner.objects.create(name="Acme", partner_type="customer")
+        cls.bolton = Partner.objects.create(name="Bolton Supply", partner_type="supplier")
+        cls.both = Partner.objects.create(name="Acme Trading", partner_type="both")
+
+    def setUp(self):
+        super().setUp()
+        caches["default"].clear()
+
+    def results(self, kind, **params):
+        response = self.client.get(f"/autocomplete/{kind}/", params)
+        self.assertEqual(response.status_code, 200)
+        return [(row["id"], row["text"]) for row in response.json()["results"]]
+
+    def test_products(self):
+        self.assertEqual(self.results("products", q="bolt"), [(self.bolt.pk, "BOLT-1 - Hex bolt")])
+        self.assertEqual(self.results("products", q="hex"), [
+            (self.bolt.pk, "BOLT-1 - Hex bolt"), (self.nut.pk, "NUT-1 - Hex nut"),
+        ])
+        response = self.client.get("/autocomplete/products/", {"q": "hex", "location": self.shelf.pk})
+        self.assertEqual([row["quantity"] for row in response.json()["results"]], [7, 0])
+        self.assertEqual(self.results("products", q="hex", location="x", page="x"), self.results("products", q="hex"))
+
+    def test_locations(self):
+        self.assertEqual(self.results("locations"), [(self.shelf.pk, "WH1 - Shelf"), (self.stock.pk, "WH1 - Stock")])
+        self.assertEqual(self.results("locations", q="sto"), [(self.stock.pk, "WH1 - Stock")])
+        self.assertEqual(self.results("locations", q="wh1", page=2), [])
+
+    def test_partners(self):
+        self.assertEqual(self.results("partners", q="acme"), [
+            (self.acme.pk, "Acme (customer)"), (self.both.pk, "Acme Trading (both)"),
+        ])
+        self.assertEqual(self.results("partners", type="supplier"), [
+            (self.both.pk, "Acme Trading (both)"), (self.bolton.pk, "Bolton Supply (supplier)"),
+        ])
+        self.assertEqual(len(self.results("partners", type="other")), 3)
+
+    def test_login_required(self):
+        self.client.logout()
+        self.assertEqual(self.client.get("/autocomplete/products/").status_code, 302)
+
+    def test_tampered_choices_are_form_errors(self):
+        for partner in ("abc", "1 OR 1=1", str(2 ** 70), str(self.bolton.pk)):
+            response = self.client.post("/deliveries/create/", {
+                "partner": partner, "source_location": self.stock.pk, "products": [self.bolt.pk], "quantities": [1],
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("partner", response.context["form"].errors)
+        response = self.client.post("/deliveries/create/", {"partner": self.acme.pk, "source_location": "x"})
+        self.assertIn(f'<option value="{self.acme.pk}" selected>Acme (customer)</option>', response.content.decode())
+
+
+class SnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH1")
+        cls.stock = Location.objects.create(warehouse=cls.warehouse, name="Stock")
+        cls.shelf = Location.objects.create(warehouse=cls.warehouse, name="Shelf")
+        cls.bolt = Product.objects.create(sku="BOLT-1", name="Hex bolt")
+        cls.day = timezone.localdate() - timedelta(days=3)
+        cls.moves = [
+            # (day offset, hour, type, source, destination, signed quantity)
+            (0, 9, "RECEIPT", None, cls.stock, 100),
+            (0, 15, "INTERNAL", cls.stock, cls.shelf, -30),
+            (0, 15, "INTERNAL", cls.stock, cls.shelf, 30),
+            (1, 10, "DELIVERY", cls.shelf, None, -10),
+            (2, 11, "ADJUST", cls.stock, cls.stock, -5),
+        ]
+        for offset, hour, op_type, source, destination, change in cls.moves:
+            operation = InventoryOperation.objects.create(
+                type=op_type, status="DONE", source_location=source, destination_location=destination,
+            )
+            line = OperationLine.objects.create(operation=operation, product=cls.bolt, quantity=abs(change))
+            entry = StockLedgerEntry.objects.create(
+                operation=operation, line=line, product=cls.bolt, source_location=source,
+                destination_location=destination, quantity_change=change,
+            )
+            StockLedgerEntry.objects.filter(pk=entry.pk).update(created_at=cls.at(offset, hour))
+
+    @classmethod
+    def at(cls, offset, hour):
+        return timezone.make_aware(datetime.combine(cls.day + timedelta(days=offset), time(hour)))
+
+    def balances(self, stock, shelf):
+        expected = {(self.bolt.pk, self.stock.pk): stock, (self.bolt.pk, self.shelf.pk): shelf}
+        return {key: quantity for key, quantity in expected.items() if quantity}
+
+    def test_replay_without_checkpoints(self):
+        self.assertEqual(snapshots.stock_at(self.at(0, 12)), self.balances(100, 0))
+        self.assertEqual(snapshots.stock_at(self.at(3, 0)), self.balances(65, 20))
+
+    def test_daily_checkpoints_agree_with_the_ledger(self):
+        due = snapshots.due_checkpoints()
+        self.assertEqual(due, [snapshots.day_end(self.day + timedelta(days=n)) for n in range(len(due))])
+        for taken_at in due:
+            snapshots.take_checkpoint(taken_at)
+        self.assertEqual(snapshots.due_checkpoints(), [])
+
+        closing = StockCheckpoint.objects.get(taken_at=snapshots.day_end(self.day))
+        self.assertEqual(
+            {(b.product_id, b.location_id): b.quantity for b in closing.balances.all()}, self.balances(70, 30)
+        )
+        # Before and after the nearest checkpoint
+        self.assertEqual(snapshots.stock_at(self.at(1, 9)), self.balances(70, 30))
+        self.assertEqual(snapshots.stock_at(self.at(1, 23)), self.balances(70, 20))
+        self.assertEqual(snapshots.stock_at(self.at(0, 14), location_ids=[self.shelf.pk]), {})
+
+    def test_diff_between_dates(self):
+        snapshots.take_checkpoint(snapshots.day_end(self.day))
+        diff = snapshots.stock_diff(snapshots.day_end(self.day), snapshots.day_end(self.day + timedelta(days=2)))
+        self.assertEqual(diff, {(self.bolt.pk, self.stock.pk): (70, 65), (self.bolt.pk, self.shelf.pk): (30, 20)})
+
+    def test_view(self):
+        self.client.force_login(User.objects.create_user(username="auditor", password="pw"))
+        response = self.client.get("/stock-as-of/", {"date": self.day.isoformat(), "location": self.shelf.pk})
+        self.assertEqual([row[2:] for row in response.context["rows"]], [(None, 30, None)])
+        response = self.client.get("/stock-as-of/", {"date": self.day.isoformat(), "compare": (self.day + timedelta(days=1)).isoformat()})
+        self.assertEqual([row[2:] for row in response.context["rows"]], [(30, 20, -10)])
+
+
+class ReconcileStockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH1")
+        cls.location = Location.objects.create(warehouse=cls.warehouse, name="Stock")
+        cls.bolt = Product.objects.create(sku="BOLT-1", name="Hex bolt")
+        cls.nut = Product.objects.create(sku="NUT-1", name="Hex nut")
+        cls.receive({cls.bolt: 40, cls.nut: 10})
+
+    @classmethod
+    def receive(cls, quantities):
+        operation = InventoryOperation.objects.create(type="RECEIPT", destination_location=cls.location)
+        for product, quantity in quantities.items():
+            OperationLine.objects.create(operation=operation, product=product, quantity=quantity)
+        stock.validate_operation(operation)
+
+    def reconcile(self, *args):
+        return call_command("reconcile_stock", "--workers", "1", *args, stdout=io.StringIO())
+
+    def level(self, product):
+        return StockLevel.objects.get(product=product, location=self.location).quantity
+
+    def test_drift_is_reported_and_repaired(self):
+        StockLevel.objects.filter(product=self.bolt).update(quantity=35)
+        with self.assertRaisesMessage(CommandError, "1 stock level(s) do not match"):
+            self.reconcile()
+        self.reconcile("--repair")
+        self.assertEqual(self.level(self.bolt), 40)
+        self.assertEqual(ProductStockSummary.objects.get(product=self.bolt).on_hand, 40)
+        self.reconcile("--full")
+
+    def test_incremental_runs_only_check_moved_products(self):
+        self.reconcile()
+        StockLevel.objects.filter(product=self.nut).update(quantity=3)
+        StockLevel.objects.filter(product=self.bolt).update(quantity=35)
+        # As if the bolt's receipt had been checked by an earlier run and the nut's had not
+        ReconciliationMark.objects.update(ledger_id=StockLedgerEntry.objects.filter(product=self.bolt).get().pk)
+        result = reconcile.reconcile_warehouse(self.warehouse.pk)
+        self.assertEqual((result["checked"], result["mismatches"]), (1, 1))
+        self.assertEqual(result["sample"], [("NUT-1", "Stock", 3, 10)])
+        self.assertEqual(reconcile.reconcile_warehouse(self.warehouse.pk, full=True)["mismatches"], 2)
+
+    def test_clamped_adjustment_matches_the_ledger(self):
+        adjust = InventoryOperation.objects.create(type="ADJUST", source_location=self.location)
+        OperationLine.objects.create(operation=adjust, product=self.bolt, quantity=-100)
+        stock.validate_operation(adjust)
+        self.receive({self.bolt: 5})
+        self.reconcile("--full")
+        self.assertEqual(self.level(self.bolt), 5)
+
+    def test_negative_balances_are_not_repaired(self):
+        self.reconcile()
+        # A backfilled adjustment that was clamped when it was applied
+        adjust = InventoryOperation.objects.create(type="ADJUST", source_location=self.location, status="DONE")
+        line = OperationLine.objects.create(operation=adjust, product=self.nut, quantity=-25)
+        StockLedgerEntry.objects.create(
+            operation=adjust, line=line, product=self.nut, source_location=self.location, quantity_change=-25
+        )
+        mark = ReconciliationMark.objects.get().ledger_id
+        with self.assertRaisesMessage(CommandError, "1 ledger balance(s) are negative"):
+            self.reconcile("--repair")
+        self.assertEqual(self.level(self.nut), 10)
+        self.assertEqual(ReconciliationMark.objects.get().ledger_id, mark)
+
+    def test_rebuild_regenerates_stock_levels(self):
+        StockLevel.objects.all().delete()
+        StockLevel.objects.create(product=self.nut, location=Location.objects.create(warehouse=self.warehouse, name="Bin"), quantity=9)
+        self.reconcile("--rebuild")
+        self.assertEqual(
+            sorted(StockLevel.objects.values_list("product__sku", "location__name", "quantity")),
+            [("BOLT-1", "Stock", 40), ("NUT-1", "Stock", 10)],
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ValuationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.hardware = Category.objects.create(name="Hardware")
+        cls.main = Warehouse.objects.create(name="Main", code="WH1")
+        cls.depot = Warehouse.objects.create(name="Depot", code="WH2")
+        cls.shelf = Location.objects.create(warehouse=cls.main, name="Shelf")
+        cls.bin = Location.objects.create(warehouse=cls.main, name="Bin")
+        cls.yard = Location.objects.create(warehouse=cls.depot, name="Yard")
+        cls.bolt = Product.objects.create(sku="BOLT-1", name="Hex bolt", category=cls.hardware, cost="0.50")
+        cls.pallet = Product.objects.create(sku="PAL-1", name="Pallet", cost="12.00")
+        for product, location, quantity in [
+            (cls.bolt, cls.shelf, 100), (cls.bolt, cls.bin, 20), (cls.bolt, cls.yard, 10), (cls.pallet, cls.yard, 3),
+        ]:
+            StockLevel.objects.create(product=product, location=location, quantity=quantity)
+
+    def values(self, rows, level):
+        return {
+            (row["warehouse"], row["location"], row["category"]): (row["quantity"], row["value"])
+            for row in rows if row["level"] == level
+        }
+
+    def test_every_level_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = valuation._query()
+        self.assertEqual(self.values(rows, "total"), {(None, None, None): (133, Decimal("101.00"))})
+        self.assertEqual(self.values(rows, "warehouse"), {
+            ("WH1", None, None): (120, Decimal("60.00")), ("WH2", None, None): (13, Decimal("41.00")),
+        })
+        self.assertEqual(self.values(rows, "location")[("WH1", "Bin", None)], (20, Decimal("10.00")))
+        # Products without a category are their own row, not mistaken for the rollup
+        self.assertEqual(self.values(rows, "category"), {
+            (None, None, "Hardware"): (130, Decimal("65.00")), (None, None, None): (3, Decimal("36.00")),
+        })
+        self.assertEqual(self.values(rows, "warehouse_category")[("WH2", None, None)], (3, Decimal("36.00")))
+
+    def assertCellsMatchStock(self):
+        def cells():
+            return {
+                (location, category): (lines, quantity, value)
+                for location, category, lines, quantity, value in StockValuationCell.objects.values_list(
+                    "location", "category", "lines", "quantity", "value"
+                )
+                if lines or quantity or value
+            }
+
+        maintained = cells()
+        StockValuationCell.refresh()
+        self.assertEqual(maintained, cells())
+
+    def receive(self, product, location, quantity, op_type="RECEIPT", source=None):
+        operation = InventoryOperation.objects.create(type=op_type, source_location=source, destination_location=location)
+        OperationLine.objects.create(operation=operation, product=product, quantity=quantity)
+        stock.validate_operation(operation)
+
+    def test_cells_follow_stock_cost_and_category(self):
+        self.assertCellsMatchStock()
+        washer = Product.objects.create(sku="WASH-1", name="Washer", category=self.hardware, cost="0.10")
+        self.receive(washer, self.bin, 50)
+        self.receive(self.bolt, self.yard, 10, op_type="INTERNAL", source=self.shelf)
+        self.receive(self.pallet, None, 3, op_type="DELIVERY", source=self.yard)
+        self.receive(self.bolt, None, -25, op_type="ADJUST", source=self.bin)
+        self.assertCellsMatchStock()
+        self.assertEqual(self.values(valuation._query(), "total"), {(None, None, None): (160, Decimal("60.00"))})
+
+        self.bolt.cost = "1.00"
+        self.bolt.save()
+        washer.category = Category.objects.create(name="Fasteners")
+        washer.save()
+        self.assertCellsMatchStock()
+        self.assertEqual(self.values(valuation._query(), "total"), {(None, None, None): (160, Decimal("115.00"))})
+
+        level = StockLevel.objects.get(product=self.bolt, location=self.shelf)
+        level.quantity = 1
+        level.save()
+        StockLevel.objects.get(product=self.bolt, location=self.yard).delete()
+        self.assertCellsMatchStock()
+        washer.category.delete()
+        self.assertCellsMatchStock()
+        washer.delete()
+        self.bin.delete()
+        self.assertCellsMatchStock()
+        self.assertEqual(self.values(valuation._query(), "total"), {(None, None, None): (1, Decimal("1.00"))})
+
+    def test_cells_follow_imports_and_repairs(self):
+        importer.import_products(io.StringIO(
+            "sku,name,category,cost,location,quantity\n"
+            "BOLT-1,Hex bolt,Hardware,0.75,WH2/Yard,12\n"
+            "PAL-1,Pallet,Hardware,12.00,,\n"
+        ), fmt="csv", load_balances=True)
+        self.assertCellsMatchStock()
+        self.assertEqual(
+            self.values(valuation._query(), "category"), {(None, None, "Hardware"): (135, Decimal("135.00"))}
+        )
+        # The stock set up here has no ledger entries: only the opening balance's +2 survives a repair
+        call_command("reconcile_stock", "--workers", "1", "--repair", stdout=io.StringIO())
+        self.assertCellsMatchStock()
+        self.assertEqual(self.values(valuation._query(), "category"), {(None, None, "Hardware"): (2, Decimal("1.50"))})
+
+    def test_filters(self):
+        rows = valuation._query(warehouse_id=self.depot.pk, category_id=self.hardware.pk)
+        self.assertEqual(self.values(rows, "total"), {(None, None, None): (10, Decimal("5.00"))})
+
+    def test_cached_until_stock_changes(self):
+        valuation.valuation()
+        with self.assertNumQueries(0):
+            valuation.valuation()
+        operation = InventoryOperation.objects.create(type="RECEIPT", destination_location=self.bin)
+        OperationLine.objects.create(operation=operation, product=self.bolt, quantity=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.validate_operation(operation)
+        self.assertEqual(valuation.by_level(valuation.valuation())["total"]["value"], Decimal("106.00"))
+
+    def test_export(self):
+        self.client.force_login(User.objects.create_user(username="accountant", password="pw"))
+        response = self.client.get("/exports/valuation.csv", {"warehouse": self.main.pk})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[:2], ["level,warehouse,location,category,lines,quantity,value", "total,,,,2,120,60.00"])
+
+    def test_stock_level_export_filters(self):
+        self.client.force_login(User.objects.create_user(username="accountant", password="pw"))
+
+        def rows(**params):
+            response = self.client.get("/exports/stock-levels.csv", params)
+            self.assertEqual(response.status_code, 200)
+            return len(b"".join(response.streaming_content).decode().splitlines()) - 1
+
+        self.assertEqual(rows(warehouse=self.main.pk), 2)
+        self.assertEqual(rows(warehouse=self.main.pk, location=self.bin.pk), 1)
+        # Malformed ids are ignored, not a server error
+        self.assertEqual(rows(warehouse="abc", location="1; DROP"), 4)
+
+
+class CostingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        warehouse = Warehouse.objects.create(name="Main", code="WH1")
+        cls.stock = Location.objects.create(warehouse=warehouse, name="Stock")
+        cls.shelf = Location.objects.create(warehouse=warehouse, name="Shelf")
+        cls.bolt = Product.objects.create(sku="BOLT-1", name="Hex bolt", cost="3.00")
+        cls.nut = Product.objects.create(sku="NUT-1", name="Hex nut", cost="0.50")
+        for day, op_type, product, change, unit_cost in [
+            # Moves are written in date order, as the stock engine would
+            (date(2026, 1, 5), "RECEIPT", cls.bolt, 10, "1.00"),
+            (date(2026, 1, 6), "RECEIPT", cls.nut, 4, "0.50"),
+            (date(2026, 1, 7), "DELIVERY", cls.nut, -1, "0.50"),
+            (date(2026, 1, 10), "RECEIPT", cls.bolt, 10, "2.00"),
+            (date(2026, 1, 20), "INTERNAL", cls.bolt, -5, "2.00"),
+            (date(2026, 1, 20), "INTERNAL", cls.bolt, 5, "2.00"),
+            (date(2026, 1, 25), "DELIVERY", cls.bolt, -15, "2.00"),
+            (date(2026, 2, 3), "ADJUST", cls.bolt, -2, "2.00"),
+            (date(2026, 2, 10), "DELIVERY", cls.bolt, -5, "3.00"),
+        ]:
+            cls.move(day, op_type, product, change, unit_cost)
+
+    @classmethod
+    def move(cls, day, op_type, product, change, unit_cost):
+        operation = InventoryOperation.objects.create(type=op_type, status="DONE")
+        line = OperationLine.objects.create(operation=operation, product=product, quantity=abs(change))
+        entry = StockLedgerEntry.objects.create(
+            operation=operation, line=line, product=product, quantity_change=change, unit_cost=unit_cost,
+            source_location=cls.stock if change < 0 else None, destination_location=cls.shelf if change > 0 else None,
+        )
+        StockLedgerEntry.objects.filter(pk=entry.pk).update(
+            created_at=timezone.make_aware(datetime.combine(day, time(12)))
+        )
+
+    def periods(self, method):
+        return {
+            (row.product.sku, row.period.month): (row.delivered_quantity, row.cogs, row.written_off_quantity, row.written_off_cost)
+            for row in PeriodCost.objects.filter(method=method).select_related("product")
+        }
+
+    def layers(self, method, product):
+        return list(
+            CostLayer.objects.filter(method=method, product=product)
+            .order_by("received_at", "pk").values_list("quantity", "unit_cost")
+        )
+
+    def assertCosted(self):
+        self.assertEqual(self.periods(costing.FIFO), {
+            ("NUT-1", 1): (1, Decimal("0.50"), 0, Decimal("0.00")),
+            ("BOLT-1", 1): (15, Decimal("20.00"), 0, Decimal("0.00")),
+            # 3 left at 2.00, then 2 issued before they were received, at the current cost
+            ("BOLT-1", 2): (5, Decimal("12.00"), 2, Decimal("4.00")),
+        })
+        self.assertEqual(self.layers(costing.FIFO, self.bolt), [(-2, Decimal("3.00"))])
+        self.assertEqual(self.layers(costing.FIFO, self.nut), [(3, Decimal("0.50"))])
+
+    def test_fifo_and_weighted_average(self):
+        call_command("run_costing", stdout=io.StringIO())
+        self.assertCosted()
+        self.assertEqual(self.periods(costing.AVERAGE)[("BOLT-1", 1)], (15, Decimal("22.50"), 0, Decimal("0.00")))
+        self.assertEqual(self.periods(costing.AVERAGE)[("BOLT-1", 2)], (5, Decimal("10.50"), 2, Decimal("3.00")))
+        self.assertEqual(self.layers(costing.AVERAGE, self.bolt), [(-2, Decimal("3.00"))])
+
+    def test_incremental_run_continues_from_closing_layers(self):
+        january = costing.run(costing.FIFO, now=timezone.make_aware(datetime(2026, 1, 31)))
+        self.assertEqual(january["entries"], 7)
+        self.assertEqual(self.layers(costing.FIFO, self.bolt), [(5, Decimal("2.00"))])
+        self.assertEqual(costing.run(costing.FIFO)["entries"], 2)
+        self.assertCosted()
+        self.assertEqual(costing.run(costing.FIFO)["entries"], 0)
+
+    def test_interrupted_run_resumes_after_last_segment(self):
+        write = costing._write
+        calls = []
+
+        def fail_second(method, results):
+            calls.append(list(results))
+            if len(calls) == 2:
+                raise RuntimeError("killed")
+            write(method, results)
+
+        with mock.patch.object(costing, "SEGMENT_PRODUCTS", 1):
+            with mock.patch.object(costing, "_write", fail_second), self.assertRaises(RuntimeError):
+                costing.run(costing.FIFO)
+            self.assertEqual(CostingState.objects.get(pk=costing.FIFO).run_product_id, self.bolt.pk)
+            result = costing.run(costing.FIFO)
+        self.assertEqual((result["resumed"], result["products"]), (True, 1))
+        self.assertCosted()
+
+    def test_backdated_entries_need_a_rebuild(self):
+        call_command("run_costing", "--method", "fifo", stdout=io.StringIO())
+        self.move(date(2026, 1, 1), "RECEIPT", self.bolt, 1, "1.00")
+        with self.assertRaisesMessage(CommandError, "rebuild the costing"):
+            call_command("run_costing", "--method", "fifo", stdout=io.StringIO())
+        call_command("run_costing", "--method", "fifo", "--rebuild", stdout=io.StringIO())
+        self.assertEqual(self.periods(costing.FIFO)[("BOLT-1", 1)], (15, Decimal("19.00"), 0, Decimal("0.00")))
+
+
+class ReplenishmentTests(TestCase):
+    today = date(2026, 3, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        warehouse = Warehouse.objects.create(name="Main", code="WH1")
+        cls.stock = Location.objects.create(warehouse=warehouse, name="Stock")
+        cls.acme = Partner.objects.create(name="Acme", partner_type="supplier")
+        cls.globex = Partner.objects.create(name="Globex", partner_type="supplier")
+        cls.bolt = Product.objects.create(sku="BOLT-1", name="Hex bolt", min_stock=5)
+        cls.gear = Product.objects.create(sku="GEAR-1", name="Gear")
+        cls.nut = Product.objects.create(sku="NUT-1", name="Hex nut", min_stock=5)
+        cls.old = Product.objects.create(sku="OLD-1", name="Retired", is_active=False)
+        cls.receipt(cls.acme, cls.bolt)
+        cls.receipt(cls.globex, cls.gear)
+        for offset in range(1, 11):
+            # The 10 days before today: bolts go 10 a day, gears 20 every other day in two deliveries
+            day = cls.today - timedelta(days=offset)
+            cls.deliver(day, cls.bolt, 10)
+            cls.deliver(day, cls.old, 10)
+            if offset % 2:
+                cls.deliver(day, cls.gear, 12)
+                cls.deliver(day, cls.gear, 8)
+        cls.deliver(cls.today, cls.bolt, 500)  # today is not history yet
+        ProductStockSummary.objects.update(on_hand=50)
+
+    @classmethod
+    def receipt(cls, partner, product):
+        operation = InventoryOperation.objects.create(
+            type="RECEIPT", status="DONE", partner=partner, destination_location=cls.stock,
+        )
+        OperationLine.objects.create(operation=operation, product=product, quantity=100)
+
+    @classmethod
+    def deliver(cls, day, product, quantity):
+        operation = InventoryOperation.objects.create(type="DELIVERY", status="DONE", source_location=cls.stock)
+        line = OperationLine.objects.create(operation=operation, product=product, quantity=quantity)
+        entry = StockLedgerEntry.objects.create(
+            operation=operation, line=line, product=product, source_location=cls.stock, quantity_change=-quantity,
+        )
+        StockLedgerEntry.objects.filter(pk=entry.pk).update(
+            created_at=timezone.make_aware(datetime.combine(day, time(12)))
+        )
+
+    def plan(self):
+        plan = replenishment.compute(days=10, today=self.today)
+        return {product_id: row for product_id, row in zip(plan["product_id"], zip(
+            plan["daily_demand"], plan["demand_std"], plan["reorder_point"], plan["order_up_to"], plan["order_quantity"]
+        ))}, plan
+
+    def test_reorder_levels(self):
+        rows, plan = self.plan()
+        self.assertNotIn(self.old.pk, rows)
+        # Steady demand needs no safety stock: 7 days of lead time, 21 days to the next order arriving
+        self.assertEqual(rows[self.bolt.pk], (10, 0, 70, 210, 160))
+        demand, std, reorder_point, _, _ = rows[self.gear.pk]
+        self.assertEqual((demand, std), (10, 10))
+        self.assertEqual(reorder_point, 114)  # 70 + 1.645 * 10 * sqrt(7)
+        self.assertEqual(rows[self.nut.pk], (0, 0, 0, 0, 0))
+        self.assertEqual([row["product_id"] for row in replenishment.suggestions(plan)], [self.gear.pk, self.bolt.pk])
+
+    def test_open_receipts_count_towards_the_position(self):
+        operation = InventoryOperation.objects.create(type="RECEIPT", destination_location=self.stock)
+        OperationLine.objects.create(operation=operation, product=self.bolt, quantity=30)
+        rows, _ = self.plan()
+        self.assertEqual(rows[self.bolt.pk][4], 0)
+
+    def test_draft_receipts_per_supplier(self):
+        _, plan = self.plan()
+        receipts, skipped = replenishment.create_receipts(replenishment.suggestions(plan))
+        self.assertEqual(skipped, [])
+        self.assertEqual(
+            sorted((r.partner.name, r.status, r.destination_location, [(l.product.sku, l.quantity) for l in r.lines.all()]) for r in receipts),
+            [("Acme", "DRAFT", self.stock, [("BOLT-1", 160)]), ("Globex", "DRAFT", self.stock, [("GEAR-1", 236)])],
+        )
+        rows, _ = self.plan()
+        self.assertEqual(rows[self.bolt.pk][4], 0)
+
+    def test_products_never_received_need_a_destination(self):
+        washer = Product.objects.create(sku="WASHER-1", name="Washer")
+        ProductStockSummary.objects.filter(product=washer).update(on_hand=0)
+        self.deliver(self.today - timedelta(days=1), washer, 30)
+        rows = [row for row in replenishment.suggestions(self.plan()[1]) if row["product_id"] == washer.pk]
+        receipts, skipped = replenishment.create_receipts(rows)
+        self.assertEqual((receipts, skipped), ([], rows))
+        receipts, skipped = replenishment.create_receipts(rows, destination=self.stock)
+        self.assertEqual(skipped, [])
+        self.assertEqual(
+            [(r.partner, r.destination_location, [l.product.sku for l in r.lines.all()]) for r in receipts],
+            [(None, self.stock, ["WASHER-1"])],
+        )
+
+    def test_update_min_stock(self):
+        _, plan = self.plan()
+        self.assertEqual(replenishment.update_min_stock(plan), 2)
+        self.assertEqual(Product.objects.get(pk=self.bolt.pk).min_stock, 70)
+        self.assertEqual(Product.objects.get(pk=self.nut.pk).min_stock, 5)
+        self.assertTrue(ProductStockSummary.objects.get(product=self.bolt).below_min)
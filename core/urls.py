@@ -8,6 +8,7 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     # Products
     path('products/', views.products_list, name='products_list'),
+    path('products/grid/', views.products_grid, name='products_grid'),
     path('products/create/', views.product_create, name='product_create'),
     path('products/<int:pk>/edit/', views.product_edit, name='product_edit'),
     # Categories
@@ -38,6 +39,14 @@ urlpatterns = [
     
     # Move History
     path('move-history/', views.move_history, name='move_history'),
+    path('stock-as-of/', views.stock_as_of, name='stock_as_of'),
+    path('valuation/', views.inventory_valuation, name='inventory_valuation'),
+    
+    # Exports (fmt: csv or ndjson)
+    path('exports/stock-levels.<str:fmt>', views.export_stock_levels, name='export_stock_levels'),
+    path('exports/operations.<str:fmt>', views.export_operations, name='export_operations'),
+    path('exports/ledger.<str:fmt>', views.export_ledger, name='export_ledger'),
+    path('exports/valuation.<str:fmt>', views.export_valuation, name='export_valuation'),
     
     # Warehouses
     path('warehouses/', views.warehouses_list, name='warehouses_list'),
@@ -46,11 +55,18 @@ urlpatterns = [
     # Locations
     path('locations/create/', views.location_create, name='location_create'),
     
+    # Autocomplete (JSON)
+    path('autocomplete/products/', views.autocomplete_products, name='autocomplete_products'),
+    path('autocomplete/locations/', views.autocomplete_locations, name='autocomplete_locations'),
+    path('autocomplete/partners/', views.autocomplete_partners, name='autocomplete_partners'),
+    
     # My Profile
     path('my-profile/', views.my_profile, name='my_profile'),
 
     #chatbot
     path('chatbot/', views.chatbot_view, name='chatbot'),
+    path('chatbot/stream/', views.chatbot_stream, name='chatbot_stream'),
+    path('charts/<slug:key>.png', views.chart_image, name='chart_image'),
 ]
 
 
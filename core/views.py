@@ -1,110 +1,94 @@
+import hashlib
+from datetime import date
+
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, Sum, Count, F, Value, IntegerField, Case, When
+from django.db.models import Q, Sum, Count, F, Value, IntegerField, Case, When, Exists, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.contrib.postgres.expressions import ArraySubquery
 from django.utils import timezone
 from django.contrib import messages
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils.html import format_html
+from django.views.decorators.http import etag
+from django.template.loader import get_template, render_to_string
 from .models import (
     Product, StockLevel, InventoryOperation, 
-    Warehouse, Location, Category, UnitOfMeasure, Partner, OperationLine, StockLedgerEntry
+    Warehouse, Location, Category, UnitOfMeasure, Partner, OperationLine, StockLedgerEntry,
+    ProductStockSummary
 )
 from .forms import (
     ProductForm, ReceiptForm, OperationLineForm, PartnerForm, 
     CategoryForm, UnitOfMeasureForm, DeliveryForm, 
     InternalTransferForm, StockAdjustmentForm, WarehouseForm, LocationForm
 )
+from .services import assistant, charts, chat_router, exports, lines, snapshots, stock, valuation
+from .pagination import paginate_request
+from .filters import (
+    PRODUCT_FILTERS, FilterError, filter_ledger_entries, filter_operations, filter_products, filter_stock_levels, has_product,
+    in_warehouse,
+)
+from . import grid, search
+from .search import search_operations, search_products
+from .caching import cached_block
 
 def home(request):
     return render(request, 'core/home.html')
 
-@login_required
-def dashboard(request):
-    # Get filter parameters
-    operation_type = request.GET.get('type', '')
-    status_filter = request.GET.get('status', '')
-    warehouse_filter = request.GET.get('warehouse', '')
-    category_filter = request.GET.get('category', '')
-    search_query = request.GET.get('search', '')
-    
-    # Calculate KPIs
-    
-    # Total Products in Stock: Count of active products with stock > 0 across all locations
-    products_with_stock = Product.objects.filter(
-        is_active=True,
-        stock_levels__quantity__gt=0
-    ).distinct().count()
-    
-    # Low Stock Items: Products below min_qty (handle NULL stock as 0)
-    low_stock_products_count = Product.objects.filter(
-        is_active=True
-    ).annotate(
-        total_stock=Case(
-            When(stock_levels__quantity__isnull=True, then=Value(0)),
-            default=Sum('stock_levels__quantity'),
-            output_field=IntegerField()
-        )
-    ).filter(
-        total_stock__lt=F('min_stock'),
-        total_stock__gte=0
-    ).distinct().count()
+def _dashboard_kpis():
+    """Stock and pending-operation KPI tiles plus the low stock table"""
+    # Calculate KPIs from the per-product stock summary (one row per product,
+    # maintained by the stock movement engine)
+    summaries = ProductStockSummary.objects.filter(product__is_active=True)
+    stock_kpis = summaries.aggregate(
+        total_products=Count('pk', filter=Q(on_hand__gt=0)),
+        low_stock_items=Count('pk', filter=Q(below_min=True, on_hand__gte=0)),
+        out_of_stock_items=Count('pk', filter=Q(on_hand=0)),
+    )
     
     # Get actual low stock products list with details
-    low_stock_products_queryset = Product.objects.filter(
-        is_active=True
-    ).annotate(
-        total_stock=Case(
-            When(stock_levels__quantity__isnull=True, then=Value(0)),
-            default=Sum('stock_levels__quantity'),
-            output_field=IntegerField()
-        )
-    ).filter(
-        total_stock__lt=F('min_stock'),
-        total_stock__gte=0
-    ).select_related('category', 'uom').distinct().order_by('name')
+    low_stock_summaries = summaries.filter(
+        below_min=True, on_hand__gte=0
+    ).select_related('product__category', 'product__uom').order_by('product__name')
     
     # Prepare low stock products with calculated difference
     low_stock_products = []
-    for product in low_stock_products_queryset:
-        current_stock = product.total_stock if product.total_stock else 0
-        min_stock = product.min_stock if product.min_stock else 0
-        difference = min_stock - current_stock
+    for summary in low_stock_summaries:
+        product = summary.product
         low_stock_products.append({
             'product': product,
-            'current_stock': current_stock,
-            'min_stock': min_stock,
-            'difference': difference,
+            'current_stock': summary.on_hand,
+            'min_stock': product.min_stock,
+            'difference': product.min_stock - summary.on_hand,
         })
     
-    # Out of Stock Items: Products with available quantity = 0
-    out_of_stock_products = Product.objects.filter(
-        is_active=True
-    ).annotate(
-        total_stock=Case(
-            When(stock_levels__quantity__isnull=True, then=Value(0)),
-            default=Sum('stock_levels__quantity'),
-            output_field=IntegerField()
-        )
-    ).filter(
-        total_stock=0
-    ).distinct().count()
-    
-    # Pending Receipts: RECEIPT operations with status WAITING or READY
-    pending_receipts = InventoryOperation.objects.filter(
-        type='RECEIPT',
-        status__in=['WAITING', 'READY']
-    ).count()
-    
-    # Pending Deliveries: DELIVERY operations with status WAITING or READY
-    pending_deliveries = InventoryOperation.objects.filter(
-        type='DELIVERY',
-        status__in=['WAITING', 'READY']
-    ).count()
-    
-    # Internal Transfers Scheduled: INTERNAL operations not DONE or CANCELED
-    internal_transfers = InventoryOperation.objects.filter(
-        type='INTERNAL'
-    ).exclude(
-        status__in=['DONE', 'CANCEL']
-    ).count()
+    # Pending Receipts / Deliveries (WAITING or READY) and Internal Transfers
+    # not DONE or CANCELED, counted in a single pass over the open operations
+    # (op_open_type_status_idx)
+    pending = ['WAITING', 'READY']
+    operation_kpis = InventoryOperation.objects.exclude(status__in=['DONE', 'CANCEL']).aggregate(
+        pending_receipts=Count('pk', filter=Q(type='RECEIPT', status__in=pending)),
+        pending_deliveries=Count('pk', filter=Q(type='DELIVERY', status__in=pending)),
+        internal_transfers=Count('pk', filter=Q(type='INTERNAL') & ~Q(status__in=['DONE', 'CANCEL'])),
+    )
+    return {
+        **stock_kpis,
+        'low_stock_products': low_stock_products,
+        **operation_kpis,
+    }
+
+@login_required
+def dashboard(request):
+    # Get filter parameters
+    operation_type = request.GET.get('type', '')
+    status_filter = request.GET.get('status', '')
+    warehouse_filter = request.GET.get('warehouse', '')
+    category_filter = request.GET.get('category', '')
+    search_query = request.GET.get('search', '')
+    
+    kpis = cached_block('dashboard-kpis', _dashboard_kpis)
     
     # Recent Operations with filters
     operations = InventoryOperation.objects.select_related(
@@ -124,13 +108,11 @@ def dashboard(request):
             Q(destination_location__warehouse_id=warehouse_filter)
         )
     if category_filter:
-        operations = operations.filter(lines__product__category_id=category_filter).distinct()
+        operations = operations.filter(Exists(
+            OperationLine.objects.filter(operation=OuterRef('pk'), product__category_id=category_filter)
+        ))
     if search_query:
-        operations = operations.filter(
-            Q(reference__icontains=search_query) |
-            Q(lines__product__sku__icontains=search_query) |
-            Q(lines__product__name__icontains=search_query)
-        ).distinct()
+        operations = search_operations(operations, search_query)
     
     # Now slice after all filters are applied
     operations = operations[:50]
@@ -155,13 +137,7 @@ def dashboard(request):
     categories = Category.objects.all()
     
     context = {
-        'total_products': products_with_stock,
-        'low_stock_items': low_stock_products_count,
-        'low_stock_products': low_stock_products,
-        'out_of_stock_items': out_of_stock_products,
-        'pending_receipts': pending_receipts,
-        'pending_deliveries': pending_deliveries,
-        'internal_transfers': internal_transfers,
+        **kpis,
         'recent_operations': recent_operations,
         'warehouses': warehouses,
         'categories': categories,
@@ -179,46 +155,36 @@ def dashboard(request):
 
 @login_required
 def products_list(request):
-    """List all products with search and filter capabilities"""
-    search_query = request.GET.get('search', '')
-    category_filter = request.GET.get('category', '')
-    status_filter = request.GET.get('status', '')
-    
-    products = Product.objects.select_related('category', 'uom').annotate(
-        total_stock=Case(
-            When(stock_levels__quantity__isnull=True, then=Value(0)),
-            default=Sum('stock_levels__quantity'),
-            output_field=IntegerField()
-        )
-    ).distinct()
-    
-    # Apply filters
-    if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) |
-            Q(sku__icontains=search_query)
-        )
-    if category_filter:
-        products = products.filter(category_id=category_filter)
-    if status_filter == 'active':
-        products = products.filter(is_active=True)
-    elif status_filter == 'inactive':
-        products = products.filter(is_active=False)
-    
-    products = products.order_by('-id')
+    """
+    Products page. Only the filters are rendered here; the table is a
+    windowed grid that loads its rows from products_grid.
+    """
+    current_filters = {name: request.GET.get(name, '') for name in PRODUCT_FILTERS}
+    sort, descending = grid.parse_sort(request.GET.get('sort', 'name'))
     categories = Category.objects.all()
     
     context = {
-        'products': products,
         'categories': categories,
-        'current_filters': {
-            'search': search_query,
-            'category': category_filter,
-            'status': status_filter,
-        }
+        'current_filters': current_filters,
+        'sort': ('-' if descending else '') + sort,
+        'page_size': grid.GRID_PAGE_SIZE,
     }
     return render(request, 'core/products_list.html', context)
 
+@login_required
+def products_grid(request):
+    """JSON window of the products grid for the list filters, ?sort= and ?after= (see core.grid)"""
+    page_size = min(_int_param(request, 'size') or grid.GRID_PAGE_SIZE, grid.MAX_GRID_PAGE_SIZE)
+    page, _, sort = grid.products_page(request.GET, page_size=page_size)
+    return JsonResponse({
+        'results': [
+            {**row, 'edit_url': reverse('core:product_edit', args=[row['id']])}
+            for row in page
+        ],
+        'sort': sort,
+        'pagination': {'next': page.next_cursor, 'estimated_total': page.estimated_total},
+    })
+
 @login_required
 def product_create(request):
     """Create a new product"""
@@ -337,6 +303,29 @@ def uom_create(request):
     }
     return render(request, 'core/uom_form.html', context)
 
+OPERATION_LIST_PAGE_SIZE = 50
+OPERATION_LIST_PREVIEW_LINES = 5
+
+def _operation_list_page(request, operations):
+    """
+    One keyset page of an operation list, with an estimated total. Each
+    operation carries line_count and its first few lines (preview_lines)
+    instead of prefetching every line of every operation: the preview ids
+    come from a LIMITed subquery per operation (opline_operation_id_idx),
+    then the lines are loaded in one query.
+    """
+    lines = OperationLine.objects.filter(operation=OuterRef('pk')).order_by()
+    page = paginate_request(request, operations.annotate(
+        line_count=Coalesce(Subquery(lines.values('operation').annotate(n=Count('pk')).values('n')), 0),
+        preview_line_ids=ArraySubquery(lines.order_by('id').values('id')[:OPERATION_LIST_PREVIEW_LINES]),
+    ), OPERATION_LIST_PAGE_SIZE, estimate_total=True)
+    preview_lines = OperationLine.objects.select_related('product').in_bulk(
+        [line_id for operation in page for line_id in operation.preview_line_ids]
+    )
+    for operation in page:
+        operation.preview_lines = [preview_lines[line_id] for line_id in operation.preview_line_ids]
+    return page
+
 @login_required
 def receipts_list(request):
     """List all receipts with search and filter capabilities"""
@@ -349,21 +338,19 @@ def receipts_list(request):
         type='RECEIPT'
     ).select_related(
         'partner', 'destination_location__warehouse', 'created_by'
-    ).prefetch_related('lines__product').order_by('-created_at')
+    )
     
-    # Apply filters
+    # Apply filters (Exists subqueries, so no join fans rows out and nothing needs DISTINCT)
     if search_query:
-        receipts = receipts.filter(
-            Q(reference__icontains=search_query) |
-            Q(lines__product__sku__icontains=search_query) |
-            Q(lines__product__name__icontains=search_query)
-        ).distinct()
+        receipts = search_operations(receipts, search_query)
     if status_filter:
         receipts = receipts.filter(status=status_filter)
     if supplier_filter:
         receipts = receipts.filter(partner_id=supplier_filter)
     if warehouse_filter:
-        receipts = receipts.filter(destination_location__warehouse_id=warehouse_filter)
+        receipts = receipts.filter(in_warehouse('destination_location_id', warehouse_filter))
+    
+    page = _operation_list_page(request, receipts)
     
     suppliers = Partner.objects.filter(
         Q(partner_type='supplier') | Q(partner_type='both')
@@ -371,7 +358,8 @@ def receipts_list(request):
     warehouses = Warehouse.objects.all()
     
     context = {
-        'receipts': receipts,
+        'receipts': page,
+        'page': page,
         'suppliers': suppliers,
         'warehouses': warehouses,
         'status_types': InventoryOperation.STATUS_TYPES,
@@ -394,32 +382,17 @@ def receipt_create(request):
             receipt.type = 'RECEIPT'
             receipt.status = 'DRAFT'
             receipt.created_by = request.user
-            receipt.save()
             
             # Handle line items
-            product_ids = request.POST.getlist('products')
-            quantities = request.POST.getlist('quantities')
-            
-            lines_created = False
-            for product_id, quantity in zip(product_ids, quantities):
-                if product_id and quantity and int(quantity) > 0:
-                    try:
-                        product = Product.objects.get(pk=product_id)
-                        OperationLine.objects.create(
-                            operation=receipt,
-                            product=product,
-                            quantity=int(quantity)
-                        )
-                        lines_created = True
-                    except (Product.DoesNotExist, ValueError):
-                        pass
-            
-            if not lines_created:
-                messages.error(request, 'Please add at least one product with quantity.')
-                products = Product.objects.filter(is_active=True).select_related('category', 'uom')
+            try:
+                line_items = lines.parse_lines(
+                    request.POST.getlist('products'), request.POST.getlist('quantities')
+                )
+                lines.save_operation_with_lines(receipt, line_items)
+            except lines.LineError as e:
+                messages.error(request, str(e))
                 context = {
                     'form': form,
-                    'products': products,
                     'title': 'Create Receipt'
                 }
                 return render(request, 'core/receipt_form.html', context)
@@ -429,11 +402,8 @@ def receipt_create(request):
     else:
         form = ReceiptForm()
     
-    products = Product.objects.filter(is_active=True).select_related('category', 'uom')
-    
     context = {
         'form': form,
-        'products': products,
         'title': 'Create Receipt'
     }
     return render(request, 'core/receipt_form.html', context)
@@ -443,27 +413,17 @@ def receipt_validate(request, pk):
     """Validate a receipt - increases stock"""
     receipt = get_object_or_404(InventoryOperation, pk=pk, type='RECEIPT')
     
-    if receipt.status == 'DONE':
+    try:
+        stock.validate_operation(receipt)
+    except stock.AlreadyValidated:
         messages.warning(request, 'This receipt has already been validated.')
         return redirect('core:receipts_list')
-    
-    if not receipt.lines.exists():
+    except stock.EmptyOperation:
         messages.error(request, 'Cannot validate receipt without line items.')
         return redirect('core:receipts_list')
-    
-    # Update stock levels
-    for line in receipt.lines.all():
-        stock_level, created = StockLevel.objects.get_or_create(
-            product=line.product,
-            location=receipt.destination_location,
-            defaults={'quantity': 0}
-        )
-        stock_level.quantity += line.quantity
-        stock_level.save()
-    
-    # Update receipt status
-    receipt.status = 'DONE'
-    receipt.save()
+    except stock.StockMovementError as e:
+        messages.error(request, str(e))
+        return redirect('core:receipts_list')
     
     messages.success(request, f'Receipt "{receipt.reference}" validated successfully! Stock updated.')
     return redirect('core:receipts_list')
@@ -524,21 +484,19 @@ def deliveries_list(request):
         type='DELIVERY'
     ).select_related(
         'partner', 'source_location__warehouse', 'created_by'
-    ).prefetch_related('lines__product').order_by('-created_at')
+    )
     
     # Apply filters
     if search_query:
-        deliveries = deliveries.filter(
-            Q(reference__icontains=search_query) |
-            Q(lines__product__sku__icontains=search_query) |
-            Q(lines__product__name__icontains=search_query)
-        ).distinct()
+        deliveries = search_operations(deliveries, search_query)
     if status_filter:
         deliveries = deliveries.filter(status=status_filter)
     if customer_filter:
         deliveries = deliveries.filter(partner_id=customer_filter)
     if warehouse_filter:
-        deliveries = deliveries.filter(source_location__warehouse_id=warehouse_filter)
+        deliveries = deliveries.filter(in_warehouse('source_location_id', warehouse_filter))
+    
+    page = _operation_list_page(request, deliveries)
     
     customers = Partner.objects.filter(
         Q(partner_type='customer') | Q(partner_type='both')
@@ -546,7 +504,8 @@ def deliveries_list(request):
     warehouses = Warehouse.objects.all()
     
     context = {
-        'deliveries': deliveries,
+        'deliveries': page,
+        'page': page,
         'customers': customers,
         'warehouses': warehouses,
         'status_types': InventoryOperation.STATUS_TYPES,
@@ -569,32 +528,17 @@ def delivery_create(request):
             delivery.type = 'DELIVERY'
             delivery.status = 'DRAFT'
             delivery.created_by = request.user
-            delivery.save()
             
             # Handle line items
-            product_ids = request.POST.getlist('products')
-            quantities = request.POST.getlist('quantities')
-            
-            lines_created = False
-            for product_id, quantity in zip(product_ids, quantities):
-                if product_id and quantity and int(quantity) > 0:
-                    try:
-                        product = Product.objects.get(pk=product_id)
-                        OperationLine.objects.create(
-                            operation=delivery,
-                            product=product,
-                            quantity=int(quantity)
-                        )
-                        lines_created = True
-                    except (Product.DoesNotExist, ValueError):
-                        pass
-            
-            if not lines_created:
-                messages.error(request, 'Please add at least one product with quantity.')
-                products = Product.objects.filter(is_active=True).select_related('category', 'uom')
+            try:
+                line_items = lines.parse_lines(
+                    request.POST.getlist('products'), request.POST.getlist('quantities')
+                )
+                lines.save_operation_with_lines(delivery, line_items)
+            except lines.LineError as e:
+                messages.error(request, str(e))
                 context = {
                     'form': form,
-                    'products': products,
                     'title': 'Create Delivery Order'
                 }
                 return render(request, 'core/delivery_form.html', context)
@@ -604,11 +548,8 @@ def delivery_create(request):
     else:
         form = DeliveryForm()
     
-    products = Product.objects.filter(is_active=True).select_related('category', 'uom')
-    
     context = {
         'form': form,
-        'products': products,
         'title': 'Create Delivery Order'
     }
     return render(request, 'core/delivery_form.html', context)
@@ -618,40 +559,17 @@ def delivery_validate(request, pk):
     """Validate a delivery - decreases stock"""
     delivery = get_object_or_404(InventoryOperation, pk=pk, type='DELIVERY')
     
-    if delivery.status == 'DONE':
+    try:
+        stock.validate_operation(delivery)
+    except stock.AlreadyValidated:
         messages.warning(request, 'This delivery has already been validated.')
         return redirect('core:deliveries_list')
-    
-    if not delivery.lines.exists():
+    except stock.EmptyOperation:
         messages.error(request, 'Cannot validate delivery without line items.')
         return redirect('core:deliveries_list')
-    
-    # Check stock availability
-    for line in delivery.lines.all():
-        stock_level = StockLevel.objects.filter(
-            product=line.product,
-            location=delivery.source_location
-        ).first()
-        
-        if not stock_level or stock_level.quantity < line.quantity:
-            messages.error(
-                request, 
-                f'Insufficient stock for {line.product.sku}. Available: {stock_level.quantity if stock_level else 0}, Required: {line.quantity}'
-            )
-            return redirect('core:deliveries_list')
-    
-    # Update stock levels
-    for line in delivery.lines.all():
-        stock_level = StockLevel.objects.get(
-            product=line.product,
-            location=delivery.source_location
-        )
-        stock_level.quantity -= line.quantity
-        stock_level.save()
-    
-    # Update delivery status
-    delivery.status = 'DONE'
-    delivery.save()
+    except stock.StockMovementError as e:
+        messages.error(request, str(e))
+        return redirect('core:deliveries_list')
     
     messages.success(request, f'Delivery Order "{delivery.reference}" validated successfully! Stock updated.')
     return redirect('core:deliveries_list')
@@ -671,27 +589,26 @@ def internal_transfers_list(request):
         type='INTERNAL'
     ).select_related(
         'source_location__warehouse', 'destination_location__warehouse', 'created_by'
-    ).prefetch_related('lines__product').order_by('-created_at')
+    )
     
     # Apply filters
     if search_query:
-        transfers = transfers.filter(
-            Q(reference__icontains=search_query) |
-            Q(lines__product__sku__icontains=search_query) |
-            Q(lines__product__name__icontains=search_query)
-        ).distinct()
+        transfers = search_operations(transfers, search_query)
     if status_filter:
         transfers = transfers.filter(status=status_filter)
     if warehouse_filter:
         transfers = transfers.filter(
-            Q(source_location__warehouse_id=warehouse_filter) |
-            Q(destination_location__warehouse_id=warehouse_filter)
+            in_warehouse('source_location_id', warehouse_filter) |
+            in_warehouse('destination_location_id', warehouse_filter)
         )
     
+    page = _operation_list_page(request, transfers)
+    
     warehouses = Warehouse.objects.all()
     
     context = {
-        'transfers': transfers,
+        'transfers': page,
+        'page': page,
         'warehouses': warehouses,
         'status_types': InventoryOperation.STATUS_TYPES,
         'current_filters': {
@@ -712,34 +629,17 @@ def internal_transfer_create(request):
             transfer.type = 'INTERNAL'
             transfer.status = 'DRAFT'
             transfer.created_by = request.user
-            transfer.save()
             
             # Handle line items
-            product_ids = request.POST.getlist('products')
-            quantities = request.POST.getlist('quantities')
-            
-            lines_created = False
-            for product_id, quantity in zip(product_ids, quantities):
-                if product_id and quantity and int(quantity) > 0:
-                    try:
-                        product = Product.objects.get(pk=product_id)
-                        OperationLine.objects.create(
-                            operation=transfer,
-                            product=product,
-                            quantity=int(quantity)
-                        )
-                        lines_created = True
-                    except (Product.DoesNotExist, ValueError):
-                        pass
-            
-            if not lines_created:
-                messages.error(request, 'Please add at least one product with quantity.')
-                products = Product.objects.filter(is_active=True).select_related('category', 'uom')
-                locations = Location.objects.all()
+            try:
+                line_items = lines.parse_lines(
+                    request.POST.getlist('products'), request.POST.getlist('quantities')
+                )
+                lines.save_operation_with_lines(transfer, line_items)
+            except lines.LineError as e:
+                messages.error(request, str(e))
                 context = {
                     'form': form,
-                    'products': products,
-                    'locations': locations,
                     'title': 'Create Internal Transfer'
                 }
                 return render(request, 'core/internal_transfer_form.html', context)
@@ -749,13 +649,8 @@ def internal_transfer_create(request):
     else:
         form = InternalTransferForm()
     
-    products = Product.objects.filter(is_active=True).select_related('category', 'uom')
-    locations = Location.objects.all()
-    
     context = {
         'form': form,
-        'products': products,
-        'locations': locations,
         'title': 'Create Internal Transfer'
     }
     return render(request, 'core/internal_transfer_form.html', context)
@@ -765,55 +660,23 @@ def internal_transfer_validate(request, pk):
     """Validate an internal transfer - moves stock"""
     transfer = get_object_or_404(InventoryOperation, pk=pk, type='INTERNAL')
     
-    if transfer.status == 'DONE':
+    try:
+        stock.validate_operation(transfer)
+    except stock.AlreadyValidated:
         messages.warning(request, 'This transfer has already been validated.')
         return redirect('core:internal_transfers_list')
-    
-    if not transfer.lines.exists():
+    except stock.EmptyOperation:
         messages.error(request, 'Cannot validate transfer without line items.')
         return redirect('core:internal_transfers_list')
-    
-    if not transfer.source_location or not transfer.destination_location:
-        messages.error(request, 'Source and destination locations are required.')
-        return redirect('core:internal_transfers_list')
-    
-    # Check stock availability at source
-    for line in transfer.lines.all():
-        stock_level = StockLevel.objects.filter(
-            product=line.product,
-            location=transfer.source_location
-        ).first()
-        
-        if not stock_level or stock_level.quantity < line.quantity:
-            messages.error(
-                request, 
-                f'Insufficient stock for {line.product.sku} at source location. Available: {stock_level.quantity if stock_level else 0}, Required: {line.quantity}'
-            )
-            return redirect('core:internal_transfers_list')
-    
-    # Update stock levels - decrease at source, increase at destination
-    for line in transfer.lines.all():
-        # Decrease at source
-        source_stock, created = StockLevel.objects.get_or_create(
-            product=line.product,
-            location=transfer.source_location,
-            defaults={'quantity': 0}
-        )
-        source_stock.quantity -= line.quantity
-        source_stock.save()
-        
-        # Increase at destination
-        dest_stock, created = StockLevel.objects.get_or_create(
-            product=line.product,
-            location=transfer.destination_location,
-            defaults={'quantity': 0}
+    except stock.InsufficientStock as e:
+        messages.error(
+            request,
+            f'Insufficient stock for {e.sku} at source location. Available: {e.available}, Required: {e.required}'
         )
-        dest_stock.quantity += line.quantity
-        dest_stock.save()
-    
-    # Update transfer status
-    transfer.status = 'DONE'
-    transfer.save()
+        return redirect('core:internal_transfers_list')
+    except stock.StockMovementError as e:
+        messages.error(request, str(e))
+        return redirect('core:internal_transfers_list')
     
     messages.success(request, f'Internal Transfer "{transfer.reference}" validated successfully! Stock moved.')
     return redirect('core:internal_transfers_list')
@@ -834,29 +697,28 @@ def stock_adjustments_list(request):
         type='ADJUST'
     ).select_related(
         'source_location__warehouse', 'created_by'
-    ).prefetch_related('lines__product').order_by('-created_at')
+    )
     
     # Apply filters
     if search_query:
-        adjustments = adjustments.filter(
-            Q(reference__icontains=search_query) |
-            Q(lines__product__sku__icontains=search_query) |
-            Q(lines__product__name__icontains=search_query)
-        ).distinct()
+        adjustments = search_operations(adjustments, search_query)
     if status_filter:
         adjustments = adjustments.filter(status=status_filter)
     if warehouse_filter:
-        adjustments = adjustments.filter(source_location__warehouse_id=warehouse_filter)
+        adjustments = adjustments.filter(in_warehouse('source_location_id', warehouse_filter))
     if product_filter:
-        adjustments = adjustments.filter(lines__product_id=product_filter).distinct()
+        adjustments = adjustments.filter(has_product(product_filter))
     
+    page = _operation_list_page(request, adjustments)
     warehouses = Warehouse.objects.all()
-    products = Product.objects.filter(is_active=True)
+    # The product filter is an autocomplete; only the selected product is loaded
+    selected_product = Product.objects.filter(pk=product_filter).first() if product_filter else None
     
     context = {
-        'adjustments': adjustments,
+        'adjustments': page,
+        'page': page,
         'warehouses': warehouses,
-        'products': products,
+        'selected_product': selected_product,
         'status_types': InventoryOperation.STATUS_TYPES,
         'current_filters': {
             'search': search_query,
@@ -867,6 +729,20 @@ def stock_adjustments_list(request):
     }
     return render(request, 'core/stock_adjustments_list.html', context)
 
+def _adjustment_form_context(form, location, product_filter):
+    """Products are searched through the autocomplete endpoint; only a preselected one is loaded"""
+    selected_product = None
+    if product_filter:
+        selected_product = Product.objects.filter(pk=product_filter, is_active=True).annotate(
+            quantity=Sum('stock_levels__quantity', filter=Q(stock_levels__location=location))
+        ).first()
+    return {
+        'form': form,
+        'location': location,
+        'selected_product': selected_product,
+        'title': 'Create Stock Adjustment'
+    }
+
 @login_required
 def stock_adjustment_create(request):
     """Create a new stock adjustment"""
@@ -881,53 +757,22 @@ def stock_adjustment_create(request):
             adjustment.status = 'DRAFT'
             adjustment.destination_location = adjustment.source_location  # For adjustments, both are same
             adjustment.created_by = request.user
-            adjustment.save()
-            
-            # Handle adjustment lines - product, system_qty, physical_qty
-            product_ids = request.POST.getlist('products')
-            system_quantities = request.POST.getlist('system_quantities')
-            physical_quantities = request.POST.getlist('physical_quantities')
             
-            lines_created = False
-            for product_id, sys_qty, phys_qty in zip(product_ids, system_quantities, physical_quantities):
-                if product_id and phys_qty:
-                    try:
-                        product = Product.objects.get(pk=product_id)
-                        physical_qty = int(phys_qty)
-                        system_qty = int(sys_qty) if sys_qty else 0
-                        difference = physical_qty - system_qty
-                        
-                        if difference != 0:  # Only create line if there's a difference
-                            OperationLine.objects.create(
-                                operation=adjustment,
-                                product=product,
-                                quantity=difference  # Store actual difference (can be + or -)
-                            )
-                            lines_created = True
-                    except (Product.DoesNotExist, ValueError):
-                        pass
-            
-            if not lines_created:
-                messages.error(request, 'Please add at least one product with a quantity difference.')
-                location = adjustment.source_location if adjustment.source_location else None
-                products = Product.objects.filter(is_active=True).select_related('category', 'uom')
-                if location:
-                    # Get products with stock at this location and annotate with stock quantity
-                    products_with_stock = StockLevel.objects.filter(location=location).select_related('product')
-                    product_stock_map = {sl.product_id: sl.quantity for sl in products_with_stock}
-                    products = products.filter(id__in=product_stock_map.keys())
-                    # Annotate products with stock
-                    for product in products:
-                        product.current_stock = product_stock_map.get(product.id, 0)
-                if product_filter:
-                    products = products.filter(id=product_filter)
-                
-                context = {
-                    'form': form,
-                    'products': products,
-                    'location': location,
-                    'title': 'Create Stock Adjustment'
-                }
+            # Handle adjustment lines - product, system_qty, physical_qty.
+            # Each line stores the actual difference (can be + or -)
+            try:
+                line_items = lines.parse_adjustment_lines(
+                    request.POST.getlist('products'),
+                    request.POST.getlist('system_quantities'),
+                    request.POST.getlist('physical_quantities'),
+                )
+                lines.save_operation_with_lines(adjustment, line_items)
+            except lines.LineError as e:
+                if isinstance(e, lines.NoLines):
+                    messages.error(request, 'Please add at least one product with a quantity difference.')
+                else:
+                    messages.error(request, str(e))
+                context = _adjustment_form_context(form, adjustment.source_location, product_filter)
                 return render(request, 'core/stock_adjustment_form.html', context)
             
             messages.success(request, f'Stock Adjustment "{adjustment.reference}" created successfully!')
@@ -941,28 +786,8 @@ def stock_adjustment_create(request):
             except Location.DoesNotExist:
                 pass
     
-    location = Location.objects.get(pk=location_id) if location_id else None
-    products = Product.objects.filter(is_active=True).select_related('category', 'uom')
-    product_stock_map = {}
-    
-    if location:
-        # Get products with stock at this location and annotate with stock quantity
-        products_with_stock = StockLevel.objects.filter(location=location).select_related('product')
-        product_stock_map = {sl.product_id: sl.quantity for sl in products_with_stock}
-        products = products.filter(id__in=product_stock_map.keys())
-        # Annotate products with stock
-        for product in products:
-            product.current_stock = product_stock_map.get(product.id, 0)
-    if product_filter:
-        products = products.filter(id=product_filter)
-    
-    context = {
-        'form': form,
-        'products': products,
-        'location': location,
-        'product_stock_map': product_stock_map,
-        'title': 'Create Stock Adjustment'
-    }
+    location = Location.objects.filter(pk=location_id).first() if location_id else None
+    context = _adjustment_form_context(form, location, product_filter)
     return render(request, 'core/stock_adjustment_form.html', context)
 
 @login_required
@@ -970,54 +795,20 @@ def stock_adjustment_validate(request, pk):
     """Validate a stock adjustment - updates stock to physical count"""
     adjustment = get_object_or_404(InventoryOperation, pk=pk, type='ADJUST')
     
-    if adjustment.status == 'DONE':
+    # Line quantities hold the signed difference (physical - system);
+    # the stock engine applies them and never lets a location go below zero.
+    try:
+        stock.validate_operation(adjustment)
+    except stock.AlreadyValidated:
         messages.warning(request, 'This adjustment has already been validated.')
         return redirect('core:stock_adjustments_list')
-    
-    if not adjustment.lines.exists():
+    except stock.EmptyOperation:
         messages.error(request, 'Cannot validate adjustment without line items.')
         return redirect('core:stock_adjustments_list')
-    
-    if not adjustment.source_location:
-        messages.error(request, 'Location is required.')
+    except stock.StockMovementError as e:
+        messages.error(request, str(e))
         return redirect('core:stock_adjustments_list')
     
-    # Update stock levels based on adjustment lines
-    # The line.quantity represents the absolute difference
-    # We need to determine if it's an increase or decrease
-    # Since we stored the absolute difference, we'll need to check the current stock
-    # and apply the adjustment accordingly
-    # Note: This is a simplified approach - ideally store both system_qty and physical_qty
-    
-    for line in adjustment.lines.all():
-        stock_level, created = StockLevel.objects.get_or_create(
-            product=line.product,
-            location=adjustment.source_location,
-            defaults={'quantity': 0}
-        )
-        
-        # The line.quantity is the absolute difference
-        # We need to determine direction - for now, we'll assume it's stored correctly
-        # In a real system, you'd have a separate field for increase/decrease
-        # For this implementation, we'll use the difference stored in the line
-        # and apply it as an adjustment (could be positive or negative)
-        
-        # Since we only store absolute difference, we'll need to infer direction
-        # This is a limitation - ideally store both values
-        # For now, we'll apply the adjustment as stored
-        # The physical quantity would be: system_qty + difference (if positive) or system_qty - difference (if negative)
-        
-        # Apply the difference (can be positive or negative)
-        # Positive difference = increase stock, Negative difference = decrease stock
-        current_stock = stock_level.quantity
-        new_stock = max(0, current_stock + line.quantity)  # Apply difference (can be + or -)
-        stock_level.quantity = new_stock
-        stock_level.save()
-    
-    # Update adjustment status
-    adjustment.status = 'DONE'
-    adjustment.save()
-    
     messages.success(request, f'Stock Adjustment "{adjustment.reference}" validated successfully! Stock updated.')
     return redirect('core:stock_adjustments_list')
 
@@ -1025,106 +816,183 @@ def stock_adjustment_validate(request, pk):
 # MOVE HISTORY (STOCK LEDGER)
 # ==========================
 
+MOVE_HISTORY_PAGE_SIZE = 100
+MOVE_HISTORY_STREAM_CHUNK = 500
+MOVE_HISTORY_ROWS_MARKER = '<!-- move-history-rows -->'
+
 @login_required
 def move_history(request):
     """View-only history of all stock movements"""
-    # Get filter parameters
-    date_from = request.GET.get('date_from', '')
-    date_to = request.GET.get('date_to', '')
-    product_filter = request.GET.get('product', '')
-    warehouse_filter = request.GET.get('warehouse', '')
-    location_filter = request.GET.get('location', '')
-    doc_type_filter = request.GET.get('doc_type', '')
-    
-    # Build query from InventoryOperation and OperationLine
-    # Since StockLedgerEntry might not be populated, we'll use operations
-    operations = InventoryOperation.objects.filter(
-        status='DONE'  # Only show completed operations
-    ).select_related(
-        'source_location__warehouse',
-        'destination_location__warehouse',
-        'created_by'
-    ).prefetch_related('lines__product').order_by('-created_at')
-    
-    # Apply filters
-    if date_from:
-        operations = operations.filter(created_at__gte=date_from)
-    if date_to:
-        operations = operations.filter(created_at__lte=date_to)
-    if product_filter:
-        operations = operations.filter(lines__product_id=product_filter).distinct()
-    if warehouse_filter:
-        operations = operations.filter(
-            Q(source_location__warehouse_id=warehouse_filter) |
-            Q(destination_location__warehouse_id=warehouse_filter)
-        )
-    if location_filter:
-        operations = operations.filter(
-            Q(source_location_id=location_filter) |
-            Q(destination_location_id=location_filter)
+    try:
+        entries, current_filters = filter_ledger_entries(
+            StockLedgerEntry.objects.select_related(
+                'product',
+                'operation__created_by',
+                'source_location__warehouse',
+                'destination_location__warehouse',
+            ),
+            request.GET,
         )
-    if doc_type_filter:
-        operations = operations.filter(type=doc_type_filter)
-    
-    # Build move history entries from operations
-    move_history_entries = []
-    for operation in operations:
-        for line in operation.lines.all():
-            # Determine quantity change direction based on operation type
-            if operation.type == 'RECEIPT':
-                qty_change = line.quantity  # Positive (incoming)
-                from_loc = None
-                to_loc = operation.destination_location
-            elif operation.type == 'DELIVERY':
-                qty_change = -line.quantity  # Negative (outgoing)
-                from_loc = operation.source_location
-                to_loc = None
-            elif operation.type == 'INTERNAL':
-                qty_change = line.quantity  # Positive at destination
-                from_loc = operation.source_location
-                to_loc = operation.destination_location
-            else:  # ADJUST
-                qty_change = line.quantity  # Can be positive or negative
-                from_loc = operation.source_location
-                to_loc = operation.source_location  # Same location for adjustments
-            
-            move_history_entries.append({
-                'date_time': operation.created_at,
-                'product': line.product,
-                'from_location': from_loc,
-                'to_location': to_loc,
-                'quantity_change': qty_change,
-                'document_type': operation.get_type_display(),
-                'document_type_code': operation.type,
-                'document_reference': operation.reference or '(no ref)',
-                'performed_by': operation.created_by,
-            })
-    
-    # Sort by date (most recent first)
-    move_history_entries.sort(key=lambda x: x['date_time'], reverse=True)
+    except FilterError as e:
+        return HttpResponseBadRequest(str(e))
     
-    # Get filter options
-    products = Product.objects.filter(is_active=True).order_by('name')
+    # Get filter options; the product filter is an autocomplete, so only the selected product is loaded
+    product_filter = current_filters['product']
+    selected_product = Product.objects.filter(pk=product_filter).first() if product_filter.isdigit() else None
     warehouses = Warehouse.objects.all()
     locations = Location.objects.all()
     
     context = {
-        'move_history_entries': move_history_entries,
-        'products': products,
+        'selected_product': selected_product,
         'warehouses': warehouses,
         'locations': locations,
         'operation_types': InventoryOperation.OPERATION_TYPES,
-        'current_filters': {
-            'date_from': date_from,
-            'date_to': date_to,
-            'product': product_filter,
-            'warehouse': warehouse_filter,
-            'location': location_filter,
-            'doc_type': doc_type_filter,
-        }
+        'current_filters': current_filters,
     }
+    
+    if request.GET.get('stream'):
+        return _stream_move_history(request, entries, context)
+    
+    page = paginate_request(request, entries, MOVE_HISTORY_PAGE_SIZE)
+    context['move_history_entries'] = page
+    context['page'] = page
     return render(request, 'core/move_history.html', context)
 
+def _stream_move_history(request, entries, context):
+    """
+    Render the move history page for an unbounded range without building the
+    row list: the page shell is rendered once and split at the rows marker,
+    then ledger rows are streamed in chunks from a server-side cursor.
+    """
+    page = render_to_string('core/move_history.html', {**context, 'streaming': True}, request=request)
+    head, tail = page.split(MOVE_HISTORY_ROWS_MARKER, 1)
+    row_template = get_template('core/move_history_row.html')
+    
+    def rows():
+        yield head
+        chunk = []
+        for entry in entries.order_by('-created_at', '-id').iterator(chunk_size=MOVE_HISTORY_STREAM_CHUNK):
+            chunk.append(row_template.render({'entry': entry}))
+            if len(chunk) == MOVE_HISTORY_STREAM_CHUNK:
+                yield ''.join(chunk)
+                chunk = []
+        yield ''.join(chunk)
+        yield tail
+    
+    return StreamingHttpResponse(rows(), content_type='text/html; charset=utf-8')
+
+STOCK_AS_OF_ROW_CAP = 500
+
+def _date_param(request, name):
+    try:
+        return date.fromisoformat(request.GET.get(name, ''))
+    except ValueError:
+        return None
+
+@login_required
+def stock_as_of(request):
+    """Closing stock per product and location at the end of a date, or what changed between two dates"""
+    day = _date_param(request, 'date') or timezone.localdate()
+    compare = _date_param(request, 'compare')
+    warehouse_id = _int_param(request, 'warehouse')
+    location_id = _int_param(request, 'location')
+    product_id = _int_param(request, 'product')
+    scope = {
+        'warehouse_id': warehouse_id,
+        'location_ids': [location_id] if location_id else None,
+        'product_ids': [product_id] if product_id else None,
+    }
+
+    if compare:
+        # Older date first, whichever order they were given in
+        start, end = sorted([compare, day])
+        changes = snapshots.stock_diff(snapshots.day_end(start), snapshots.day_end(end), **scope)
+        balances = {key: (before, after, after - before) for key, (before, after) in changes.items()}
+    else:
+        balances = {
+            key: (None, quantity, None)
+            for key, quantity in snapshots.stock_at(snapshots.day_end(day), **scope).items()
+        }
+
+    keys = sorted(balances)[:STOCK_AS_OF_ROW_CAP]
+    products = Product.objects.in_bulk({product for product, _ in keys})
+    locations = Location.objects.select_related('warehouse').in_bulk({location for _, location in keys})
+    rows = [
+        (products[product], locations[location], *balances[product, location])
+        for product, location in keys
+        if product in products and location in locations
+    ]
+
+    context = {
+        'rows': rows,
+        'total_rows': len(balances),
+        'row_cap': STOCK_AS_OF_ROW_CAP,
+        'day': day,
+        'compare': compare,
+        'selected_product': Product.objects.filter(pk=product_id).first() if product_id else None,
+        'warehouses': Warehouse.objects.all(),
+        'locations': Location.objects.select_related('warehouse'),
+        'current_filters': {
+            'warehouse': warehouse_id,
+            'location': location_id,
+        },
+    }
+    return render(request, 'core/stock_as_of.html', context)
+
+@login_required
+def inventory_valuation(request):
+    """On-hand quantity x cost per location, warehouse and category, with the grand total"""
+    warehouse_id = _int_param(request, 'warehouse')
+    category_id = _int_param(request, 'category')
+    context = {
+        'levels': valuation.by_level(valuation.valuation(warehouse_id, category_id)),
+        'warehouses': Warehouse.objects.all(),
+        'categories': Category.objects.order_by('name'),
+        'current_filters': {'warehouse': warehouse_id, 'category': category_id},
+    }
+    return render(request, 'core/inventory_valuation.html', context)
+
+# ==========================
+# EXPORTS
+# ==========================
+
+def _export_response(name, fmt, rows):
+    if fmt not in exports.FORMATS:
+        raise Http404(f'Unsupported export format: {fmt}')
+    response = StreamingHttpResponse(rows, content_type=exports.FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{name}-{timezone.now():%Y%m%d-%H%M%S}.{fmt}"'
+    return response
+
+@login_required
+def export_stock_levels(request, fmt):
+    """Stock levels, filtered like the products list (plus warehouse / location)"""
+    levels, _ = filter_stock_levels(StockLevel.objects.all(), request.GET)
+    return _export_response('stock-levels', fmt, exports.stock_levels(levels, fmt))
+
+@login_required
+def export_valuation(request, fmt):
+    """The valuation report, filtered like the page"""
+    rows = valuation.valuation(_int_param(request, 'warehouse'), _int_param(request, 'category'))
+    return _export_response('valuation', fmt, exports.valuation(rows, fmt))
+
+@login_required
+def export_operations(request, fmt):
+    """Operations with their lines, filtered like move history (plus status)"""
+    try:
+        operations, _ = filter_operations(InventoryOperation.objects.all(), request.GET)
+    except FilterError as e:
+        return HttpResponseBadRequest(str(e))
+    return _export_response('operations', fmt, exports.operations(operations, fmt))
+
+@login_required
+def export_ledger(request, fmt):
+    """Ledger entries, filtered like move history"""
+    try:
+        entries, _ = filter_ledger_entries(StockLedgerEntry.objects.all(), request.GET)
+    except FilterError as e:
+        return HttpResponseBadRequest(str(e))
+    return _export_response('ledger', fmt, exports.ledger_entries(entries, fmt))
+
 # ==========================
 # WAREHOUSES
 # ==========================
@@ -1132,42 +1000,46 @@ def move_history(request):
 @login_required
 def warehouses_list(request):
     """List all warehouses with statistics"""
-    warehouses = Warehouse.objects.annotate(
+    warehouses = cached_block('warehouses-list', lambda: list(Warehouse.objects.annotate(
         location_count=Count('locations', distinct=True),
         product_count=Count('locations__stock_levels__product', distinct=True)
-    ).order_by('code')
+    ).order_by('code')))
     
     context = {
         'warehouses': warehouses,
     }
     return render(request, 'core/warehouses_list.html', context)
 
-@login_required
-def warehouse_detail(request, pk):
-    """Detail view of a warehouse with locations"""
-    warehouse = get_object_or_404(Warehouse, pk=pk)
-    
+def _warehouse_stats(warehouse):
+    """Location breakdown and totals for one warehouse"""
     # Get all locations for this warehouse
-    locations = Location.objects.filter(warehouse=warehouse).annotate(
+    locations = list(Location.objects.filter(warehouse=warehouse).annotate(
         product_count=Count('stock_levels__product', distinct=True),
         total_stock=Sum('stock_levels__quantity')
-    ).order_by('name')
+    ).order_by('name'))
     
     # Get statistics
-    total_locations = locations.count()
-    total_products = StockLevel.objects.filter(
-        location__warehouse=warehouse
-    ).values('product').distinct().count()
-    total_quantity = StockLevel.objects.filter(
-        location__warehouse=warehouse
-    ).aggregate(total=Sum('quantity'))['total'] or 0
+    totals = StockLevel.objects.filter(location__warehouse=warehouse).aggregate(
+        total_products=Count('product', distinct=True),
+        total_quantity=Sum('quantity'),
+    )
+    return {
+        'locations': locations,
+        'total_locations': len(locations),
+        'total_products': totals['total_products'],
+        'total_quantity': totals['total_quantity'] or 0,
+    }
+
+@login_required
+def warehouse_detail(request, pk):
+    """Detail view of a warehouse with locations"""
+    warehouse = get_object_or_404(Warehouse, pk=pk)
+    
+    stats = cached_block(f'warehouse-detail:{warehouse.pk}', lambda: _warehouse_stats(warehouse), warehouse_id=warehouse.pk)
     
     context = {
         'warehouse': warehouse,
-        'locations': locations,
-        'total_locations': total_locations,
-        'total_products': total_products,
-        'total_quantity': total_quantity,
+        **stats,
     }
     return render(request, 'core/warehouse_detail.html', context)
 
@@ -1251,6 +1123,49 @@ def location_create(request):
     }
     return render(request, 'core/location_form.html', context)
 
+# ==========================
+# AUTOCOMPLETE
+# ==========================
+
+AUTOCOMPLETE_CACHE_TIMEOUT = 30
+
+def _int_param(request, name):
+    try:
+        return int(request.GET.get(name, ''))
+    except ValueError:
+        return None
+
+def _autocomplete(request, name, build, **params):
+    """JSON page of matches for ?q=&page=, cached briefly per query (and per stock version)"""
+    query = request.GET.get('q', '').strip()[:100]
+    page = _int_param(request, 'page') or 1
+    digest = hashlib.md5(f'{query}|{page}|{sorted(params.items())}'.encode()).hexdigest()
+    data = cached_block(
+        f'autocomplete-{name}:{digest}',
+        lambda: build(query, page=page, **params),
+        timeout=AUTOCOMPLETE_CACHE_TIMEOUT,
+    )
+    return JsonResponse(data)
+
+@login_required
+def autocomplete_products(request):
+    """Active products; ?location= adds each product's quantity at that location"""
+    return _autocomplete(
+        request, 'products', search.autocomplete_products, location_id=_int_param(request, 'location')
+    )
+
+@login_required
+def autocomplete_locations(request):
+    return _autocomplete(request, 'locations', search.autocomplete_locations)
+
+@login_required
+def autocomplete_partners(request):
+    """Partners; ?type=supplier or ?type=customer (both include 'both')"""
+    partner_type = request.GET.get('type')
+    if partner_type not in ('supplier', 'customer'):
+        partner_type = None
+    return _autocomplete(request, 'partners', search.autocomplete_partners, partner_type=partner_type)
+
 # ==========================
 # MY PROFILE
 # ==========================
@@ -1261,39 +1176,36 @@ def my_profile(request):
     user = request.user
     
     # Get user statistics
-    receipts_created = InventoryOperation.objects.filter(
-        type='RECEIPT',
-        created_by=user
-    ).count()
-    
-    deliveries_created = InventoryOperation.objects.filter(
-        type='DELIVERY',
+    stats = cached_block(f'profile:{user.pk}', lambda: InventoryOperation.objects.filter(
         created_by=user
-    ).count()
-    
-    transfers_created = InventoryOperation.objects.filter(
-        type='INTERNAL',
-        created_by=user
-    ).count()
-    
-    adjustments_created = InventoryOperation.objects.filter(
-        type='ADJUST',
-        created_by=user
-    ).count()
+    ).aggregate(
+        receipts_created=Count('pk', filter=Q(type='RECEIPT')),
+        deliveries_created=Count('pk', filter=Q(type='DELIVERY')),
+        transfers_created=Count('pk', filter=Q(type='INTERNAL')),
+        adjustments_created=Count('pk', filter=Q(type='ADJUST')),
+    ))
     
     context = {
         'user': user,
-        'receipts_created': receipts_created,
-        'deliveries_created': deliveries_created,
-        'transfers_created': transfers_created,
-        'adjustments_created': adjustments_created,
+        **stats,
     }
     return render(request, 'core/my_profile.html', context)
 
 from django.http import JsonResponse
 import json
-import matplotlib.pyplot as plt
-import io, base64
+
+def _chart_reply(args):
+    """The reply for a create_bar_chart call: an <img> for the cached chart URL (core.services.charts)"""
+    try:
+        spec = charts.clean_spec(args)
+    except charts.ChartError as e:
+        return str(e)
+    chart_url = reverse('core:chart_image', args=[charts.store(spec)])
+    return format_html(
+        '<p>Here is the chart for {}:</p><img src="{}" alt="{}" style="max-width:100%" />',
+        spec[0], chart_url, spec[0],
+    )
+
 
 @login_required
 def chatbot_view(request):
@@ -1302,119 +1214,82 @@ def chatbot_view(request):
     data = json.loads(request.body)
     message = data.get('message', '').lower()
 
-    from django.conf import settings
-    from google import genai
-    from google.genai import types
+    # Common lookups are answered locally, without a model round trip
+    answer = chat_router.route(message)
+    if answer is not None:
+        return JsonResponse({'reply': answer.reply, 'intent': answer.intent})
 
-    api_key = getattr(settings, 'GEMINI_API_KEY', None)
-    if not api_key:
+    client = assistant.get_client()
+    if client is None:
         return JsonResponse({'reply': 'Gemini API key not configured.'})
 
-    # Prepare prompt with comprehensive database context
-    # 1. Products & Stock
-    products = Product.objects.filter(is_active=True).prefetch_related('stock_levels__location')
-    product_info = []
-    for p in products:
-        total_stock = sum(sl.quantity for sl in p.stock_levels.all())
-        stock_details = ", ".join([f"{sl.location.name}: {sl.quantity}" for sl in p.stock_levels.all() if sl.quantity > 0])
-        product_info.append(f"- {p.sku}: {p.name} | Cost: ${p.cost} | Min Stock: {p.min_stock} | Total Stock: {total_stock} ({stock_details})")
-    
-    # 2. Warehouses & Locations
-    warehouses = Warehouse.objects.prefetch_related('locations').all()
-    wh_info = []
-    for wh in warehouses:
-        locs = ", ".join([l.name for l in wh.locations.all()])
-        wh_info.append(f"- {wh.code} ({wh.name}): Locations [{locs}]")
-
-    # 3. Partners
-    partners = Partner.objects.all()
-    partner_info = [f"- {p.name} ({p.partner_type})" for p in partners]
-
-    # 4. Recent Operations
-    ops = InventoryOperation.objects.all().order_by('-created_at')[:10]
-    op_info = []
-    for op in ops:
-        op_info.append(f"- {op.reference} ({op.get_type_display()}) Status: {op.status} Date: {op.created_at.strftime('%Y-%m-%d')}")
-
-    context_str = (
-        "DATABASE CONTEXT:\n\n"
-        "PRODUCTS & STOCK:\n" + "\n".join(product_info) + "\n\n"
-        "WAREHOUSES:\n" + "\n".join(wh_info) + "\n\n"
-        "PARTNERS:\n" + "\n".join(partner_info) + "\n\n"
-        "RECENT OPERATIONS:\n" + "\n".join(op_info)
-    )
-
-    prompt = f"System: You are a helpful assistant for a stock management system. Use the provided database context to answer the user's question accurately. If the user asks to visualize, plot, or graph data, call the create_bar_chart function.\n\n{context_str}\n\nUser: {message}"
-
-    # Define tool
-    create_chart_function = {
-        "name": "create_bar_chart",
-        "description": "Creates a bar chart given a title, labels, and corresponding values.",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "title": {
-                    "type": "string",
-                    "description": "The title for the chart.",
-                },
-                "labels": {
-                    "type": "array",
-                    "items": {"type": "string"},
-                    "description": "List of labels for the data points.",
-                },
-                "values": {
-                    "type": "array",
-                    "items": {"type": "number"},
-                    "description": "List of numerical values.",
-                },
-            },
-            "required": ["title", "labels", "values"],
-        },
-    }
-
     try:
-        client = genai.Client(api_key=api_key)
-        tools = types.Tool(function_declarations=[create_chart_function])
-        config = types.GenerateContentConfig(tools=[tools])
-        
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt,
-            config=config
-        )
-        
-        # Check for function call
-        if response.candidates and response.candidates[0].content.parts:
-            part = response.candidates[0].content.parts[0]
-            if part.function_call:
-                fc = part.function_call
-                if fc.name == 'create_bar_chart':
-                    args = fc.args
-                    title = args.get('title', 'Chart')
-                    labels = args.get('labels', [])
-                    values = args.get('values', [])
-                    
-                    # Plotting logic
-                    plt.figure(figsize=(8,4))
-                    plt.bar(labels, values, color='#704a66')
-                    plt.xticks(rotation=45, ha='right')
-                    plt.title(title)
-                    plt.tight_layout()
-                    
-                    buf = io.BytesIO()
-                    plt.savefig(buf, format='png')
-                    buf.seek(0)
-                    img_b64 = base64.b64encode(buf.read()).decode('utf-8')
-                    plt.close()
-                    
-                    reply = f'<p>Here is the chart for {title}:</p><img src="data:image/png;base64,{img_b64}" style="max-width:100%" />'
-                else:
-                    reply = "Function call not supported."
-            else:
-                reply = response.text if response.text else "No response text generated."
+        # The model fetches data through read-only tools (core.services.chat_tools)
+        result = assistant.converse(client, message)
+        if result.chart is not None:
+            reply = _chart_reply(result.chart)
         else:
-            reply = "No response from Gemini."
+            reply = result.text
 
     except Exception as e:
         reply = f"Gemini error: {str(e)}"
     return JsonResponse({'reply': reply})
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _chatbot_events(message):
+    """
+    Server-sent events for one message: "delta" events carry model text as it
+    arrives, "reply" a complete HTML reply (router answers, charts), "error" a
+    failure; "done" always comes last.
+    """
+    answer = await sync_to_async(chat_router.route)(message)
+    if answer is not None:
+        yield _sse('reply', {'reply': answer.reply, 'intent': answer.intent})
+    else:
+        client = assistant.get_async_client()
+        if client is None:
+            yield _sse('reply', {'reply': 'Gemini API key not configured.'})
+        else:
+            try:
+                async for kind, value in assistant.stream(client, message):
+                    if kind == 'text':
+                        yield _sse('delta', {'text': value})
+                    elif kind == 'chart':
+                        yield _sse('reply', {'reply': await sync_to_async(_chart_reply)(value)})
+            except Exception as e:
+                yield _sse('error', {'reply': f"Gemini error: {str(e)}"})
+    yield _sse('done', {})
+
+
+@login_required
+async def chatbot_stream(request):
+    """The chatbot as a Server-Sent Events stream; async, so a slow model does not hold a worker"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+    message = json.loads(request.body).get('message', '').lower()
+    response = StreamingHttpResponse(_chatbot_events(message), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # let nginx pass events through unbuffered
+    return response
+
+
+@login_required
+@etag(lambda request, key: key)
+def chart_image(request, key):
+    """A chatbot chart by content hash; the PNG never changes, so browsers may keep it"""
+    try:
+        png = charts.chart_png(key)
+    except charts.ChartUnavailable as e:
+        response = HttpResponse(str(e), content_type='text/plain', status=503)
+        response['Retry-After'] = '5'
+        response['Cache-Control'] = 'no-store'
+        return response
+    if png is None:
+        raise Http404("Chart not found")
+    response = HttpResponse(png, content_type='image/png')
+    response['Cache-Control'] = f'private, max-age={charts.CHART_CACHE_TIMEOUT}, immutable'
+    return response